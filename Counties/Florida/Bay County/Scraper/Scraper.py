@@ -3,16 +3,26 @@ import getopt
 import time
 import os
 import uuid
+import socket
+import requests
 from datetime import datetime
 from selenium import webdriver
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import ElementNotInteractableException, NoSuchElementException, TimeoutException
+from selenium.common.exceptions import ElementNotInteractableException, NoSuchElementException, TimeoutException, \
+    WebDriverException
 
 from captcha.CaptchaSolver import CaptchaSolver
 import utils.ScraperUtils as ScraperUtils
-from utils.ScraperUtils import Record, Charge
+import utils.BrowserProfile as BrowserProfile
+from utils.SeenCases import SeenCases
+from utils.PortalSession import PortalSession
+from utils.BrowserSupervisor import BrowserSupervisor
+import utils.WorkQueue as WorkQueue
+from utils.CaseSnapshot import CaseSnapshot, parse_record, parse_attachments
+from utils.Pipeline import Pipeline
+from utils.DeadLetters import DeadLetters
 
 settings = {
     'portal-base': 'https://court.baycoclerk.com/BenchmarkWeb2/',
@@ -23,28 +33,60 @@ settings = {
     'missing-thresh': 5,
     'collect-pii': False,
     'connect-thresh': 10,
+    'captcha-thresh': 10,
     'output': 'bay-county-scraped.csv',
     'save-attachments': 'none',
     'solve-captchas': False,
+    'headless': False,
+    'lean-browser': False,
+    'allowed-hosts': [],
+    'coordinator': None,
+    'node-id': '{}-{}'.format(socket.gethostname(), os.getpid()),
+    'lease-seconds': 300,
+    'max-browser-mb': 2048,
+    'max-browser-cases': 1000,
+    'retry-failed': False,
+    'min-search-interval': 0,
     'verbose': False
 }
 
 output_attachments = os.path.join(os.getcwd(), 'attachments')
 output_file = os.path.join(os.getcwd(), settings['output'])
 
-ffx_profile = webdriver.FirefoxOptions()
-# Automatically dismiss unexpected alerts.
-ffx_profile.set_capability('unexpectedAlertBehaviour', 'dismiss')
-driver = webdriver.Firefox(options=ffx_profile)
-captcha_solver = CaptchaSolver(driver)
+driver = None
+captcha_solver = None
+seen_cases = None
+portal_session = None
+browser_supervisor = None
+pipeline = None
+dead_letters = None
+
+
+def start_browser():
+    """
+    Starts Firefox with the configured profile. Also used by the browser supervisor to replace the browser.
+    :return: Selenium driver
+    """
+    global driver
+    ffx_profile = BrowserProfile.build_firefox_options(settings['portal-base'], settings['headless'],
+                                                       settings['lean-browser'], settings['allowed-hosts'])
+    driver = webdriver.Firefox(options=ffx_profile)
+    if captcha_solver is not None:
+        captcha_solver.driver = driver
+    if portal_session is not None:
+        # The new browser does not have the portal session
+        portal_session.browser_restarted()
+    return driver
 
 
 def main():
     # Parse Arguments
     args = sys.argv[1:]
     short_args = 'p:s:c:y:e:t:pc:o:a:uv'
-    long_args = ['portal-base=', 'state=', 'county', 'start-year=', 'end-year=', 'missing-thresh=', 'collect-pii',
-                 'connect-thresh=', 'output=', 'save-attachments=','solve-captchas', 'verbose']
+    long_args = ['portal-base=', 'state=', 'county=', 'start-year=', 'end-year=', 'missing-thresh=', 'collect-pii',
+                 'connect-thresh=', 'output=', 'save-attachments=','solve-captchas', 'headless', 'lean-browser',
+                 'allow-host=', 'coordinator=', 'node-id=', 'lease-seconds=', 'max-browser-mb=', 'max-browser-cases=',
+                 'retry-failed', 'min-search-interval=', 'captcha-thresh=', 'verbose']
 
     try:
         args, vals = getopt.getopt(args, short_args, long_args)
@@ -64,9 +106,9 @@ def main():
             elif arg in ('-p', '--collect-pii'):
                 settings['collect-pii'] = True
             elif arg in ('-c', '--connect-thresh'):
-                settings['connect-thresh'] = val
+                settings['connect-thresh'] = int(val)
             elif arg in ('-o', '--output'):
-                if val.endswith('.csv') or val.endswith('.CSV'):
+                if val.lower().endswith(('.csv', '.csv.gz', '.csv.zst')):
                     settings['output'] = val
                 else:
                     settings['output'] = '{}.csv'.format(val)
@@ -77,6 +119,28 @@ def main():
                     raise ValueError('Invalid value {} for argument --save-attachments (-a)'.format(val))
             elif arg in ('-u', '--solve-captchas'):
                 settings['solve-captchas'] = True
+            elif arg == '--headless':
+                settings['headless'] = True
+            elif arg == '--lean-browser':
+                settings['lean-browser'] = True
+            elif arg == '--allow-host':
+                settings['allowed-hosts'].append(val)
+            elif arg == '--coordinator':
+                settings['coordinator'] = val
+            elif arg == '--node-id':
+                settings['node-id'] = val
+            elif arg == '--lease-seconds':
+                settings['lease-seconds'] = int(val)
+            elif arg == '--max-browser-mb':
+                settings['max-browser-mb'] = int(val)
+            elif arg == '--max-browser-cases':
+                settings['max-browser-cases'] = int(val)
+            elif arg == '--retry-failed':
+                settings['retry-failed'] = True
+            elif arg == '--min-search-interval':
+                settings['min-search-interval'] = float(val)
+            elif arg == '--captcha-thresh':
+                settings['captcha-thresh'] = int(val)
             elif arg in ('-v', '--verbose'):
                 settings['verbose'] = True
             else:
@@ -84,9 +148,29 @@ def main():
     except getopt.error as err:
         print("Unable to read arguments.", str(err))
 
-    global output_file
+    global output_file, captcha_solver, portal_session, browser_supervisor, pipeline, dead_letters
     output_file = os.path.join(os.getcwd(), settings['output'])
-    begin_scrape()
+    start_browser()
+    captcha_solver = CaptchaSolver(driver)
+    portal_session = PortalSession(settings['portal-base'], settings['min-search-interval'])
+    browser_supervisor = BrowserSupervisor(start_browser, settings['max-browser-mb'], settings['max-browser-cases'])
+    pipeline = start_pipeline()
+    # Cases which failed, saved to retry with --retry-failed
+    dead_letters = DeadLetters('{}.failed.sqlite'.format(output_file))
+    try:
+        if settings['retry-failed']:
+            retry_dead_letters()
+        elif settings['coordinator']:
+            begin_coordinated_scrape()
+        else:
+            begin_scrape()
+    finally:
+        try:
+            # Finish writing the cases already read, even if scraping stopped with an error
+            pipeline.close()
+            print(pipeline.report())
+        finally:
+            driver.quit()
 
 
 def begin_scrape():
@@ -94,22 +178,27 @@ def begin_scrape():
     Starts the scraping process. Continues from the last scraped record if the scraper was stopped before.
     :return:
     """
-    global driver
+    global driver, seen_cases
+
+    # Cases scraped in this run or previous runs
+    seen_cases = SeenCases('{}.seen'.format(output_file), output_file)
 
     # Find the progress of any past scraping runs to continue from then
     try:
-        last_case_number = ScraperUtils.get_last_csv_row(output_file).split(',')[3]
+        last_case_number = ScraperUtils.get_last_portal_id(output_file)
+    except FileNotFoundError:
+        # No existing scraping CSV
+        last_case_number = None
+
+    if last_case_number:
         print("Continuing from last scrape (Case number: {})".format(last_case_number))
-        last_year = 2000 + int(str(last_case_number)[:2])  # I know there's faster ways of doing this. It only runs once ;)
-        if not last_case_number.isnumeric():
-            last_case_number = last_case_number[:-4]
-        last_case = int(str(last_case_number)[-6:])
+        # PortalID is YYNNNNNN followed by the court type, eg. 19000123CFMA
+        last_year = 2000 + int(last_case_number[:2])
+        last_case = int(last_case_number[2:8])
         settings['end-year'] = last_year
         continuing = True
-    except FileNotFoundError:
-        # No existing scraping CSV
+    else:
         continuing = False
-        pass
 
     # Scrape from the most recent year to the oldest.
     for year in range(settings['end-year'], settings['start-year'], -1):
@@ -119,39 +208,195 @@ def begin_scrape():
             N = 1
 
         print("Scraping year {} from case {}".format(year, N))
-        YY = year % 100
-
-        record_missing_count = 0
-        # Increment case numbers until the threshold missing cases is met, then advance to the next year.
-        while record_missing_count < settings['missing-thresh']:
-            # Generate the case number to scrape
-            case_number = f'{YY:02}' + f'{N:06}'
-
-            search_result = search_portal(case_number)
-            if search_result:
-                record_missing_count = 0
-                # if multiple associated cases are found,
-                # scrape all of them
-                if len(search_result) > 1:
-                    for case in search_result:
-                        search_portal(case)
-                        scrape_record(case)
-                # only a single case, no multiple associated cases found
-                else:
-                    scrape_record(case_number)
-            else:
-                record_missing_count += 1
-
-            N += 1
-
+        scrape_year(year, N)
         continuing = False
 
         print("Scraping for year {} is complete".format(year))
+        print(seen_cases.summary())
+        print(portal_session.summary())
+        print(browser_supervisor.summary())
+        print(pipeline.report())
+        print(dead_letters.summary())
+
+
+def begin_coordinated_scrape():
+    """
+    Scrapes case ranges handed out by a shared work queue, so several scraper nodes can work on the same portal.
+    Progress is reported to the queue after every case, so if this node dies another node continues from the same case.
+    """
+    global seen_cases
+
+    seen_cases = SeenCases('{}.seen'.format(output_file), output_file)
+    work_queue = WorkQueue.open_work_queue(settings['coordinator'])
+    node = settings['node-id']
+    lease = settings['lease-seconds']
+
+    while True:
+        unit = work_queue.acquire(node, lease)
+        if unit is None:
+            print("No work left in the work queue")
+            break
+
+        print("Scraping year {} cases {} to {}, from case {}".format(unit['year'], unit['first_case'],
+                                                                      unit['last_case'], unit['next_case']))
+
+        def heartbeat(next_case):
+            # Only report progress once the cases are written, so another node continuing from here misses none.
+            pipeline.drain('extract', 'write')
+            # The work queue may be briefly unreachable. Only give up the unit if it stays that way.
+            return WorkQueue.with_retries(work_queue.heartbeat, unit['id'], node, next_case, lease)
+
+        try:
+            end_of_year = scrape_year(unit['year'], unit['next_case'], unit['last_case'], heartbeat)
+        except KeyboardInterrupt:
+            # Stopped, eg. by the portal scheduler. Hand the unit back now rather than once the lease expires, so another
+            # node continues from the last case reported.
+            work_queue.release(unit['id'], node, stopped=True)
+            raise
+        except BaseException:
+            # Failed. The attempt counts towards the unit's limit, so a unit which fails every node is given up on.
+            work_queue.release(unit['id'], node)
+            raise
+        if end_of_year is None:
+            print("Lease on year {} cases {} to {} was lost, moving on".format(unit['year'], unit['first_case'],
+                                                                              unit['last_case']))
+            continue
+        WorkQueue.with_retries(work_queue.complete, unit['id'], node, end_of_year)
+        print(seen_cases.summary())
+        print(portal_session.summary())
+        print(browser_supervisor.summary())
+        print(pipeline.report())
+        print(dead_letters.summary())
+
+
+def scrape_year(year, first_case, last_case=None, on_case_done=None):
+    """
+    Scrapes cases in a year, starting from first_case, until 'missing-thresh' cases in a row are missing.
+    :param year: 4-digit year
+    :param first_case: First case number to scrape
+    :param last_case: Stop after this case number. If None, continue until the end of the year.
+    :param on_case_done: Called with the next case number after each case. If it returns False, scraping stops.
+    :return: True if the end of the year was found, False if last_case was reached first. None if on_case_done stopped
+    scraping.
+    """
+    global driver
+    YY = year % 100
+    N = first_case
+    record_missing_count = 0
+    # Increment case numbers until the threshold missing cases is met, then advance to the next year.
+    while record_missing_count < settings['missing-thresh']:
+        if last_case is not None and N > last_case:
+            return False
+
+        # Generate the case number to scrape
+        case_number = f'{YY:02}' + f'{N:06}'
+        # If the browser has to be restarted part way through, the case is retried from the start in the new browser
+        try:
+            with pipeline.busy('browser'):
+                found, driver = browser_supervisor.run_case(driver, lambda: scrape_case_number(case_number))
+        except (RuntimeError, WebDriverException) as err:
+            # Still failing after the browser was restarted. Save it to retry later, and move on.
+            print('Could not scrape case {}, saved to retry later: {}'.format(case_number, err), file=sys.stderr)
+            dead_letters.add(case_number, str(err), browser_supervisor.max_retries + 1)
+            # Neither found nor missing, so it does not count towards the end of the year
+            found = None
+        if found:
+            record_missing_count = 0
+        elif found is not None:
+            record_missing_count += 1
+
+        N += 1
+        if on_case_done is not None and not on_case_done(N):
+            return None
+    return True
+
+
+def retry_dead_letters():
+    """
+    Retry pass: scrapes cases which failed in earlier runs, waiting until each is due to be retried. Pages are given
+    twice as many attempts to load as in the main crawl. Cases which fail again are retried after a longer wait, until
+    they have failed too many times.
+    Retried cases are written to a separate output (eg. bay-county-scraped.retried.csv), as they are from earlier years
+    than the end of the main output, which the main crawl continues from.
+    """
+    global driver, seen_cases, output_file
+    seen_cases = SeenCases('{}.seen'.format(output_file), output_file)
+    output_file = ScraperUtils.output_variant(output_file, 'retried')
+    print("Writing retried cases to {}".format(output_file))
+    settings['connect-thresh'] = settings['connect-thresh'] * 2
+    print(dead_letters.summary())
+
+    while True:
+        letter = dead_letters.next_letter()
+        if letter is None:
+            break
+        wait = letter['next_retry'] - time.time()
+        if wait > 0:
+            print("Waiting {:.0f}s to retry case {}".format(wait, letter['case_number']))
+            time.sleep(wait)
+
+        case_number = letter['case_number']
+        print("Retrying case {} (failed {} times)".format(case_number, letter['failures']))
+        try:
+            with pipeline.busy('browser'):
+                found, driver = browser_supervisor.run_case(driver, lambda: scrape_case_number(case_number))
+        except (RuntimeError, WebDriverException) as err:
+            status = dead_letters.add(case_number, str(err), browser_supervisor.max_retries + 1)
+            print('Case {} failed again ({}): {}'.format(case_number, status, err), file=sys.stderr)
+            continue
+        # Only resolved once every case the search found has been written
+        pipeline.drain('extract', 'write')
+        if seen_cases.search_written(case_number):
+            dead_letters.resolve(case_number)
+        else:
+            reason = 'Cases found were not written' if found else 'No case found'
+            status = dead_letters.add(case_number, reason, browser_supervisor.max_retries + 1)
+            print('Case {} failed again ({}): {}'.format(case_number, status, reason), file=sys.stderr)
+
+    print(dead_letters.summary())
+
+
+def scrape_case_number(case_number):
+    """
+    Searches for a case number and scrapes every case found.
+    :param case_number: Case number to search, eg. '19000123'
+    :return: True if any cases were found (or were already scraped), False if the case number is missing.
+    """
+    if seen_cases.search_done(case_number):
+        # Every case this search found before has already been scraped.
+        return True
+
+    search_result = search_portal(case_number)
+    if not search_result:
+        return False
+    # The search can be skipped next time, once every case it found has been scraped
+    seen_cases.add_search(case_number, search_result)
+
+    # if multiple associated cases are found,
+    # scrape all of them
+    if len(search_result) > 1:
+        for case, case_link in search_result.items():
+            if seen_cases.scrape_done(case):
+                continue
+            if case_link:
+                # Open the case straight from the link in the search results, in the same session.
+                # This avoids another search and captcha for every associated case.
+                load_page(case_link, case, settings['verbose'])
+            else:
+                search_portal(case)
+            scrape_record(case)
+    # only a single case, no multiple associated cases found
+    else:
+        case = next(iter(search_result))
+        if not seen_cases.scrape_done(case):
+            scrape_record(case)
+    return True
 
 
 def scrape_record(case_number):
     """
-    Scrapes a record once the case has been opened.
+    Reads a record once the case has been opened. The case page and the defendant's party details page are taken from
+    the browser, and queued to be parsed, written and have their attachments downloaded in other threads.
     :param case_number: The current case's case number.
     """
     # Wait for court summary to load
@@ -164,11 +409,6 @@ def scrape_record(case_number):
             else:
                 driver.refresh()
 
-    # Get relevant page content
-    summary_table_col1 = driver.find_elements_by_xpath('//*[@id="summaryAccordionCollapse"]/table/tbody/tr/td[1]/dl/dd')
-    summary_table_col2 = driver.find_elements_by_xpath('//*[@id="summaryAccordionCollapse"]/table/tbody/tr/td[2]/dl/dd')
-    summary_table_col3 = driver.find_elements_by_xpath('//*[@id="summaryAccordionCollapse"]/table/tbody/tr/td[3]/dl/dd')
-
     # Wait for court dockets to load
     for i in range(settings['connect-thresh']):
         try:
@@ -179,132 +419,100 @@ def scrape_record(case_number):
             else:
                 driver.refresh()
 
-    charges_table = driver.find_elements_by_xpath('//*[@id="gridCharges"]/tbody/tr')
-    docket_public_defender = driver.find_elements_by_xpath(
-        "//*[contains(text(), 'COURT APPOINTED ATTORNEY') and contains(text(), 'ASSIGNED')]")
-    docket_attorney = driver.find_elements_by_xpath("//*[contains(text(), 'DEFENSE') and contains(text(), 'ASSIGNED')]")
-    docket_pleas = driver.find_elements_by_xpath("//*[contains(text(), 'PLEA OF')]")
-    docket_attachments = driver.find_elements_by_class_name('casedocketimage')
-
-    _id = str(uuid.uuid4())
-    _state = settings['state-code']
-    _county = settings['county']
-    CaseNum = summary_table_col2[1].text.strip()
-    AgencyReportNum = summary_table_col1[4].text.strip()
-    ArrestDate = None  # Can't be found on this portal
-    FilingDate = summary_table_col1[2].text.strip()
-    OffenseDate = None  # Can't be found on this portal
-    DivisionName = summary_table_col3[3].text.strip()
-    CaseStatus = summary_table_col3[1].text.strip()
-
-    if settings['collect-pii']:
-        # Create list of assigned defense attorney(s)
-        defense_attorney_text = list(map(lambda x: x.text, docket_attorney))
-        DefenseAttorney = ScraperUtils.parse_attorneys(defense_attorney_text)
-        # Create list of assigned public defenders / appointed attorneys
-        public_defender_text = list(map(lambda x: x.text, docket_public_defender))
-        PublicDefender = ScraperUtils.parse_attorneys(public_defender_text)
-        # Get Judge
-        Judge = summary_table_col1[0].text.strip()
-
-        # Download docket attachments.
-        # Todo(OscarVanL): This could be parallelized to speed up scraping if save-attachments is set to 'all'.
-        if settings['save-attachments']:
-            for attachment_link in docket_attachments:
-                attachment_text = attachment_link.find_element_by_xpath('./../../td[3]').text.strip()
-                if settings['save-attachments'] == 'filing':
-                    if not ('CITATION FILED' in attachment_text or 'CASE FILED' in attachment_text):
-                        # Attachment is not a filing, don't download it.
-                        continue
-                ScraperUtils.save_attached_pdf(driver, output_attachments, '{}-{}'.format(case_number, attachment_text),
-                                               settings['portal-base'], attachment_link, 20, settings['verbose'])
-    else:
-        DefenseAttorney = []
-        PublicDefender = []
-        Judge = None
-
-    Charges = {}
-    for charge in charges_table:
-        charge_details = charge.find_elements_by_tag_name('td')
-        count = int(charge_details[0].text.strip())
-        long_desc = charge_details[1].text.strip()
-        # Statute is contained within brackets
-        if '(' in long_desc and ')' in long_desc:
-            statute = long_desc[long_desc.find('(') + 1:long_desc.find(')')]
-        else:
-            statute = None
-        description = long_desc.split('(')[0]
-        level = charge_details[2].text.strip()
-        degree = charge_details[3].text.strip()
-        # plea = charge_details[4].text.strip() # Plea is not filled out on this portal.
-        disposition = charge_details[5].text.strip()
-        disposition_date = charge_details[6].text.strip()
-        offense_date = None  # Not shown on this portal
-        citation_number = None  # Not shown on this portal
-        Charges[count] = Charge(count, statute, description, level, degree, disposition, disposition_date, offense_date,
-                                citation_number, None, None)
-
-    # Pleas are not in the 'plea' field, but instead in the dockets.
-    for plea_element in docket_pleas:
-        plea_text = plea_element.text.strip()
-        plea = ScraperUtils.parse_plea_type(plea_text)
-        plea_date = plea_element.find_element_by_xpath('./../td[2]').text.strip()
-        plea_number = ScraperUtils.parse_plea_case_numbers(plea_text, list(Charges.keys()))
-
-        # If no case number is specified in the plea, then we assume it applies to all charges in the trial.
-        if len(plea_number) == 0:
-            for charge in Charges.values():
-                charge.plea = plea
-                charge.plea_date = plea_date
-        else:
-            # Apply plea to relevant charge count(s).
-            for count in plea_number:
-                Charges[count].plea = plea
-                Charges[count].plea_date = plea_date
+    case_url = driver.current_url
+    case_html = driver.page_source
 
-    ArrestingOfficer = None  # Can't be found on this portal
-    ArrestingOfficerBadgeNumber = None  # Can't be found on this portal
+    # Docket attachments are downloaded with the browser's cookies, outside of the browser.
+    http_session = None
+    javascript_time = None
+    if settings['collect-pii'] and settings['save-attachments'] != 'none':
+        http_session = portal_session.get_http_session(driver)
+        javascript_time = driver.execute_script('return String(new Date())')
 
     profile_link = driver.find_element_by_xpath("//table[@id='gridParties']/tbody/tr/*[contains(text(), 'DEFENDANT')]/../td[2]/div/a").get_attribute(
        'href')
-    # profile_link = driver.find_element_by_xpath('//*[@id="gridParties"]/tbody/tr[1]/td[2]/div[1]/a').get_attribute(
-    #     'href')
     load_page(profile_link, 'Party Details:', settings['verbose'])
 
-    Suffix = None
-    DOB = None  # This portal has DOB as N/A for every defendent
-    Race = driver.find_element_by_xpath(
-        '//*[@id="fd-table-2"]/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody/tr[7]/td[2]').text.strip()
-    Sex = driver.find_element_by_xpath(
-        '//*[@id="mainTableContent"]/tbody/tr/td/table/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody/tr[6]/td[2]').text.strip()
-    FirstName = None
-    MiddleName = None
-    LastName = None
-    PartyID = None
-
-    # Only collect PII if configured
+    snapshot = CaseSnapshot(case_number, case_url, case_html, driver.page_source, http_session, javascript_time)
+    # Not scraped again while it waits to be written
+    seen_cases.add_pending(case_number)
+    pipeline.put('extract', snapshot)
+
+
+def extract_record(snapshot):
+    """
+    Pipeline stage: parses a case from its pages, and queues it to be written and its attachments downloaded.
+    :param snapshot: CaseSnapshot taken by scrape_record
+    """
+    record = parse_record(snapshot, settings['state-code'], settings['county'], settings['collect-pii'],
+                          str(uuid.uuid4()))
+    pipeline.put('write', record)
     if settings['collect-pii']:
-        # Navigate to party profile
-        full_name = driver.find_element_by_xpath(
-            '//*[@id="mainTableContent"]/tbody/tr/td/table/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody/tr[1]/td[2]').text.strip()
-        MiddleName = None
-        LastName = None
-        if ',' in full_name:
-            name_split = full_name.split(',')[1].lstrip().split()
-            FirstName = name_split[0]
-            MiddleName = " ".join(name_split[1:])
-            LastName = full_name.split(',')[0]
-        else:
-            # If there's no comma, it's a corporation name.
-            FirstName = full_name
-        PartyID = driver.find_element_by_xpath(
-            '//*[@id="mainTableContent"]/tbody/tr/td/table/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody/tr[8]/td[2]').text.strip()  # PartyID is a field within the portal system to uniquely identify defendants
-
-    record = Record(_id, _state, _county, case_number, CaseNum, AgencyReportNum, PartyID, FirstName, MiddleName,
-                    LastName, Suffix, DOB, Race, Sex, ArrestDate, FilingDate, OffenseDate, DivisionName, CaseStatus,
-                    DefenseAttorney, PublicDefender, Judge, list(Charges.values()), ArrestingOfficer,
-                    ArrestingOfficerBadgeNumber)
+        # Download docket attachments.
+        for attachment in parse_attachments(snapshot, settings['save-attachments']):
+            pipeline.put('download', (snapshot, attachment))
+
+
+def write_record(record):
+    """
+    Pipeline stage: writes a record to the output CSV.
+    :param record: Record
+    """
     ScraperUtils.write_csv(output_file, record, settings['verbose'])
+    seen_cases.add(record.portal_id)
+
+
+def download_attachment(item):
+    """
+    Pipeline stage: downloads a docket attachment.
+    :param item: (CaseSnapshot, Attachment)
+    """
+    snapshot, attachment = item
+    ScraperUtils.download_attached_pdf(snapshot.http_session, output_attachments, attachment.name,
+                                       settings['portal-base'], attachment.cid, attachment.digest, snapshot.case_url,
+                                       snapshot.javascript_time, 20, settings['verbose'], portal_session)
+
+
+def is_infrastructure_error(err):
+    """
+    :return: True if the error would fail every case, not only the one which raised it (eg. the disk is full), so the
+    crawl should stop. Network errors while downloading are per case.
+    """
+    return isinstance(err, (OSError, MemoryError)) and not isinstance(err, requests.RequestException)
+
+
+def dead_letter_case(stage, portal_id, err):
+    """
+    Saves a case which failed in a pipeline stage to retry later (with --retry-failed), so the crawl continues.
+    :param stage: Name of the pipeline stage
+    :param portal_id: PortalID of the case, eg. '19000123CFMA'
+    :return: True if the error was handled. False if it is an infrastructure error, which stops the crawl.
+    """
+    if is_infrastructure_error(err):
+        return False
+    # Scraped again if it is found again in this run
+    seen_cases.discard_pending(portal_id)
+    status = dead_letters.add(portal_id, 'Pipeline stage {} failed: {!r}'.format(stage, err))
+    print('Case {} failed in {}, saved to retry later ({})'.format(portal_id, stage, status), file=sys.stderr)
+    return True
+
+
+def start_pipeline():
+    """
+    Starts the threads which parse, write and download cases read by the browser.
+    Records are parsed and written by one thread each, so they are written in the order they were read, and resuming
+    from the last record written does not skip any. A case which fails in a stage is saved to the dead letters.
+    :return: Pipeline
+    """
+    scrape_pipeline = Pipeline()
+    scrape_pipeline.add_source('browser')
+    scrape_pipeline.add_stage('extract', extract_record, workers=1, queue_size=8,
+                              on_error=lambda snapshot, err: dead_letter_case('extract', snapshot.case_number, err))
+    scrape_pipeline.add_stage('write', write_record, workers=1, queue_size=32,
+                              on_error=lambda record, err: dead_letter_case('write', record.portal_id, err))
+    scrape_pipeline.add_stage('download', download_attachment, workers=2, queue_size=32,
+                              on_error=lambda item, err: dead_letter_case('download', item[0].case_number, err))
+    return scrape_pipeline
 
 
 def search_portal(case_number):
@@ -312,8 +520,82 @@ def search_portal(case_number):
     Performs a search of the portal from its home page, including selecting the case number input, solving the captcha
     and pressing Search. Also handles the captcha being solved incorrectly
     :param case_number: Case to search
-    :return: A set of case number(s).
+    :return: A dict of case number(s) found to the URL of each case's details page.
+    """
+    if not settings['solve-captchas']:
+        raise Exception("Automated captcha solving is disabled by default. Please seek advice before using this feature.")
+
+    # The search is started again after a timeout, up to 'connect-thresh' times, or after the captcha is rejected, up to
+    # 'captcha-thresh' times.
+    timeouts = 0
+    captcha_failures = 0
+    while True:
+        captcha_attempted = start_search(case_number)
+
+        # If the title stays as 'Search': Captcha solving failed
+        # If the title contains the case number or 'Search Results': Captcha solving succeeded
+        try:
+            # Wait for page to load
+            WebDriverWait(driver, 5).until(
+                lambda x: 'Search' in driver.title or case_number in driver.title or 'Search Results:' in driver.title)
+        except TimeoutException:
+            timeouts += 1
+            if timeouts >= settings['connect-thresh']:
+                raise RuntimeError('Case page could not be loaded after {} attempts, or unexpected page title: {}'.format(settings['connect-thresh'], driver.title))
+            continue
+
+        # Page loaded
+        if driver.title == 'Search':
+            # Clicking search did not change the page. This could be because of a failed captcha attempt.
+            try:
+                # Check if 'Invalid Captcha' dialog is showing
+                driver.find_element_by_xpath(
+                    '//div[@class="alert alert-error"]')
+                print("Captcha was solved incorrectly")
+                captcha_solver.notify_last_captcha_fail()
+                # The portal does not present a new captcha on refresh, so clear the session to get a new one.
+                portal_session.captcha_rejected(driver)
+                captcha_failures += 1
+                if captcha_failures >= settings['captcha-thresh']:
+                    raise RuntimeError('Captcha was rejected {} times in a row'.format(captcha_failures))
+            except NoSuchElementException:
+                timeouts += 1
+                if timeouts >= settings['connect-thresh']:
+                    raise RuntimeError('Search for case {} did not load after {} attempts'.format(
+                        case_number, settings['connect-thresh']))
+            # Try the search again.
+            continue
+        elif 'Search Results: CaseNumber:' in driver.title:
+            search_succeeded(captcha_attempted)
+            # Figure out the numer of cases returned
+            case_detail_tbl = driver.find_element_by_tag_name('table').text.split('\n')
+            case_count_idx = case_detail_tbl.index('CASES FOUND') + 1
+            case_count = int(case_detail_tbl[case_count_idx])
+            # Case number search found multiple cases.
+            if case_count > 1:
+                return ScraperUtils.get_associated_cases(driver)
+            # Case number search found no cases
+            else:
+                return {}
+        elif case_number in driver.title:
+            search_succeeded(captcha_attempted)
+            # Case number search did find a single court case.
+            return {case_number: driver.current_url}
+        else:
+            # An unexpected page, eg. an error page. Start again from the search page.
+            timeouts += 1
+            if timeouts >= settings['connect-thresh']:
+                raise RuntimeError('Case page could not be loaded after {} attempts, or unexpected page title: {}'.format(settings['connect-thresh'], driver.title))
+
+
+def start_search(case_number):
+    """
+    Enters a case number on the portal's search page, solves the captcha if there is one, and presses Search.
+    :param case_number: Case to search
+    :return: True if a captcha was solved for this search
     """
+    # Keep within the portal's rate budget
+    portal_session.pace_search()
     # Load portal search page
     load_page(f"{settings['portal-base']}/Home.aspx/Search", 'Search', settings['verbose'])
     # Give some time for the captcha to load, as it does not load instantly.
@@ -325,74 +607,36 @@ def search_portal(case_number):
     case_input.click()
     case_input.send_keys(case_number)
 
-    if settings['solve-captchas']:
-        # Solve captcha if it is required
-        try:
-            # Get Captcha
-            captcha_image_elem = driver.find_element_by_xpath(
-                '//*/img[@alt="Captcha"]')
-            captcha_buffer = captcha_image_elem.screenshot_as_png
-            captcha_answer = captcha_solver.solve_captcha(captcha_buffer)
-            captcha_textbox = driver.find_element_by_xpath(
-                '//*/input[@name="captcha"]')
-            captcha_textbox.click()
-            captcha_textbox.send_keys(captcha_answer)
-        except NoSuchElementException:
-            # No captcha on the page, continue.
-            pass
-
-        # Do search
-        search_button = driver.find_element_by_id('searchButton')
-        search_button.click()
-    else:
-        raise Exception("Automated captcha solving is disabled by default. Please seek advice before using this feature.")
-
-    # If the title stays as 'Search': Captcha solving failed
-    # If the title contains the case number or 'Search Results': Captcha solving succeeded
-    # If a timeout occurs, retry 'connect-thresh' times.
-    for i in range(settings['connect-thresh']):
-        try:
-            # Wait for page to load
-            WebDriverWait(driver, 5).until(
-                lambda x: 'Search' in driver.title or case_number in driver.title or 'Search Results:' in driver.title)
-            # Page loaded
-            if driver.title == 'Search':
-                # Clicking search did not change the page. This could be because of a failed captcha attempt.
-                try:
-                    # Check if 'Invalid Captcha' dialog is showing
-                    driver.find_element_by_xpath(
-                        '//div[@class="alert alert-error"]')
-                    print("Captcha was solved incorrectly")
-                    captcha_solver.notify_last_captcha_fail()
-                except NoSuchElementException:
-                    pass
-                # Clear cookies so a new captcha is presented upon refresh
-                driver.delete_all_cookies()
-                # Try solving the captcha again.
-                search_portal(case_number)
-            elif 'Search Results: CaseNumber:' in driver.title:
-                # Captcha solved correctly
-                captcha_solver.notify_last_captcha_success()
-                # Figure out the numer of cases returned
-                case_detail_tbl = driver.find_element_by_tag_name('table').text.split('\n')
-                case_count_idx = case_detail_tbl.index('CASES FOUND') + 1
-                case_count = int(case_detail_tbl[case_count_idx])
-                # Case number search found multiple cases.
-                if case_count > 1:
-                    return ScraperUtils.get_associated_cases(driver)
-                # Case number search found no cases
-                else:
-                    return set()
-            elif case_number in driver.title:
-                # Captcha solved correctly
-                captcha_solver.notify_last_captcha_success()
-                # Case number search did find a single court case.
-                return {case_number}
-        except TimeoutException:
-            if i == settings['connect-thresh'] - 1:
-                raise RuntimeError('Case page could not be loaded after {} attempts, or unexpected page title: {}'.format(settings['connect-thresh'], driver.title))
-            else:
-                search_portal(case_number)
+    # Only solve a captcha if the portal asks for one. Once solved, the session is reused for as many searches as the
+    # portal allows.
+    captcha_attempted = portal_session.captcha_required(driver)
+    if captcha_attempted:
+        # Get Captcha
+        captcha_image_elem = driver.find_element_by_xpath(
+            '//*/img[@alt="Captcha"]')
+        captcha_buffer = BrowserProfile.get_captcha_png(driver, captcha_image_elem, settings['lean-browser'])
+        captcha_answer = captcha_solver.solve_captcha(captcha_buffer) if captcha_buffer else 0
+        captcha_textbox = driver.find_element_by_xpath(
+            '//*/input[@name="captcha"]')
+        captcha_textbox.click()
+        captcha_textbox.send_keys(captcha_answer)
+
+    # Do search
+    search_button = driver.find_element_by_id('searchButton')
+    search_button.click()
+    return captcha_attempted
+
+
+def search_succeeded(captcha_attempted):
+    """
+    Records a search which reached the results, or a case.
+    :param captcha_attempted: True if a captcha was solved for this search
+    """
+    if captcha_attempted:
+        # Captcha solved correctly
+        captcha_solver.notify_last_captcha_success()
+        portal_session.captcha_solved()
+    portal_session.search_succeeded()
 
 
 def select_case_input():
@@ -0,0 +1,249 @@
+import os
+import sys
+import csv
+import json
+import zlib
+import struct
+import getopt
+import zipfile
+
+from analysis.StreamingAggregator import parse_year
+from utils import CompressedCsv
+
+INDEX_MAGIC = b'PDAPIDX1'
+SEGMENT_HEADER = struct.Struct('<Q')
+
+# Indexed fields, and the column each is read from. Fields whose column is missing from the CSV are skipped,
+# eg. the felonies dataset has no PortalID.
+INDEXED_FIELDS = {
+    'statute': 'ChargeStatute',
+    'case': 'PortalID',
+    'year': 'FilingDate',
+    'disposition': 'ChargeDisposition',
+}
+
+
+def iter_rows_with_offsets(stream):
+    """
+    Reads complete CSV rows from a binary stream along with the byte offset each row starts at.
+    A row can span several lines if a quoted field contains a newline. A torn row at the end of the stream (eg. from a
+    crash part way through a write) is not returned.
+    :param stream: Binary file object, positioned at the start of a row
+    :return: Generator of (offset, row bytes)
+    """
+    offset = stream.tell()
+    row = b''
+    for line in iter(stream.readline, b''):
+        row += line
+        if row.count(b'"') % 2 == 1 or not row.endswith(b'\n'):
+            # Inside a quoted field, or the last line of the file is incomplete
+            continue
+        yield offset, row
+        offset += len(row)
+        row = b''
+
+
+def statute_matches(statute, prefix):
+    """
+    Checks if a statute falls under a statute prefix. '812' and '812.014' match '812.014(2C1)', but '812.01' does not.
+    :param statute: Statute as written in the CSV
+    :param prefix: Statute chapter, section or full statute
+    :return: True if matching
+    """
+    if not statute.startswith(prefix):
+        return False
+    return len(statute) == len(prefix) or not statute[len(prefix)].isdigit()
+
+
+class CsvIndex:
+    """
+    On-disk index of row byte offsets in a scraped output CSV (or the extracted felonies CSV), grouped by statute,
+    portal case number, filing year and disposition.
+
+    The index file is a list of segments, each covering a byte range of the CSV. Updating the index only scans rows
+    appended since the last segment and adds a new segment, so the existing index is never rewritten.
+    """
+
+    def __init__(self, csv_file, index_file=None):
+        if zipfile.is_zipfile(csv_file):
+            raise ValueError('Cannot index a zipped CSV, as rows cannot be read by offset. Extract it first.')
+        if CompressedCsv.compression_for(csv_file):
+            raise ValueError('Cannot index a compressed CSV, as rows cannot be read by offset. Decompress it first.')
+        self.csv_file = csv_file
+        self.index_file = index_file or '{}.idx'.format(csv_file)
+        self.header = None
+        self.indexed_size = 0
+        self.postings = {field: {} for field in INDEXED_FIELDS}
+        if os.path.isfile(self.index_file):
+            self.__load__()
+
+    def __load__(self):
+        with open(self.index_file, 'rb') as f:
+            if f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                raise ValueError('{} is not a CSV index file'.format(self.index_file))
+            while True:
+                length = f.read(SEGMENT_HEADER.size)
+                if len(length) < SEGMENT_HEADER.size:
+                    break
+                payload = f.read(SEGMENT_HEADER.unpack(length)[0])
+                segment = json.loads(zlib.decompress(payload).decode('utf-8'))
+                self.__add_segment__(segment)
+
+    def __add_segment__(self, segment):
+        if segment['start'] != self.indexed_size:
+            raise ValueError('Index file {} has a gap at byte {}'.format(self.index_file, self.indexed_size))
+        self.header = segment['header']
+        self.indexed_size = segment['end']
+        for field, keys in segment['postings'].items():
+            field_postings = self.postings[field]
+            for key, deltas in keys.items():
+                # Offsets are stored as deltas from the previous offset, which compresses well.
+                offsets = field_postings.setdefault(key, [])
+                offset = 0
+                for delta in deltas:
+                    offset += delta
+                    offsets.append(offset)
+
+    def update(self):
+        """
+        Indexes rows appended to the CSV since the index was last updated. Rebuilds the index if the CSV has shrunk.
+        :return: Number of rows indexed
+        """
+        csv_size = os.path.getsize(self.csv_file)
+        if csv_size < self.indexed_size:
+            # CSV was replaced or truncated, the existing index is invalid.
+            os.remove(self.index_file)
+            self.header = None
+            self.indexed_size = 0
+            self.postings = {field: {} for field in INDEXED_FIELDS}
+        if csv_size == self.indexed_size:
+            return 0
+
+        rows = 0
+        with open(self.csv_file, 'rb') as f:
+            start = self.indexed_size
+            if self.header is None:
+                header_line = f.readline()
+                self.header = next(csv.reader([header_line.decode('utf-8-sig')]))
+            else:
+                f.seek(start)
+            columns = {field: self.header.index(col) for field, col in INDEXED_FIELDS.items() if col in self.header}
+            postings = {field: {} for field in columns}
+            end = f.tell()
+
+            last_offsets = {}
+            for offset, row_bytes in iter_rows_with_offsets(f):
+                end = offset + len(row_bytes)
+                row = next(csv.reader([row_bytes.decode('utf-8')]), [])
+                if len(row) < len(self.header):
+                    continue
+                rows += 1
+                for field, col in columns.items():
+                    key = row[col].strip()
+                    if field == 'year':
+                        key = parse_year(key)
+                    if not key:
+                        continue
+                    deltas = postings[field].setdefault(key, [])
+                    deltas.append(offset - last_offsets.get((field, key), 0))
+                    last_offsets[(field, key)] = offset
+
+        if end == start:
+            # Only a torn row has been appended so far.
+            return 0
+        segment = {'start': start, 'end': end, 'header': self.header, 'postings': postings}
+        payload = zlib.compress(json.dumps(segment, separators=(',', ':')).encode('utf-8'))
+        new_file = not os.path.isfile(self.index_file)
+        with open(self.index_file, 'ab') as f:
+            if new_file:
+                f.write(INDEX_MAGIC)
+            f.write(SEGMENT_HEADER.pack(len(payload)))
+            f.write(payload)
+        self.__add_segment__(segment)
+        return rows
+
+    def keys(self, field):
+        """
+        :param field: One of INDEXED_FIELDS
+        :return: Sorted list of indexed values for the field
+        """
+        return sorted(self.postings[field])
+
+    def offsets(self, statute=None, case=None, year=None, disposition=None):
+        """
+        Finds the byte offsets of rows matching all of the given criteria.
+        :param statute: Statute prefix, eg. '812', '812.014' or '812.014(2C1)'
+        :param case: Portal case number (PortalID)
+        :param year: 4-digit filing year, as str or int
+        :param disposition: Charge disposition, eg. 'NOLLE PROSSE'
+        :return: Sorted list of byte offsets
+        """
+        matches = None
+        criteria = {'case': case, 'year': None if year is None else str(year), 'disposition': disposition}
+        for field, key in criteria.items():
+            if key is None:
+                continue
+            found = set(self.postings[field].get(key, []))
+            matches = found if matches is None else matches & found
+        if statute is not None:
+            found = set()
+            for key, offsets in self.postings['statute'].items():
+                if statute_matches(key, statute):
+                    found.update(offsets)
+            matches = found if matches is None else matches & found
+        if matches is None:
+            raise ValueError('At least one search criteria must be given')
+        return sorted(matches)
+
+    def query(self, **criteria):
+        """
+        Reads rows matching all of the given criteria by seeking straight to them. See offsets() for criteria.
+        :return: List of rows, each a list of str in the same order as self.header
+        """
+        results = []
+        with open(self.csv_file, 'rb') as f:
+            for offset in self.offsets(**criteria):
+                f.seek(offset)
+                row_bytes = next(iter_rows_with_offsets(f))[1]
+                results.append(next(csv.reader([row_bytes.decode('utf-8')])))
+        return results
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'i:s:n:y:d:'
+    long_args = ['index=', 'statute=', 'case=', 'year=', 'disposition=']
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    if len(paths) != 1:
+        print('Usage: python -m analysis.CsvIndex [-i index-file] [-s statute] [-n case] [-y year] [-d disposition] '
+              'input.csv', file=sys.stderr)
+        sys.exit(2)
+
+    index_file = None
+    criteria = {}
+    for arg, val in opts:
+        if arg in ('-i', '--index'):
+            index_file = val
+        elif arg in ('-s', '--statute'):
+            criteria['statute'] = val
+        elif arg in ('-n', '--case'):
+            criteria['case'] = val
+        elif arg in ('-y', '--year'):
+            criteria['year'] = val
+        elif arg in ('-d', '--disposition'):
+            criteria['disposition'] = val
+
+    index = CsvIndex(paths[0], index_file)
+    print('Indexed {} new rows'.format(index.update()), file=sys.stderr)
+    if criteria:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(index.header)
+        writer.writerows(index.query(**criteria))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import os
+import zipfile
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.compute as pc
+
+# felonies_13-19.zip lives at the root of the repository, alongside the Counties folder.
+DEFAULT_FELONIES_ZIP = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..', 'felonies_13-19.zip'))
+
+FELONIES_COLUMNS = ['Race', 'Sex', 'ArrestDate', 'FilingDate', 'OffenseDate', 'DivisionName', 'CaseStatus',
+                    'ChargeCount', 'ChargeStatute', 'ChargeDescription', 'ChargeDisposition', 'ChargeDispositionDate',
+                    'ChargeOffenseDate', 'ChargeCitationNum', 'ChargePlea', 'ChargePleaDate']
+
+DATE_COLUMNS = ['ArrestDate', 'FilingDate', 'OffenseDate', 'ChargeDispositionDate', 'ChargeOffenseDate',
+                'ChargePleaDate']
+
+# Low-cardinality columns. These are stored as integer codes into a single table of unique strings.
+CATEGORY_COLUMNS = ['Race', 'Sex', 'DivisionName', 'CaseStatus', 'ChargeStatute', 'ChargeDisposition', 'ChargePlea']
+
+# The portal fills empty fields with a (non-breaking) space rather than leaving them empty.
+BLANK_VALUES = ['', ' ', '\xa0', '\xa0\xa0']
+
+DATE_FORMAT = '%m/%d/%Y'
+
+
+def open_zipped_csv(zip_path, member=None):
+    """
+    Opens a CSV inside a zip archive as a binary stream, without extracting it to disk.
+    :param zip_path: Path to the zip archive
+    :param member: Name of the CSV within the archive. Defaults to the first .csv file found.
+    :return: Binary file object. The caller is responsible for closing it.
+    """
+    with zipfile.ZipFile(zip_path) as archive:
+        if member is None:
+            csv_members = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+            if len(csv_members) == 0:
+                raise ValueError('No CSV file found in {}'.format(zip_path))
+            member = csv_members[0]
+        # The member stream keeps its own reference to the zip file, so it outlives the archive handle.
+        return archive.open(member)
+
+
+def load_felonies_table(path=DEFAULT_FELONIES_ZIP, member=None, columns=None):
+    """
+    Loads the felonies dataset into an Arrow table with typed columns.
+    Blank fields become nulls, dates become timestamp columns, and low-cardinality text becomes dictionary encoded.
+    The trailing unnamed columns in the CSV are dropped.
+    :param path: Path to felonies_13-19.zip, or to an already extracted CSV.
+    :param member: Name of the CSV within the zip archive. Defaults to the first .csv file found.
+    :param columns: Subset of FELONIES_COLUMNS to load. Defaults to all of them.
+    :return: pyarrow Table
+    """
+    columns = columns or FELONIES_COLUMNS
+    unknown = set(columns) - set(FELONIES_COLUMNS)
+    if unknown:
+        raise ValueError('Unknown felonies column(s): {}'.format(', '.join(sorted(unknown))))
+
+    column_types = {}
+    for col in columns:
+        if col in CATEGORY_COLUMNS:
+            column_types[col] = pa.dictionary(pa.int32(), pa.string())
+        elif col == 'ChargeCount':
+            column_types[col] = pa.uint16()
+        else:
+            # Dates are read as text first, as pyarrow would otherwise fail the whole load on a single bad date.
+            column_types[col] = pa.string()
+    convert_options = pa_csv.ConvertOptions(include_columns=columns, column_types=column_types,
+                                            null_values=BLANK_VALUES, strings_can_be_null=True)
+
+    if zipfile.is_zipfile(path):
+        source = open_zipped_csv(path, member)
+    else:
+        source = open(path, 'rb')
+    with source:
+        table = pa_csv.read_csv(source, convert_options=convert_options)
+
+    # A few rows have unquoted commas in the charge description, which shifts text into the date columns.
+    # These values become nulls.
+    for col in DATE_COLUMNS:
+        if col in columns:
+            dates = pc.strptime(table[col], format=DATE_FORMAT, unit='s', error_is_null=True)
+            table = table.set_column(table.schema.get_field_index(col), col, dates)
+
+    return table
+
+
+def load_felonies(path=DEFAULT_FELONIES_ZIP, member=None, columns=None):
+    """
+    Loads the felonies dataset into a pandas DataFrame. See load_felonies_table for how columns are typed.
+    Dictionary encoded columns become pandas categoricals, and dates become datetime64 columns.
+    :param path: Path to felonies_13-19.zip, or to an already extracted CSV.
+    :param member: Name of the CSV within the zip archive. Defaults to the first .csv file found.
+    :param columns: Subset of FELONIES_COLUMNS to load. Defaults to all of them.
+    :return: pandas DataFrame
+    """
+    return load_felonies_table(path, member, columns).to_pandas()
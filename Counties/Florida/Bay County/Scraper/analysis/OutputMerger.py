@@ -0,0 +1,318 @@
+"""
+Merges scraper output CSVs into one sorted file with only the newest version of each case, using an external sort so
+memory use does not grow with the files.
+
+Usage: python -m analysis.OutputMerger [-j processes] [-m memory-cap-MB] [-t temp-dir] -o output.csv input.csv [...]
+"""
+import os
+import io
+import sys
+import csv
+import getopt
+import heapq
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from analysis.StreamingAggregator import open_csv, iter_blocks, MIN_BLOCK_SIZE
+from utils import CompressedCsv
+
+# A charge is identified by its case and its number within the case
+KEY_COLUMNS = ('PortalID', 'ChargeCount')
+# Every row written for one scrape of a case has the same _id
+VERSION_COLUMN = '_id'
+
+DEFAULT_MEMORY_CAP = 256 * 1024 * 1024
+# Bytes held per byte of block while it is sorted: the raw block, its decoded text and the parsed rows.
+SORT_OVERHEAD = 8
+# Most runs merged at once. More runs are merged in several passes.
+MAX_FAN_IN = 64
+# Rows written to the output at once (one frame for compressed output)
+WRITE_BATCH = 10000
+
+
+def sort_value(value):
+    """
+    Numbers sort numerically and before other text, so charge 10 comes after charge 9.
+    """
+    if value.isdigit():
+        return 0, int(value), ''
+    return 1, 0, value
+
+
+def row_key(row, key_indexes):
+    return tuple(sort_value(row[i]) for i in key_indexes)
+
+
+def newest_rows(sequenced_rows, key_indexes, version_index):
+    """
+    Keeps the newest version of every case: the rows with the same _id as the case's newest row. A case scraped again
+    with fewer charges does not keep the charges only the older version had.
+    :param sequenced_rows: Iterable of (sequence, row) in key order, and in sequence order within each key.
+    :param key_indexes: Indexes of KEY_COLUMNS in the rows
+    :param version_index: Index of VERSION_COLUMN in the rows
+    :return: Generator of (sequence, row), one for each charge of the newest version of each case
+    """
+    for _, case_rows in itertools.groupby(sequenced_rows, key=lambda item: item[1][key_indexes[0]]):
+        # Rows of one case, which are few enough to hold in memory
+        case_rows = list(case_rows)
+        version = max(case_rows, key=lambda item: item[0])[1][version_index]
+        yield from newest_charges((item for item in case_rows if item[1][version_index] == version), key_indexes)
+
+
+def newest_charges(sequenced_rows, key_indexes):
+    """
+    Keeps the newest row of every key.
+    :param sequenced_rows: Iterable of (sequence, row) in key order, and in sequence order within each key.
+    :param key_indexes: Indexes of KEY_COLUMNS in the rows
+    :return: Generator of (sequence, row), one for each key
+    """
+    newest = None
+    newest_key = None
+    for sequenced_row in sequenced_rows:
+        key = tuple(sequenced_row[1][i] for i in key_indexes)
+        if newest is not None and key != newest_key:
+            yield newest
+        newest = sequenced_row
+        newest_key = key
+    if newest is not None:
+        yield newest
+
+
+def write_run(run_file, sequenced_rows):
+    """
+    Saves sorted rows to a run file, with each row's sequence in the first 3 columns.
+    :return: Number of rows written
+    """
+    count = 0
+    with open(run_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for sequence, row in sequenced_rows:
+            writer.writerow(list(sequence) + row)
+            count += 1
+    return count
+
+
+def read_run(run_file, key_indexes):
+    """
+    :return: Generator of ((key, sequence), row) from a run file, in the order they were written.
+    """
+    with open(run_file, 'r', encoding='utf-8', newline='') as f:
+        for line in csv.reader(f):
+            sequence = (int(line[0]), int(line[1]), int(line[2]))
+            row = line[3:]
+            yield (row_key(row, key_indexes), sequence), row
+
+
+def sort_block(block, header, file_number, block_number, run_file):
+    """
+    Sorts a block of complete CSV rows by key, and saves the newest version of every case in the block to a run file.
+    Runs in a worker process when a pool is used.
+    :param block: Encoded CSV rows, without the header. Must not end part way through a row.
+    :param header: Column names of the CSV
+    :param file_number: Position of the block's file in the inputs. Later files are newer.
+    :param block_number: Position of the block in its file
+    :param run_file: Path to save the sorted rows to
+    :return: (rows read, rows saved)
+    """
+    key_indexes = [header.index(col) for col in KEY_COLUMNS]
+    version_index = header.index(VERSION_COLUMN)
+    rows = []
+    for row_number, row in enumerate(csv.reader(io.StringIO(block.decode('utf-8'), newline=''))):
+        if len(row) < len(header):
+            # Blank or truncated row
+            continue
+        rows.append(((row_key(row, key_indexes), (file_number, block_number, row_number)), row))
+    rows.sort(key=lambda item: item[0])
+    return len(rows), write_run(run_file, newest_rows(((sort_key[1], row) for sort_key, row in rows), key_indexes,
+                                                      version_index))
+
+
+def merge_runs(run_files, header, output_file):
+    """
+    Merges sorted run files into one, keeping the newest version of every case. Runs in a worker process when a pool is
+    used.
+    :param run_files: Paths of the runs, which are deleted once merged
+    :param header: Column names of the CSV
+    :param output_file: Path of the merged run
+    :return: Rows saved
+    """
+    key_indexes = [header.index(col) for col in KEY_COLUMNS]
+    version_index = header.index(VERSION_COLUMN)
+    merged = heapq.merge(*[read_run(run_file, key_indexes) for run_file in run_files], key=lambda item: item[0])
+    count = write_run(output_file, newest_rows(((sort_key[1], row) for sort_key, row in merged), key_indexes,
+                                               version_index))
+    for run_file in run_files:
+        os.remove(run_file)
+    return count
+
+
+class OutputMerger:
+    """
+    Merges scraper output CSVs (plain or compressed) into one CSV sorted by PortalID and ChargeCount, with one row per
+    charge. Restarts, associated cases found again and merged worker outputs can save the same case several times,
+    each with a different _id. Only the newest version of each case is kept (the _id of its newest row), with one row
+    per charge: rows in later input files are newer, and later rows in a file are newer than earlier ones.
+
+    The inputs are read in blocks which are sorted into run files in a temporary directory, in a process pool when
+    processes is more than 1. The runs are then merged, MAX_FAN_IN at a time.
+    """
+
+    def __init__(self, processes=1, memory_cap=DEFAULT_MEMORY_CAP, temp_dir=None):
+        """
+        :param processes: Number of worker processes. 1 sorts in this process.
+        :param memory_cap: Approximate limit in bytes for blocks held in memory at once.
+        :param temp_dir: Directory for run files. Defaults to the output's directory, as runs can be as large as the
+        inputs.
+        """
+        self.processes = processes
+        self.memory_cap = memory_cap
+        self.temp_dir = temp_dir
+        self.max_pending = max(processes, 1) * 2
+        self.block_size = max(memory_cap // (self.max_pending * SORT_OVERHEAD), MIN_BLOCK_SIZE)
+        self.rows_read = 0
+        self.rows_written = 0
+        self.runs = 0
+        self.merge_passes = 0
+
+    def merge(self, input_files, output_file):
+        """
+        :param input_files: Paths to the CSVs to merge, oldest first. The output may be one of them.
+        :param output_file: Path of the merged CSV. Compressed if it ends in .csv.gz or .csv.zst.
+        :return: Number of duplicate rows removed
+        """
+        output_dir = os.path.dirname(os.path.abspath(output_file))
+        with tempfile.TemporaryDirectory(prefix='merge-', dir=self.temp_dir or output_dir) as run_dir:
+            if self.processes <= 1:
+                header, runs = self.sort_inputs(input_files, run_dir, None)
+                run = self.merge_all(runs, header, run_dir, None)
+            else:
+                with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                    header, runs = self.sort_inputs(input_files, run_dir, pool)
+                    run = self.merge_all(runs, header, run_dir, pool)
+            # Written beside the output first, so an input being replaced is only replaced once fully merged
+            merged_file = os.path.join(output_dir, '.merging-' + os.path.basename(output_file))
+            if os.path.isfile(merged_file):
+                os.remove(merged_file)
+            self.write_output(run, header, merged_file)
+            os.replace(merged_file, output_file)
+        return self.rows_read - self.rows_written
+
+    def read_header(self, input_file, stream, header):
+        file_header = next(csv.reader([stream.readline().decode('utf-8-sig')]))
+        missing = [col for col in KEY_COLUMNS + (VERSION_COLUMN,) if col not in file_header]
+        if missing:
+            raise ValueError('{} is missing column(s): {}'.format(input_file, ', '.join(missing)))
+        if header is not None and file_header != header:
+            raise ValueError('{} has different columns to {}'.format(input_file, header))
+        return file_header
+
+    def sort_inputs(self, input_files, run_dir, pool):
+        """
+        Sorts every input into runs of at most block_size bytes.
+        :return: (header, list of run file paths)
+        """
+        header = None
+        runs = []
+        pending = set()
+        for file_number, input_file in enumerate(input_files):
+            with open_csv(input_file) as stream:
+                header = self.read_header(input_file, stream, header)
+                for block_number, block in enumerate(iter_blocks(stream, self.block_size)):
+                    run_file = os.path.join(run_dir, 'run-{}.csv'.format(len(runs)))
+                    runs.append(run_file)
+                    if pool is None:
+                        self.rows_read += sort_block(block, header, file_number, block_number, run_file)[0]
+                        continue
+                    # Stop reading ahead until a worker finishes, to keep the number of blocks in memory bounded.
+                    if len(pending) >= self.max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self.rows_read += sum(future.result()[0] for future in done)
+                    pending.add(pool.submit(sort_block, block, header, file_number, block_number, run_file))
+        self.rows_read += sum(future.result()[0] for future in pending)
+        if header is None:
+            raise ValueError('No input files')
+        self.runs = len(runs)
+        return header, runs
+
+    def merge_all(self, runs, header, run_dir, pool):
+        """
+        Merges runs MAX_FAN_IN at a time until one is left. Each row keeps its sequence, so the newest row of a key is
+        kept whichever runs it is merged with.
+        :return: Path of the last run, or None if there were no rows
+        """
+        while len(runs) > 1:
+            self.merge_passes += 1
+            groups = [runs[i:i + MAX_FAN_IN] for i in range(0, len(runs), MAX_FAN_IN)]
+            merged = [os.path.join(run_dir, 'pass-{}-{}.csv'.format(self.merge_passes, i)) for i in range(len(groups))]
+            if pool is None:
+                for group, merged_file in zip(groups, merged):
+                    merge_runs(group, header, merged_file)
+            else:
+                for future in [pool.submit(merge_runs, group, header, merged_file)
+                               for group, merged_file in zip(groups, merged)]:
+                    future.result()
+            runs = merged
+        return runs[0] if runs else None
+
+    def write_output(self, run_file, header, output_file):
+        rows = read_run(run_file, []) if run_file else []
+        if CompressedCsv.compression_for(output_file):
+            batch = []
+            for _, row in rows:
+                batch.append(row)
+                if len(batch) >= WRITE_BATCH:
+                    CompressedCsv.write_rows(output_file, batch, header)
+                    self.rows_written += len(batch)
+                    batch = []
+            if batch or not os.path.isfile(output_file):
+                CompressedCsv.write_rows(output_file, batch, header)
+                self.rows_written += len(batch)
+            return
+        with open(output_file, 'w', encoding='utf-8', newline='') as outfile:
+            writer = csv.writer(outfile)
+            writer.writerow(header)
+            for _, row in rows:
+                writer.writerow(row)
+                self.rows_written += 1
+
+    def summary(self):
+        return 'Merged {} rows into {} ({} duplicates removed), {} sorted runs, {} merge passes'.format(
+            self.rows_read, self.rows_written, self.rows_read - self.rows_written, self.runs, self.merge_passes)
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'j:m:t:o:'
+    long_args = ['processes=', 'memory-cap=', 'temp-dir=', 'output=']
+    processes = 1
+    memory_cap = DEFAULT_MEMORY_CAP
+    temp_dir = None
+    output = None
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    for arg, val in opts:
+        if arg in ('-j', '--processes'):
+            processes = int(val)
+        elif arg in ('-m', '--memory-cap'):
+            # Given in megabytes
+            memory_cap = int(val) * 1024 * 1024
+        elif arg in ('-t', '--temp-dir'):
+            temp_dir = val
+        elif arg in ('-o', '--output'):
+            output = val
+    if len(paths) == 0 or output is None:
+        print('Usage: python -m analysis.OutputMerger [-j processes] [-m memory-cap-MB] [-t temp-dir] -o output.csv '
+              'input.csv [...]', file=sys.stderr)
+        sys.exit(2)
+
+    merger = OutputMerger(processes, memory_cap, temp_dir)
+    merger.merge(paths, output)
+    print(merger.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import sys
+import io
+import csv
+import getopt
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from analysis.FeloniesLoader import open_zipped_csv
+from utils import CompressedCsv
+
+# Summary counts produced for every file, and the columns each is keyed on.
+# These columns are present in both the write_csv output and the felonies dataset.
+AGGREGATES = {
+    'statute': ('ChargeStatute',),
+    'disposition': ('ChargeDisposition',),
+    'race_sex': ('Race', 'Sex'),
+    'year': ('FilingDate',),
+}
+
+DEFAULT_MEMORY_CAP = 256 * 1024 * 1024
+MIN_BLOCK_SIZE = 64 * 1024
+# Bytes held per byte of block while it is in flight: the raw block, plus its decoded text in the worker.
+BLOCK_OVERHEAD = 3
+
+
+def parse_year(date_text):
+    """
+    Gets the year from a portal date. Eg: '12/2/2019' returns '2019'.
+    :param date_text: Date as M/D/YYYY
+    :return: 4-digit year as str, or None if the date is blank or malformed.
+    """
+    year = date_text.rsplit('/', 1)[-1]
+    if len(year) == 4 and year.isdigit():
+        return year
+    return None
+
+
+def aggregate_block(block, header):
+    """
+    Counts a block of complete CSV rows. Runs in a worker process when a pool is used.
+    :param block: Encoded CSV rows, without the header. Must not end part way through a row.
+    :param header: Column names of the CSV
+    :return: Dict of aggregate name to Counter
+    """
+    indexes = {name: [header.index(col) for col in cols] for name, cols in AGGREGATES.items()}
+    counters = {name: Counter() for name in AGGREGATES}
+    counters['rows'] = Counter()
+    for row in csv.reader(io.StringIO(block.decode('utf-8'))):
+        if len(row) < len(header):
+            # Blank or truncated row
+            continue
+        counters['rows']['total'] += 1
+        for name, cols in indexes.items():
+            values = tuple(row[i].strip() or None for i in cols)
+            if name == 'year':
+                values = (parse_year(values[0]) if values[0] else None,)
+            counters[name][values if len(values) > 1 else values[0]] += 1
+    return counters
+
+
+def merge_aggregates(total, partial):
+    """
+    Adds a partial aggregate into a running total in place.
+    :param total: Dict of aggregate name to Counter
+    :param partial: Dict of aggregate name to Counter
+    :return: The updated total
+    """
+    for name, counter in partial.items():
+        total.setdefault(name, Counter()).update(counter)
+    return total
+
+
+def iter_blocks(stream, block_size):
+    """
+    Reads a binary CSV stream in blocks which always end on a row boundary.
+    A newline only ends a row if it is outside quotes, which is tracked by the parity of quote characters.
+    :param stream: Binary file object, positioned after the header
+    :param block_size: Approximate size of each block in bytes
+    :return: Generator of bytes blocks
+    """
+    carry = b''
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        data = carry + data
+        # Walk back to the last newline with an even number of quotes before it
+        quotes = data.count(b'"')
+        end = len(data)
+        while True:
+            newline = data.rfind(b'\n', 0, end)
+            if newline == -1:
+                break
+            quotes -= data.count(b'"', newline, end)
+            end = newline
+            if quotes % 2 == 0:
+                break
+        if newline == -1:
+            # No row boundary in this block yet, keep reading.
+            carry = data
+            continue
+        yield data[:newline + 1]
+        carry = data[newline + 1:]
+    if carry.strip():
+        yield carry
+
+
+def open_csv(path):
+    """
+    Opens a CSV, the first CSV inside a zip archive, or a compressed scraper output CSV as a binary stream.
+    :param path: Path to .csv, .zip, .csv.gz or .csv.zst
+    :return: Binary file object
+    """
+    if CompressedCsv.compression_for(path):
+        return CompressedCsv.open_binary(path)
+    if zipfile.is_zipfile(path):
+        return open_zipped_csv(path)
+    return open(path, 'rb')
+
+
+def aggregate_csv(path, processes=1, memory_cap=DEFAULT_MEMORY_CAP):
+    """
+    Computes summary counts over a CSV in fixed-size blocks, so memory use does not grow with the file.
+    Accepts the write_csv output or the felonies dataset (zipped or not).
+    :param path: Path to the CSV
+    :param processes: Number of worker processes. 1 aggregates in this process.
+    :param memory_cap: Approximate limit in bytes for blocks held in memory at once. Does not include the counts.
+    :return: Dict of aggregate name to Counter. See AGGREGATES.
+    """
+    max_pending = max(processes, 1) * 2
+    block_size = max(memory_cap // (max_pending * BLOCK_OVERHEAD), MIN_BLOCK_SIZE)
+    totals = {}
+    with open_csv(path) as stream:
+        header = next(csv.reader([stream.readline().decode('utf-8-sig')]))
+        missing = [col for cols in AGGREGATES.values() for col in cols if col not in header]
+        if missing:
+            raise ValueError('{} is missing column(s): {}'.format(path, ', '.join(missing)))
+
+        if processes <= 1:
+            for block in iter_blocks(stream, block_size):
+                merge_aggregates(totals, aggregate_block(block, header))
+            return totals
+
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            pending = set()
+            for block in iter_blocks(stream, block_size):
+                # Stop reading ahead until a worker finishes, to keep the number of blocks in memory bounded.
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        merge_aggregates(totals, future.result())
+                pending.add(pool.submit(aggregate_block, block, header))
+            for future in pending:
+                merge_aggregates(totals, future.result())
+    return totals
+
+
+def write_aggregates(output_file, totals):
+    """
+    Writes aggregates to a CSV with columns Aggregate, Key, Count. Multi-column keys are joined with '|'.
+    :param output_file: Output path + filename of CSV
+    :param totals: Dict of aggregate name to Counter
+    """
+    with open(output_file, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['Aggregate', 'Key', 'Count'])
+        for name, counter in totals.items():
+            for key, count in counter.most_common():
+                if isinstance(key, tuple):
+                    key = '|'.join(k or '' for k in key)
+                writer.writerow([name, key, count])
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'j:m:o:'
+    long_args = ['processes=', 'memory-cap=', 'output=']
+    processes = 1
+    memory_cap = DEFAULT_MEMORY_CAP
+    output = None
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    for arg, val in opts:
+        if arg in ('-j', '--processes'):
+            processes = int(val)
+        elif arg in ('-m', '--memory-cap'):
+            # Given in megabytes
+            memory_cap = int(val) * 1024 * 1024
+        elif arg in ('-o', '--output'):
+            output = val
+    if len(paths) != 1:
+        print('Usage: python -m analysis.StreamingAggregator [-j processes] [-m memory-cap-MB] [-o output.csv] '
+              'input.csv', file=sys.stderr)
+        sys.exit(2)
+
+    totals = aggregate_csv(paths[0], processes, memory_cap)
+    if output:
+        write_aggregates(output, totals)
+    else:
+        for name, counter in totals.items():
+            print('-----------')
+            print(name)
+            for key, count in counter.most_common(10):
+                print(' ', key, count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Shared fixtures for the micro-benchmarks, which are run with pytest-benchmark: python -m pytest benchmarks
+
+Each benchmark has a time budget in thresholds.json, and fails if its mean time is over budget. Budgets were set on one
+machine, along with the time a fixed reference workload took on it. On a slower machine, budgets are scaled up by how
+much slower the reference workload runs, so the same thresholds can be used on any machine.
+"""
+import os
+import json
+import time
+import pytest
+
+THRESHOLDS_FILE = os.path.join(os.path.dirname(__file__), 'thresholds.json')
+
+
+def reference_workload():
+    return sum(i * i for i in range(200000))
+
+
+def time_reference_workload(repeats=5):
+    """
+    :return: Fastest time to run the reference workload on this machine, in seconds.
+    """
+    best = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        reference_workload()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@pytest.fixture(scope='session')
+def thresholds():
+    with open(THRESHOLDS_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='session')
+def machine_slowdown(thresholds):
+    """
+    :return: How many times slower this machine is than the one the budgets were set on. At least 1.
+    """
+    return max(1.0, time_reference_workload() / thresholds['reference_seconds'])
+
+
+@pytest.fixture
+def check_budget(request, thresholds, machine_slowdown):
+    """
+    :return: Function which fails the test if a benchmark's mean time is over its budget in thresholds.json.
+    """
+    def check(benchmark):
+        if benchmark.stats is None:
+            # Benchmarks disabled, eg. with --benchmark-disable
+            return
+        name = request.node.name
+        assert name in thresholds['budgets'], 'No budget for {} in {}'.format(name, THRESHOLDS_FILE)
+        budget = thresholds['budgets'][name] * machine_slowdown
+        mean = benchmark.stats.stats.mean
+        assert mean <= budget, '{} took {:.6f}s on average, over its budget of {:.6f}s'.format(name, mean, budget)
+    return check
@@ -0,0 +1,137 @@
+"""
+Local stand-in for a Benchmark portal, serving a search page with the same kinds of resources as the real portal
+(stylesheets, web fonts, images, a captcha and a third-party script). Counts requests and bytes served per resource type.
+"""
+import os
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CAPTCHA_PNG = os.path.join(os.path.dirname(__file__), '..', 'tests', 'test_ocr_valid.png')
+
+SEARCH_PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<title>Search</title>
+<link rel="stylesheet" href="/BenchmarkWeb2/Content/site.css">
+<link rel="stylesheet" href="/BenchmarkWeb2/Content/bootstrap.css">
+<script src="{third_party}/analytics.js"></script>
+</head>
+<body>
+<img src="/BenchmarkWeb2/Content/images/banner.jpg" alt="Banner">
+<img src="/BenchmarkWeb2/Content/images/seal.png" alt="Seal">
+<div id="title">Case Search</div>
+<input type="radio" searchtype="CaseNumber"> <input type="radio" searchtype="Name">
+<input id="caseNumber" type="text">
+<img src="/BenchmarkWeb2/Captcha.aspx" alt="Captcha">
+<input name="captcha" type="text">
+<button id="searchButton">Search</button>
+</body>
+</html>
+'''
+
+STYLESHEET = '@font-face {{ font-family: Portal; src: url("/BenchmarkWeb2/Content/fonts/portal.woff"); }}\n' \
+             'body {{ font-family: Portal; background: url("/BenchmarkWeb2/Content/images/background.jpg"); }}\n{}'
+
+# Sizes are similar to the resources served by the real portal.
+STATIC_SIZES = {
+    '/BenchmarkWeb2/Content/images/banner.jpg': 180 * 1024,
+    '/BenchmarkWeb2/Content/images/seal.png': 60 * 1024,
+    '/BenchmarkWeb2/Content/images/background.jpg': 120 * 1024,
+    '/BenchmarkWeb2/Content/fonts/portal.woff': 90 * 1024,
+    '/analytics.js': 45 * 1024,
+}
+
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.png': 'image/png', '.woff': 'font/woff', '.js': 'application/javascript',
+                 '.css': 'text/css'}
+
+
+def resource_type(path):
+    if path.endswith('.css'):
+        return 'stylesheet'
+    if path.endswith('.woff'):
+        return 'font'
+    if path.endswith('.js'):
+        return 'third-party'
+    if path.endswith('Captcha.aspx'):
+        return 'captcha'
+    if path.endswith(('.jpg', '.png')):
+        return 'image'
+    return 'document'
+
+
+class FakePortal:
+    """Serves the fake portal, and a fake third-party host, on local ports until stop() is called."""
+
+    def __init__(self, third_party_host='localhost'):
+        self.requests = Counter()
+        self.bytes = Counter()
+        self.lock = threading.Lock()
+        self.third_party_host = third_party_host
+        self.portal = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler__())
+        self.third_party = ThreadingHTTPServer(('127.0.0.1', 0), self.__handler__())
+        self.threads = [threading.Thread(target=server.serve_forever, daemon=True)
+                        for server in (self.portal, self.third_party)]
+
+    @property
+    def portal_base(self):
+        return 'http://127.0.0.1:{}/BenchmarkWeb2/'.format(self.portal.server_address[1])
+
+    @property
+    def third_party_base(self):
+        return 'http://{}:{}'.format(self.third_party_host, self.third_party.server_address[1])
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        for server in (self.portal, self.third_party):
+            server.shutdown()
+            server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.requests.clear()
+            self.bytes.clear()
+
+    def body(self, path):
+        if path.startswith('/BenchmarkWeb2/Home.aspx/Search'):
+            return SEARCH_PAGE.format(third_party=self.third_party_base).encode('utf-8')
+        if path.endswith('.css'):
+            return STYLESHEET.format('.rule { margin: 0; }\n' * 2000).encode('utf-8')
+        if path.endswith('Captcha.aspx'):
+            with open(CAPTCHA_PNG, 'rb') as f:
+                return f.read()
+        if path in STATIC_SIZES:
+            return os.urandom(STATIC_SIZES[path])
+        return None
+
+    def __handler__(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                body = portal.body(path)
+                if body is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPES.get(os.path.splitext(path)[1], 'text/html'))
+                self.send_header('Content-Length', str(len(body)))
+                if path.startswith('/BenchmarkWeb2/Content/'):
+                    self.send_header('Cache-Control', 'max-age=3600')
+                else:
+                    self.send_header('Cache-Control', 'no-cache')
+                self.end_headers()
+                self.wfile.write(body)
+                with portal.lock:
+                    portal.requests[resource_type(path)] += 1
+                    portal.bytes[resource_type(path)] += len(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,61 @@
+"""
+Compares FeloniesLoader against a naive csv.reader pass over felonies_13-19.zip.
+Each loader runs in a fresh process so peak resident memory is measured independently.
+Run from the Scraper folder: python -m benchmarks.felonies_loader [path/to/felonies_13-19.zip]
+"""
+import sys
+import csv
+import io
+import time
+import resource
+import multiprocessing
+
+from analysis.FeloniesLoader import DEFAULT_FELONIES_ZIP, open_zipped_csv, load_felonies
+
+
+def naive_load(path):
+    with open_zipped_csv(path) as f:
+        return list(csv.reader(io.TextIOWrapper(f, encoding='utf-8')))
+
+
+def frame_load(path):
+    return load_felonies(path)
+
+
+LOADERS = {'csv.reader': naive_load, 'FeloniesLoader': frame_load}
+
+
+def max_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(name, path, results):
+    baseline = max_rss_bytes()
+    start = time.perf_counter()
+    data = LOADERS[name](path)
+    elapsed = time.perf_counter() - start
+    results.put((name, elapsed, max_rss_bytes() - baseline, len(data)))
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FELONIES_ZIP
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    measured = {}
+    for name in LOADERS:
+        proc = ctx.Process(target=measure, args=(name, path, results))
+        proc.start()
+        result = results.get()
+        proc.join()
+        measured[name] = result
+        print('{:<16} {:>8.3f}s {:>10.1f} MB peak RSS {:>10} rows'.format(result[0], result[1], result[2] / 1e6,
+                                                                        result[3]))
+
+    naive, frame = measured['csv.reader'], measured['FeloniesLoader']
+    print('FeloniesLoader takes {:.0%} of the time and {:.0%} of the memory of csv.reader'.format(
+        frame[1] / naive[1], frame[2] / naive[2]))
+
+
+if __name__ == '__main__':
+    main()
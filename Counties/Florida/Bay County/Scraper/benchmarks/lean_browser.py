@@ -0,0 +1,55 @@
+"""
+Measures the bandwidth and page load time saved by the lean browser profile, against a local portal stand-in.
+Requires Firefox and geckodriver, as for the scraper itself.
+Run from the Scraper folder: python -m benchmarks.lean_browser [page loads per profile]
+"""
+import sys
+from selenium import webdriver
+
+from benchmarks.fake_portal import FakePortal
+from utils import BrowserProfile
+
+THIRD_PARTY_HOST = 'cdn.portal.test'
+
+
+def run_profile(portal, lean, loads):
+    options = BrowserProfile.build_firefox_options(portal.portal_base, headless=True, lean=lean)
+    # Resolve the fake third-party host to this machine, so it is a different host to the portal.
+    options.set_preference('network.dns.localDomains', THIRD_PARTY_HOST)
+    driver = webdriver.Firefox(options=options)
+    try:
+        portal.reset_counts()
+        load_times = []
+        captcha_sizes = []
+        for _ in range(loads):
+            driver.get('{}Home.aspx/Search'.format(portal.portal_base))
+            load_times.append(driver.execute_script(
+                'return performance.timing.loadEventEnd - performance.timing.navigationStart;'))
+            captcha = driver.find_element_by_xpath('//*/img[@alt="Captcha"]')
+            captcha_sizes.append(len(BrowserProfile.get_captcha_png(driver, captcha, lean) or b''))
+        return dict(portal.bytes), dict(portal.requests), sum(load_times) / len(load_times), min(captcha_sizes)
+    finally:
+        driver.quit()
+
+
+def main():
+    loads = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    portal = FakePortal(THIRD_PARTY_HOST).start()
+    try:
+        results = {name: run_profile(portal, lean, loads) for name, lean in (('default', False), ('lean', True))}
+    finally:
+        portal.stop()
+
+    for name, (sent, requests, load_time, captcha_size) in results.items():
+        print('{:<8} {:>10.1f} KB {:>5} requests {:>8.1f} ms/page  captcha {} bytes'.format(
+            name, sum(sent.values()) / 1024, sum(requests.values()), load_time, captcha_size))
+        for kind in sorted(requests):
+            print('    {:<12} {:>10.1f} KB {:>5} requests'.format(kind, sent[kind] / 1024, requests[kind]))
+
+    default, lean = results['default'], results['lean']
+    print('Lean profile transfers {:.0%} of the bytes and loads pages in {:.0%} of the time'.format(
+        sum(lean[0].values()) / sum(default[0].values()), lean[2] / default[2]))
+
+
+if __name__ == '__main__':
+    main()
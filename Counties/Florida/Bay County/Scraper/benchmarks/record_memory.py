@@ -0,0 +1,110 @@
+"""
+Compares the memory used by a buffer of ScraperUtils Records against the plain dataclasses they replaced.
+Records are built from the felonies dataset, with every field copied into a new str as if it had just been scraped.
+Run from the Scraper folder: python -m benchmarks.record_memory [number of records]
+"""
+import sys
+import csv
+import io
+import tracemalloc
+from dataclasses import dataclass
+from typing import List
+
+from analysis.FeloniesLoader import DEFAULT_FELONIES_ZIP, open_zipped_csv
+from utils.ScraperUtils import Record, Charge
+
+
+@dataclass
+class PlainCharge:
+    count: int
+    statute: str
+    description: str
+    level: str
+    degree: str
+    disposition: str
+    disposition_date: str
+    offense_date: str
+    citation_number: str
+    plea: str
+    plea_date: str
+
+
+@dataclass
+class PlainRecord:
+    id: str
+    state: str
+    county: str
+    portal_id: str
+    case_num: str
+    agency_report_num: str
+    party_id: str
+    first_name: str
+    middle_name: str
+    last_name: str
+    suffix: str
+    dob: str
+    race: str
+    sex: str
+    arrest_date: str
+    filing_date: str
+    offense_date: str
+    division_name: str
+    case_status: str
+    defense_attorney: str
+    public_defender: str
+    judge: str
+    charges: List[PlainCharge]
+    arresting_officer: str
+    arresting_officer_badge_number: str
+
+
+def fresh(value):
+    # Scraped text is a new str object every time, even when the value repeats.
+    return ''.join(list(value))
+
+
+def read_rows(count):
+    rows = []
+    with open_zipped_csv(DEFAULT_FELONIES_ZIP) as f:
+        reader = csv.DictReader(io.TextIOWrapper(f, encoding='utf-8'))
+        for row in reader:
+            rows.append(row)
+            if len(rows) == count:
+                break
+    return rows
+
+
+def build_records(rows, record_cls, charge_cls):
+    records = []
+    for n, row in enumerate(rows):
+        charge = charge_cls(int(row['ChargeCount']), fresh(row['ChargeStatute']), fresh(row['ChargeDescription']),
+                            fresh('F'), fresh('3'), fresh(row['ChargeDisposition']), fresh(row['ChargeDispositionDate']),
+                            None, None, fresh(row['ChargePlea']), fresh(row['ChargePleaDate']))
+        records.append(record_cls('{:036}'.format(n), fresh('FL'), fresh('Bay'), '{:08}CFMA'.format(n), '', '', None,
+                                  None, None, None, None, None, fresh(row['Race']), fresh(row['Sex']), None,
+                                  fresh(row['FilingDate']), None, fresh(row['DivisionName']), fresh(row['CaseStatus']),
+                                  [], [], None, [charge], None, None))
+    return records
+
+
+def measure(rows, record_cls, charge_cls):
+    tracemalloc.start()
+    records = build_records(rows, record_cls, charge_cls)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return size
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rows = read_rows(count)
+    plain = measure(rows, PlainRecord, PlainCharge)
+    compact = measure(rows, Record, Charge)
+    print('{} records'.format(len(rows)))
+    print('Plain dataclasses: {:>8.1f} MB'.format(plain / 1e6))
+    print('ScraperUtils:      {:>8.1f} MB ({:.0%})'.format(compact / 1e6, compact / plain))
+
+
+if __name__ == '__main__':
+    main()
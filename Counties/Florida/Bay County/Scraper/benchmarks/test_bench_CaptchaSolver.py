@@ -0,0 +1,40 @@
+import os
+import shutil
+import cv2
+import pytest
+
+from captcha.CaptchaSolver import CaptchaSolver
+
+TEST_DATA = os.path.join(os.path.dirname(__file__), '..', 'tests')
+CAPTCHAS = ['test_ocr_valid.png', 'test_ocr_invalid.png']
+
+
+def read_png(name):
+    with open(os.path.join(TEST_DATA, name), 'rb') as f:
+        return f.read()
+
+
+class TestCaptchaSolverBenchmarks:
+
+    @pytest.mark.parametrize('name', CAPTCHAS)
+    def test_preprocess_captcha_png(self, benchmark, check_budget, name):
+        # As received from Selenium
+        captcha_png = read_png(name)
+        captcha = benchmark(CaptchaSolver.__preprocess_captcha__, captcha_png)
+        assert captcha.ndim == 2
+        check_budget(benchmark)
+
+    @pytest.mark.parametrize('name', CAPTCHAS)
+    def test_preprocess_captcha_array(self, benchmark, check_budget, name):
+        captcha_img = cv2.imread(os.path.join(TEST_DATA, name))
+        captcha = benchmark(CaptchaSolver.__preprocess_captcha__, captcha_img)
+        assert captcha.shape == captcha_img.shape[:2]
+        check_budget(benchmark)
+
+    @pytest.mark.skipif(shutil.which('tesseract') is None, reason='Tesseract is not installed')
+    @pytest.mark.parametrize('name', CAPTCHAS)
+    def test_read_captcha(self, benchmark, check_budget, name, tmp_path):
+        captcha_solver = CaptchaSolver(None, outdir=str(tmp_path), use_cache=False)
+        captcha_text = benchmark.pedantic(captcha_solver.read_captcha, args=(read_png(name),), rounds=10)
+        assert captcha_text.isdigit()
+        check_budget(benchmark)
@@ -0,0 +1,133 @@
+import os
+import random
+import pytest
+
+from utils import ScraperUtils
+from utils.ScraperUtils import Record, Charge, CSV_HEADER, record_rows
+
+SIZES = [100, 10000]
+
+PLEA_TEMPLATES = ['PLEA OF NOT GUILTY', 'PLEA OF GUILTY COUNT {}', 'PLEA OF NOLO CONTENDERE COUNTS {},{}',
+                  'DEFENDANT ENTERED PLEA OF NOT GUILTY AND WAIVED ARRAIGNMENT CT {}', 'PLEA OF GUILTY 3 4 CT{}']
+
+ATTORNEY_TEMPLATES = ['DEFENSE ATTORNEY: {}, {} ASSIGNED', 'COURT APPOINTED ATTORNEY: {} {} ASSIGNED',
+                      'DEFENSE ATTORNEY {}, {} WITHDRAWN']
+
+NAMES = ['SMITH', 'JOHNSON', 'WILLIAMS', 'BROWN', 'JONES', 'GARCIA', 'MILLER', 'DAVIS']
+
+
+def synthetic_pleas(size, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(PLEA_TEMPLATES).format(rng.randint(1, 9), rng.randint(1, 9)) for _ in range(size)]
+
+
+def synthetic_attorneys(size, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(ATTORNEY_TEMPLATES).format(rng.choice(NAMES), rng.choice(NAMES)) for _ in range(size)]
+
+
+def synthetic_record(case, rng):
+    charges = [Charge(count, '812.014(2C{})'.format(rng.randint(1, 4)), 'GRAND THEFT', 'F', '3', 'NOLLE PROSSE',
+                      '01/02/2019', None, None, 'Not Guilty', '01/01/2019') for count in range(1, rng.randint(2, 4))]
+    return Record('id-{}'.format(case), 'FL', 'Bay', '19{:06d}CFMA'.format(case), '19{:06d}CFMA'.format(case),
+                  'BCSO19-{}'.format(case), None, None, None, None, None, None, rng.choice(['White', 'Black']),
+                  rng.choice(['Male', 'Female']), None, '01/02/2019', None, 'X: Felony - X', 'Closed', [], [], None,
+                  charges, None, None)
+
+
+def synthetic_records(size, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_record(case, rng) for case in range(1, size + 1)]
+
+
+def write_sparse_csv(path, size, tail_records=2000):
+    """
+    Writes a CSV of the given size in bytes without using that much disk: a header, a sparse gap, then real rows at the
+    end. Only the end of the file is read when finding the last row.
+    """
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write(','.join(CSV_HEADER) + '\n')
+    tail_file = path + '.tail'
+    for record in synthetic_records(tail_records):
+        ScraperUtils.write_csv(tail_file, record)
+    with open(tail_file, 'rb') as f:
+        f.readline()
+        tail = f.read()
+    os.remove(tail_file)
+    with open(path, 'r+b') as f:
+        f.truncate(size - len(tail))
+        f.seek(0, os.SEEK_END)
+        # Start the real rows on their own line
+        f.seek(-1, os.SEEK_END)
+        f.write(b'\n')
+        f.write(tail)
+
+
+@pytest.fixture(scope='module', params=[1024 ** 2, 1024 ** 3, 4 * 1024 ** 3], ids=['1MB', '1GB', '4GB'])
+def large_csv(request, tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('csv') / 'scraped.csv')
+    write_sparse_csv(path, request.param)
+    yield path
+    os.remove(path)
+
+
+class TestScraperUtilsBenchmarks:
+
+    @pytest.mark.parametrize('size', SIZES)
+    def test_parse_plea_case_numbers(self, benchmark, check_budget, size):
+        pleas = synthetic_pleas(size)
+        valid_charges = list(range(1, 10))
+        result = benchmark(lambda: [ScraperUtils.parse_plea_case_numbers(plea, valid_charges) for plea in pleas])
+        assert len(result) == size
+        check_budget(benchmark)
+
+    @pytest.mark.parametrize('size', SIZES)
+    def test_parse_plea_type(self, benchmark, check_budget, size):
+        pleas = synthetic_pleas(size)
+        result = benchmark(lambda: [ScraperUtils.parse_plea_type(plea) for plea in pleas])
+        assert 'Not Guilty' in result
+        check_budget(benchmark)
+
+    @pytest.mark.parametrize('size', SIZES)
+    def test_parse_attorneys(self, benchmark, check_budget, size):
+        dockets = synthetic_attorneys(size)
+        result = benchmark(ScraperUtils.parse_attorneys, dockets)
+        assert len(result) > 0
+        check_budget(benchmark)
+
+    @pytest.mark.parametrize('size', SIZES)
+    def test_parse_out_path(self, benchmark, check_budget, size, tmp_path):
+        names = ['{}-CASE FILED: <{}>?'.format('19{:06d}CFMA'.format(i), 'X' * (i % 300)) for i in range(size)]
+        directory = str(tmp_path)
+        result = benchmark(lambda: [ScraperUtils.parse_out_path(directory, name, 'pdf') for name in names])
+        assert all(len(path) <= 256 for path in result)
+        check_budget(benchmark)
+
+    @pytest.mark.parametrize('size', [100, 1000, 10000])
+    def test_write_csv(self, benchmark, check_budget, size, tmp_path):
+        records = synthetic_records(size)
+        runs = []
+
+        def setup():
+            output_file = str(tmp_path / 'out-{}.csv'.format(len(runs)))
+            runs.append(output_file)
+            return (output_file,), {}
+
+        def write_all(output_file):
+            for record in records:
+                ScraperUtils.write_csv(output_file, record)
+
+        benchmark.pedantic(write_all, setup=setup, rounds=3 if size >= 10000 else 10)
+        with open(runs[0], 'r', encoding='utf-8') as f:
+            assert sum(1 for _ in f) == 1 + sum(len(record_rows(record)) for record in records)
+        check_budget(benchmark)
+
+    def test_get_last_csv_row(self, benchmark, check_budget, large_csv):
+        row = benchmark(ScraperUtils.get_last_csv_row, large_csv)
+        assert row[3] == '19002000CFMA'
+        check_budget(benchmark)
+
+    def test_get_last_portal_id(self, benchmark, check_budget, large_csv):
+        portal_id = benchmark(ScraperUtils.get_last_portal_id, large_csv, False)
+        assert portal_id == '19002000CFMA'
+        check_budget(benchmark)
@@ -0,0 +1,78 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+
+
+def hash_captcha(captcha):
+    """
+    Exact digest of a preprocessed captcha. Preprocessing thresholds the captcha to black and white, which removes the
+    background noise, so the same captcha image gives the same digest. Captchas which differ by a single pixel (eg. a 3
+    and an 8) give different digests, so a cached answer is never used for a different captcha.
+    :param captcha: Preprocessed captcha as a greyscale cv2 image
+    :return: SHA-256 of the image's size and pixels as a 64 character hex str
+    """
+    digest = hashlib.sha256('{}x{}:'.format(*captcha.shape[:2]).encode('ascii'))
+    digest.update(captcha.tobytes())
+    return digest.hexdigest()
+
+
+class CaptchaCache:
+    """
+    Least recently used cache of confirmed captcha answers, keyed by the captcha's digest. Saved to a JSON file so
+    answers are kept between runs.
+    """
+
+    def __init__(self, cache_file, max_size=2000):
+        """
+        :param cache_file: Path to save the cache to
+        :param max_size: Maximum number of answers to keep. The least recently used answer is dropped when full.
+        """
+        self.cache_file = cache_file
+        self.max_size = max_size
+        self.answers = OrderedDict()
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                for captcha_hash, answer in json.load(f):
+                    self.answers[captcha_hash] = tuple(answer)
+
+    def __len__(self):
+        return len(self.answers)
+
+    def get(self, captcha_hash):
+        """
+        Looks up the answer to a captcha.
+        :param captcha_hash: Hash from hash_captcha
+        :return: (first_number, second_number), or None if the captcha is not cached.
+        """
+        if captcha_hash not in self.answers:
+            return None
+        self.answers.move_to_end(captcha_hash)
+        return self.answers[captcha_hash]
+
+    def add(self, captcha_hash, answer):
+        """
+        Saves an answer which the portal accepted.
+        :param captcha_hash: Hash from hash_captcha
+        :param answer: (first_number, second_number)
+        """
+        self.answers[captcha_hash] = tuple(answer)
+        self.answers.move_to_end(captcha_hash)
+        while len(self.answers) > self.max_size:
+            self.answers.popitem(last=False)
+        self.save()
+
+    def remove(self, captcha_hash):
+        """
+        Drops an answer which the portal rejected.
+        :param captcha_hash: Hash from hash_captcha
+        """
+        if self.answers.pop(captcha_hash, None) is not None:
+            self.save()
+
+    def save(self):
+        # Written to a temporary file first so a crash can't leave a half-written cache.
+        tmp_file = '{}.tmp'.format(self.cache_file)
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(list(self.answers.items()), f)
+        os.replace(tmp_file, self.cache_file)
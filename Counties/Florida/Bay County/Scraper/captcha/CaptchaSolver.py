@@ -3,32 +3,54 @@ import numpy as np
 import cv2
 import pytesseract
 import re
+from captcha.CaptchaCache import CaptchaCache, hash_captcha
 
 
 class CaptchaSolver:
     """Class for solving Captchas used on Benchmark-based Portals"""
 
-    def __init__(self, driver, outdir=None):
+    def __init__(self, driver, outdir=None, use_cache=True, cache_size=2000):
         self.driver = driver
         self.outdir = outdir or os.path.join(os.getcwd(), 'captcha')
         self.correct_dir = os.path.join(self.outdir, 'correct')
         self.incorrect_dir = os.path.join(self.outdir, 'incorrect')
         self.current_captcha = None
+        self.current_hash = None
         self.first_number = None
         self.second_number = None
+        self.cache_hits = 0
 
         # Create necessary folders for saving correct/incorrect captchas
         os.makedirs(self.correct_dir, exist_ok=True)
         os.makedirs(self.incorrect_dir, exist_ok=True)
 
+        # The portal reuses a limited set of captcha images, so answers the portal accepted are remembered.
+        if use_cache:
+            self.answer_cache = CaptchaCache(os.path.join(str(self.outdir), 'answers.json'), cache_size)
+        else:
+            self.answer_cache = None
+
     def solve_captcha(self, captcha_buffer):
         """
         Solve Captcha and return its value
         :param captcha_buffer: Selenium screenshot buffer of captcha
         :return: Captcha answer
         """
+        self.first_number = None
+        self.second_number = None
+        self.current_captcha = self.__preprocess_captcha__(captcha_buffer)
+        self.current_hash = hash_captcha(self.current_captcha)
+
+        if self.answer_cache is not None:
+            cached_answer = self.answer_cache.get(self.current_hash)
+            if cached_answer is not None:
+                # Seen this captcha before, no need for OCR.
+                self.cache_hits += 1
+                self.first_number, self.second_number = cached_answer
+                return self.first_number + self.second_number
+
         # Read digits in captcha
-        captcha_digits = self.read_captcha(captcha_buffer)
+        captcha_digits = self.__ocr_captcha__(self.current_captcha)
 
         if len(captcha_digits) >= 3:
             # Do the sum
@@ -47,9 +69,17 @@ class CaptchaSolver:
         :return: Text contained in captcha
         """
         self.current_captcha = self.__preprocess_captcha__(captcha_buffer)
+        return self.__ocr_captcha__(self.current_captcha)
 
+    @staticmethod
+    def __ocr_captcha__(captcha):
+        """
+        Read the text in a preprocessed captcha
+        :param captcha: Preprocessed captcha as opencv cv2 image
+        :return: Text contained in captcha
+        """
         # Use Tesseract to perform OCR on processed captcha, using a limited character-set and Page Segmentation Mode 7
-        captcha_text = pytesseract.pytesseract.image_to_string(self.current_captcha,
+        captcha_text = pytesseract.pytesseract.image_to_string(captcha,
                                                                config="-c tessedit_char_whitelist=0123456789+=? --psm 7")
         # Remove any symbols from the text
         captcha_text = re.sub("[^0-9]", "", captcha_text)
@@ -88,6 +118,10 @@ class CaptchaSolver:
         """
         If the last captcha was incorrectly solved, the Scraper should call this function to save the incorrect captcha
         """
+        if self.answer_cache is not None and self.current_hash is not None:
+            # The cached answer (if any) was wrong, so don't use it again.
+            self.answer_cache.remove(self.current_hash)
+
         counter = 1
         filename = 'captcha{}.png'
         while os.path.isfile(os.path.join(self.incorrect_dir, filename.format(counter))):
@@ -99,6 +133,9 @@ class CaptchaSolver:
         """
         If the last captcha was correctly solved, the Scraper should call this function to save the correct captcha
         """
+        if self.answer_cache is not None and self.current_hash is not None and self.first_number is not None:
+            self.answer_cache.add(self.current_hash, (self.first_number, self.second_number))
+
         cv2.imwrite(
             os.path.join(self.correct_dir, '{}+{}=.png'.format(self.first_number, self.second_number)),
             self.current_captcha)
@@ -0,0 +1,33 @@
+from utils.ScraperUtils import Record, Charge
+
+
+def make_charge(count=1, statute='812.014(2C1)', disposition='NOLLE PROSSE', description='GRAND THEFT', **fields):
+    """
+    Builds a felony charge for tests. Fields not given are blank.
+    :param fields: Any other Charge fields, by name
+    :return: Charge
+    """
+    values = dict(count=count, statute=statute, description=description, level='F', degree='3',
+                  disposition=disposition, disposition_date='', offense_date=None, citation_number=None, plea=None,
+                  plea_date=None)
+    values.update(fields)
+    return Charge(**values)
+
+
+def make_record(portal_id='19000001CFMA', charges=None, **fields):
+    """
+    Builds a closed felony case record for tests. Fields not given are blank.
+    :param portal_id: Case number on the portal
+    :param charges: List of Charge, or the number of charges to make with make_charge. Defaults to none.
+    :param fields: Any other Record fields, by name. Eg. id, race, sex, filing_date
+    :return: Record
+    """
+    if isinstance(charges, int):
+        charges = [make_charge(count) for count in range(1, charges + 1)]
+    values = dict(id='id-{}'.format(portal_id), state='FL', county='Bay', portal_id=portal_id, case_num='',
+                  agency_report_num='', party_id=None, first_name=None, middle_name=None, last_name=None, suffix=None,
+                  dob=None, race='W', sex='M', arrest_date=None, filing_date='01/02/2019', offense_date=None,
+                  division_name='X: Felony - X', case_status='Closed', defense_attorney=None, public_defender=None,
+                  judge=None, charges=charges or [], arresting_officer=None, arresting_officer_badge_number=None)
+    values.update(fields)
+    return Record(**values)
@@ -0,0 +1,31 @@
+from urllib.parse import unquote
+from utils import BrowserProfile
+
+PORTAL_BASE = 'https://court.baycoclerk.com/BenchmarkWeb2/'
+
+
+class TestBrowserProfile:
+
+    def test_default_profile(self):
+        options = BrowserProfile.build_firefox_options(PORTAL_BASE)
+        assert '-headless' not in options.arguments
+        assert 'permissions.default.image' not in options.preferences
+        assert options.to_capabilities()['unexpectedAlertBehaviour'] == 'dismiss'
+
+    def test_headless(self):
+        options = BrowserProfile.build_firefox_options(PORTAL_BASE, headless=True)
+        assert '-headless' in options.arguments
+
+    def test_lean_profile(self):
+        options = BrowserProfile.build_firefox_options(PORTAL_BASE, lean=True, allowed_hosts=['cdn.example.com'])
+        assert options.preferences['permissions.default.image'] == 2
+        assert options.preferences['gfx.downloadable_fonts.enabled'] is False
+        assert options.preferences['network.proxy.type'] == 2
+        pac = unquote(options.preferences['network.proxy.autoconfig_url'])
+        assert 'host == "court.baycoclerk.com"' in pac
+        assert 'host == "cdn.example.com"' in pac
+
+    def test_pac_script_blocks_other_hosts(self):
+        pac = BrowserProfile.build_pac_script([])
+        assert 'if (false) return "DIRECT"' in pac
+        assert BrowserProfile.BLOCKING_PROXY in pac
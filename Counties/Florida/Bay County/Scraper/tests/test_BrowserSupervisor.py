@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import subprocess
+import psutil
+import pytest
+from selenium.common.exceptions import WebDriverException
+
+from utils.BrowserSupervisor import BrowserSupervisor, browser_rss, browser_processes
+
+
+class FakeService:
+    def __init__(self, pid):
+        self.process = type('Process', (), {'pid': pid})()
+
+
+class FakeDriver:
+    """Driver whose webdriver process is a sleeping child process, with a child of its own like Firefox."""
+
+    def __init__(self):
+        script = 'import subprocess, sys, time; subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"]);' \
+                 ' time.sleep(60)'
+        self.process = subprocess.Popen([sys.executable, '-c', script])
+        self.service = FakeService(self.process.pid)
+        self.quit_called = False
+        for _ in range(100):
+            if len(browser_processes(self)) == 2:
+                break
+            time.sleep(0.05)
+
+    def quit(self):
+        self.quit_called = True
+        raise WebDriverException('Browser is not responding')
+
+
+@pytest.fixture
+def drivers():
+    started = []
+    yield started
+    for driver in started:
+        for process in browser_processes(driver):
+            process.kill()
+        driver.process.kill()
+        driver.process.wait()
+
+
+class TestBrowserSupervisor:
+
+    def make_supervisor(self, drivers, **kwargs):
+        def start_browser():
+            drivers.append(FakeDriver())
+            return drivers[-1]
+        return BrowserSupervisor(start_browser, **kwargs)
+
+    def test_browser_rss(self):
+        driver = type('Driver', (), {'service': FakeService(os.getpid())})()
+        assert browser_rss(driver) >= psutil.Process().memory_info().rss
+        assert browser_rss(object()) == 0
+
+    def test_restart_after_case_count(self, drivers):
+        supervisor = self.make_supervisor(drivers, max_rss_mb=0, max_cases=2)
+        driver = supervisor.start_browser()
+        result, driver = supervisor.run_case(driver, lambda: True)
+        assert result and driver is drivers[0]
+        result, driver = supervisor.run_case(driver, lambda: False)
+        assert not result and driver is drivers[1]
+        assert drivers[0].quit_called
+        assert supervisor.restarts['cases'] == 1
+        assert supervisor.cases == 0
+
+    def test_hung_browser_processes_killed(self, drivers):
+        supervisor = self.make_supervisor(drivers, max_rss_mb=0, max_cases=1)
+        driver = supervisor.start_browser()
+        processes = browser_processes(driver)
+        assert len(processes) == 2
+        supervisor.run_case(driver, lambda: True)
+        driver.process.wait(timeout=10)
+        assert not any(process.is_running() and process.status() != psutil.STATUS_ZOMBIE for process in processes)
+
+    def test_restart_after_memory_limit(self, drivers):
+        supervisor = self.make_supervisor(drivers, max_rss_mb=1, max_cases=0)
+        driver = supervisor.start_browser()
+        result, driver = supervisor.run_case(driver, lambda: True)
+        assert driver is drivers[1]
+        assert supervisor.restarts['memory'] == 1
+
+    def test_failed_case_retried_in_new_browser(self, drivers):
+        supervisor = self.make_supervisor(drivers, max_rss_mb=0, max_cases=0)
+        driver = supervisor.start_browser()
+        attempts = []
+
+        def scrape_case():
+            attempts.append(drivers[-1])
+            if len(attempts) == 1:
+                raise RuntimeError('Page could not be loaded after 10 attempts.')
+            return True
+
+        result, driver = supervisor.run_case(driver, scrape_case)
+        assert result
+        assert attempts == drivers
+        assert driver is drivers[1]
+        assert supervisor.restarts['failure'] == 1
+
+    def test_failed_case_raised_after_retries(self, drivers):
+        supervisor = self.make_supervisor(drivers, max_rss_mb=0, max_cases=0, max_retries=1)
+        driver = supervisor.start_browser()
+
+        def scrape_case():
+            raise RuntimeError('Page could not be loaded after 10 attempts.')
+
+        with pytest.raises(RuntimeError):
+            supervisor.run_case(driver, scrape_case)
+        assert len(drivers) == 2
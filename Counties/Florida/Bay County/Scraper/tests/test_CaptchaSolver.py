@@ -1,7 +1,9 @@
 import pytest
 from captcha.CaptchaSolver import CaptchaSolver
+from captcha.CaptchaCache import CaptchaCache, hash_captcha
 import os
 import cv2
+import numpy as np
 
 @pytest.fixture(scope='module')
 def testdatadir(request):
@@ -74,3 +76,59 @@ class TestCaptchaSolver:
         captcha_solver.notify_last_captcha_success()
 
         assert os.path.exists(tmpdir.join('captcha', 'correct', '12+3=.png'))
+
+    def test_cache_hit_skips_ocr(self, tmpdir, testdatadir):
+        td = tmpdir.mkdir('captcha')
+        captcha_solver = CaptchaSolver(None, outdir=td)
+        test_img = cv2.imread(testdatadir.join('test_ocr_valid.png').strpath)
+        captcha_hash = hash_captcha(CaptchaSolver.__preprocess_captcha__(test_img))
+        captcha_solver.answer_cache.add(captcha_hash, (12, 3))
+
+        assert captcha_solver.solve_captcha(test_img) == 15
+        assert captcha_solver.cache_hits == 1
+        assert captcha_solver.first_number == 12
+        assert captcha_solver.second_number == 3
+
+    def test_cache_evicted_on_fail(self, tmpdir, testdatadir):
+        td = tmpdir.mkdir('captcha')
+        captcha_solver = CaptchaSolver(None, outdir=td)
+        test_img = cv2.imread(testdatadir.join('test_ocr_valid.png').strpath)
+        captcha_hash = hash_captcha(CaptchaSolver.__preprocess_captcha__(test_img))
+        captcha_solver.answer_cache.add(captcha_hash, (12, 4))
+
+        captcha_solver.solve_captcha(test_img)
+        captcha_solver.notify_last_captcha_fail()
+        assert captcha_solver.answer_cache.get(captcha_hash) is None
+
+    def test_cache_persists(self, tmpdir):
+        cache_file = tmpdir.join('answers.json').strpath
+        cache = CaptchaCache(cache_file)
+        cache.add('00000000000000ff', (12, 3))
+        assert CaptchaCache(cache_file).get('00000000000000ff') == (12, 3)
+
+    def test_cache_lru_bound(self, tmpdir):
+        cache = CaptchaCache(tmpdir.join('answers.json').strpath, max_size=2)
+        cache.add('0000000000000001', (10, 1))
+        cache.add('0000000000000002', (10, 2))
+        cache.get('0000000000000001')
+        cache.add('0000000000000003', (10, 3))
+        assert len(cache) == 2
+        assert cache.get('0000000000000002') is None
+        assert cache.get('0000000000000001') == (10, 1)
+
+    def test_hash_distinct_captchas(self):
+        # Every sum the portal can show, drawn the way its captchas are: dark digits on a light background
+        hashes = {}
+        for first_number in range(10, 100):
+            for second_number in range(10):
+                img = np.full((30, 100, 3), 230, np.uint8)
+                cv2.putText(img, '{}+{}=?'.format(first_number, second_number), (5, 22), cv2.FONT_HERSHEY_SIMPLEX,
+                            0.7, (40, 40, 40), 2)
+                captcha_hash = hash_captcha(CaptchaSolver.__preprocess_captcha__(img))
+                assert hashes.setdefault(captcha_hash, (first_number, second_number)) == (first_number, second_number)
+        assert len(hashes) == 900
+
+        # The same captcha always gives the same hash
+        img = np.full((30, 100, 3), 230, np.uint8)
+        cv2.putText(img, '12+3=?', (5, 22), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (40, 40, 40), 2)
+        assert hashes[hash_captcha(CaptchaSolver.__preprocess_captcha__(img))] == (12, 3)
@@ -0,0 +1,55 @@
+from utils.CaseSnapshot import CaseSnapshot, parse_record, parse_attachments
+
+CASE_HTML = '''<html><body>
+<div id="summaryAccordionCollapse"><table><tbody><tr>
+<td><dl><dd>SMITH, JOHN</dd><dd>x</dd><dd>01/02/2019</dd><dd>x</dd><dd> BCSO19-123 </dd></dl></td>
+<td><dl><dd>x</dd><dd>19000123CFMA</dd></dl></td>
+<td><dl><dd>x</dd><dd>CLOSED</dd><dd>x</dd><dd>FELONY</dd></dl></td>
+</tr></tbody></table></div>
+<table id="gridCharges"><tbody>
+<tr><td>1</td><td>GRAND THEFT
+ (812.014(2C1))</td><td>F</td><td>3</td><td></td><td>NOLLE PROSSE</td><td>03/04/2019</td></tr>
+<tr><td>2</td><td>RESIST OFFICER (843.02)</td><td>M</td><td>1</td><td></td><td>ADJUDICATED GUILTY</td><td>03/04/2019</td></tr>
+</tbody></table>
+<table id="gridDocketsView"><tbody>
+<tr><td><a class="casedocketimage" rel="111" digest="aaa"></a></td><td>02/02/2019</td><td>CASE FILED</td></tr>
+<tr><td><a class="casedocketimage" rel="222" digest="bbb"></a></td><td>02/03/2019</td><td>NOTICE OF HEARING</td></tr>
+<tr><td>PLEA OF NOT GUILTY COUNT 2</td><td>02/04/2019</td></tr>
+<tr><td>DEFENSE ATTORNEY: DOE, JANE ASSIGNED</td><td>02/05/2019</td></tr>
+</tbody></table>
+</body></html>'''
+
+PARTY_ROWS = ['SMITH, JOHN PAUL', 'x', 'x', 'x', 'x', 'M', 'WHITE', 'P123']
+PARTY_HTML = '''<html><body>
+<table id="mainTableContent"><tbody><tr><td><table id="fd-table-2"><tbody><tr></tr><tr><td></td><td>
+<table></table><table><tbody><tr><td></td><td><table><tbody>{}</tbody></table></td></tr></tbody></table>
+</td></tr></tbody></table></td></tr></tbody></table>
+</body></html>'''.format(''.join('<tr><td></td><td>{}</td></tr>'.format(value) for value in PARTY_ROWS))
+
+SNAPSHOT = CaseSnapshot('19000123CFMA', 'https://portal/CourtCase.aspx/Details/1', CASE_HTML, PARTY_HTML)
+
+
+class TestCaseSnapshot:
+
+    def test_parse_record(self):
+        record = parse_record(SNAPSHOT, 'FL', 'Bay', record_id='id')
+        assert (record.portal_id, record.case_num, record.agency_report_num) == ('19000123CFMA', '19000123CFMA',
+                                                                                'BCSO19-123')
+        assert (record.filing_date, record.case_status, record.division_name) == ('01/02/2019', 'CLOSED', 'FELONY')
+        assert (record.race, record.sex) == ('WHITE', 'M')
+        assert record.first_name is None and record.judge is None and record.defense_attorney == []
+        assert [(c.count, c.statute, c.description) for c in record.charges] == \
+            [(1, '812.014(2C1', 'GRAND THEFT '), (2, '843.02', 'RESIST OFFICER ')]
+        assert [(c.plea, c.plea_date) for c in record.charges] == [(None, None), ('Not Guilty', '02/04/2019')]
+
+    def test_parse_record_pii(self):
+        record = parse_record(SNAPSHOT, 'FL', 'Bay', collect_pii=True)
+        assert (record.first_name, record.middle_name, record.last_name) == ('JOHN', 'PAUL', 'SMITH')
+        assert record.party_id == 'P123'
+        assert record.judge == 'SMITH, JOHN'
+
+    def test_parse_attachments(self):
+        assert [(a.name, a.cid, a.digest) for a in parse_attachments(SNAPSHOT, 'filing')] == \
+            [('19000123CFMA-CASE FILED', '111', 'aaa')]
+        assert len(parse_attachments(SNAPSHOT, 'all')) == 2
+        assert parse_attachments(SNAPSHOT, 'none') == []
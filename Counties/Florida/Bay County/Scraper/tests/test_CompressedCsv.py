@@ -0,0 +1,99 @@
+import csv
+import gzip
+import pytest
+
+from utils import CompressedCsv
+from utils.ScraperUtils import CSV_HEADER, write_csv, get_last_portal_id, read_csv_tail
+from utils.SeenCases import SeenCases
+from analysis.StreamingAggregator import aggregate_csv
+from factories import make_record, make_charge
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+needs_zstandard = pytest.mark.skipif(zstandard is None, reason='zstandard is not installed')
+
+@pytest.fixture(params=['csv.gz', pytest.param('csv.zst', marks=needs_zstandard)])
+def output_file(request, tmpdir):
+    return tmpdir.join('out.{}'.format(request.param)).strpath
+
+
+class TestCompressedCsv:
+
+    def test_compression_for(self):
+        assert CompressedCsv.compression_for('out.csv.gz') == 'gzip'
+        assert CompressedCsv.compression_for('out.csv') is None
+
+    @needs_zstandard
+    def test_compression_for_zst(self):
+        assert CompressedCsv.compression_for('out.csv.zst') == 'zstd'
+
+    def test_write_and_read_back(self, output_file):
+        for portal_id in ('19000001CFMA', '19000002CFMA', '19000003MMMA'):
+            write_csv(output_file, make_record(portal_id, [make_charge(count, description='GRAND THEFT,\nOVER $300')
+                                                           for count in (1, 2)]))
+        with CompressedCsv.open_text(output_file) as f:
+            rows = list(csv.reader(f))
+        assert rows[0] == CSV_HEADER
+        assert [row[3] for row in rows[1:]] == ['19000001CFMA'] * 2 + ['19000002CFMA'] * 2 + ['19000003MMMA'] * 2
+        assert rows[1][24] == 'GRAND THEFT,\nOVER $300'
+
+    def test_readable_by_standard_tools(self, output_file):
+        write_csv(output_file, make_record('19000001CFMA', charges=1))
+        write_csv(output_file, make_record('19000002CFMA', charges=1))
+        with open(output_file, 'rb') as f:
+            data = f.read()
+        if output_file.endswith('.gz'):
+            text = gzip.decompress(data)
+        else:
+            text = zstandard.ZstdDecompressor().stream_reader(data, read_across_frames=True).read()
+        assert text.decode('utf-8').count('GRAND THEFT') == 2
+
+    def test_read_tail(self, output_file):
+        for case in range(1, 201):
+            write_csv(output_file, make_record('19{:06d}CFMA'.format(case), charges=1))
+        header, rows = CompressedCsv.read_tail(output_file, block_size=1024)
+        assert header == CSV_HEADER
+        assert len(rows) > 0
+        assert rows[-1][3] == '19000200CFMA'
+        assert get_last_portal_id(output_file) == '19000200CFMA'
+
+    def test_torn_frame_removed(self, output_file):
+        write_csv(output_file, make_record('19000001CFMA', charges=1))
+        write_csv(output_file, make_record('19000002CFMA', charges=1))
+        with open(output_file, 'rb') as f:
+            complete = f.read()
+        write_csv(output_file, make_record('19000003CFMA', charges=5))
+        with open(output_file, 'rb') as f:
+            data = f.read()
+        # Simulate a crash part way through writing the last frame
+        with open(output_file, 'wb') as f:
+            f.write(data[:len(complete) + (len(data) - len(complete)) // 2])
+
+        header, rows = read_csv_tail(output_file, truncate_torn_row=True)
+        assert rows[-1][3] == '19000002CFMA'
+        with open(output_file, 'rb') as f:
+            assert f.read() == complete
+
+        # Appending after the torn frame is removed gives a valid file
+        write_csv(output_file, make_record('19000004CFMA', charges=1))
+        with CompressedCsv.open_text(output_file) as f:
+            assert [row[3] for row in csv.reader(f)][1:] == ['19000001CFMA', '19000002CFMA', '19000004CFMA']
+
+    def test_header_only(self, output_file):
+        CompressedCsv.write_rows(output_file, [], header=CSV_HEADER)
+        assert CompressedCsv.read_tail(output_file) == (CSV_HEADER, [])
+        assert get_last_portal_id(output_file) is None
+
+    def test_seen_cases_from_compressed_output(self, output_file, tmpdir):
+        write_csv(output_file, make_record('19000001CFMA', charges=1))
+        write_csv(output_file, make_record('19000002CFMA', charges=1))
+        seen = SeenCases(tmpdir.join('out.seen').strpath, output_file)
+        assert '19000002CFMA' in seen
+
+    def test_aggregate_compressed_output(self, output_file):
+        write_csv(output_file, make_record('19000001CFMA', charges=3))
+        aggregates = aggregate_csv(output_file)
+        assert aggregates['statute'] == {'812.014(2C1)': 3}
@@ -0,0 +1,75 @@
+import pytest
+from analysis.CsvIndex import CsvIndex, statute_matches
+from utils import ScraperUtils
+from factories import make_record, make_charge
+
+
+@pytest.fixture
+def scraped_csv(tmpdir):
+    path = tmpdir.join('scraped.csv').strpath
+    ScraperUtils.write_csv(path, make_record('19000001CFMA', filing_date='01/02/2019', charges=[
+        make_charge(1, '812.014(2C1)', 'NOLLE PROSSE'),
+        make_charge(2, '843.02', 'NOLLE PROSSE', 'RESIST OFFICER,\nWITHOUT VIOLENCE')]))
+    ScraperUtils.write_csv(path, make_record('18000002CFMA', filing_date='03/04/2018', charges=[
+        make_charge(1, '812.0145', 'NO FILE')]))
+    return path
+
+
+class TestCsvIndex:
+
+    def test_statute_matches(self):
+        assert statute_matches('812.014(2C1)', '812')
+        assert statute_matches('812.014(2C1)', '812.014')
+        assert statute_matches('812.014(2C1)', '812.014(2C1)')
+        assert not statute_matches('812.0145', '812.014')
+        assert not statute_matches('843.02', '812')
+
+    def test_query(self, scraped_csv):
+        index = CsvIndex(scraped_csv)
+        assert index.update() == 3
+        rows = index.query(statute='812.014')
+        assert [row[3] for row in rows] == ['19000001CFMA']
+        assert len(index.query(statute='812')) == 2
+        assert len(index.query(disposition='NOLLE PROSSE')) == 2
+        assert len(index.query(case='19000001CFMA', year=2019)) == 2
+        assert index.query(case='19000001CFMA', year=2018) == []
+
+    def test_multiline_row(self, scraped_csv):
+        index = CsvIndex(scraped_csv)
+        index.update()
+        row = index.query(statute='843.02')[0]
+        assert row[index.header.index('ChargeDescription')] == 'RESIST OFFICER,\nWITHOUT VIOLENCE'
+
+    def test_reload_and_incremental_update(self, scraped_csv):
+        CsvIndex(scraped_csv).update()
+        ScraperUtils.write_csv(scraped_csv, make_record('17000003CFMA', filing_date='05/06/2017', charges=[
+            make_charge(1, '812.014(2C1)', 'NO FILE')]))
+
+        index = CsvIndex(scraped_csv)
+        assert len(index.query(statute='812.014')) == 1
+        assert index.update() == 1
+        assert len(index.query(statute='812.014')) == 2
+        assert CsvIndex(scraped_csv).keys('year') == ['2017', '2018', '2019']
+
+    def test_torn_row_not_indexed(self, scraped_csv):
+        CsvIndex(scraped_csv).update()
+        with open(scraped_csv, 'a', encoding='utf-8') as f:
+            f.write('id-x,FL,Bay,16000004CFMA,')
+        index = CsvIndex(scraped_csv)
+        assert index.update() == 0
+        assert index.query(case='16000004CFMA') == []
+
+    def test_rebuild_after_truncation(self, scraped_csv, tmpdir):
+        CsvIndex(scraped_csv).update()
+        tmpdir.join('scraped.csv').remove()
+        ScraperUtils.write_csv(scraped_csv, make_record('15000005CFMA', filing_date='05/06/2015', charges=[
+            make_charge(1, '843.02', 'NO FILE')]))
+        index = CsvIndex(scraped_csv)
+        index.update()
+        assert index.keys('case') == ['15000005CFMA']
+
+    def test_no_criteria(self, scraped_csv):
+        index = CsvIndex(scraped_csv)
+        index.update()
+        with pytest.raises(ValueError):
+            index.query()
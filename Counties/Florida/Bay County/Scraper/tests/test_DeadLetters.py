@@ -0,0 +1,69 @@
+import pytest
+from utils.DeadLetters import DeadLetters, FAILED, RESOLVED, ABANDONED
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def dead_letters(tmpdir, clock):
+    letters = DeadLetters(tmpdir.join('out.csv.failed.sqlite').strpath, base_delay=60, max_delay=600, max_failures=3,
+                          clock=clock)
+    yield letters
+    letters.close()
+
+
+class TestDeadLetters:
+
+    def test_add_and_persist(self, dead_letters, tmpdir, clock):
+        assert dead_letters.add('19000123', 'Page could not be loaded', attempts=3) == FAILED
+        reloaded = DeadLetters(tmpdir.join('out.csv.failed.sqlite').strpath, clock=clock)
+        letter = reloaded.next_letter()
+        assert (letter['case_number'], letter['reason'], letter['attempts'], letter['failures']) == \
+            ('19000123', 'Page could not be loaded', 3, 1)
+        assert letter['next_retry'] == 1060
+        reloaded.close()
+
+    def test_backoff_grows(self, dead_letters, clock):
+        dead_letters.add('19000123', 'Timeout', attempts=3)
+        clock.now = 2000
+        dead_letters.add('19000123', 'Timeout again', attempts=3)
+        letter = dead_letters.next_letter()
+        assert (letter['attempts'], letter['failures'], letter['reason']) == (6, 2, 'Timeout again')
+        assert letter['next_retry'] == 2000 + 240
+        assert letter['first_failed'] == 1000
+        assert dead_letters.backoff(5) == 600
+
+    def test_retried_soonest_first(self, dead_letters, clock):
+        dead_letters.add('19000005', 'Timeout')
+        dead_letters.add('19000005', 'Timeout')
+        clock.now = 1100
+        dead_letters.add('19000009', 'Timeout')
+        assert dead_letters.next_letter()['case_number'] == '19000009'
+
+    def test_resolve(self, dead_letters):
+        dead_letters.add('19000123', 'Timeout')
+        dead_letters.resolve('19000123')
+        assert dead_letters.next_letter() is None
+        assert dead_letters.counts() == {RESOLVED: 1}
+
+    def test_abandoned_after_max_failures(self, dead_letters):
+        for _ in range(3):
+            status = dead_letters.add('19000123', 'Timeout')
+        assert status == ABANDONED
+        assert dead_letters.next_letter() is None
+        assert [letter['case_number'] for letter in dead_letters.letters(ABANDONED)] == ['19000123']
+
+        dead_letters.requeue('19000123')
+        assert dead_letters.next_letter()['failures'] == 0
+        assert 'waiting to be retried' in dead_letters.summary()
@@ -0,0 +1,64 @@
+import pytest
+import zipfile
+import pandas as pd
+from analysis import FeloniesLoader
+
+HEADER = 'Race,Sex,ArrestDate,FilingDate,OffenseDate,DivisionName,CaseStatus,ChargeCount,ChargeStatute,' \
+         'ChargeDescription,ChargeDisposition,ChargeDispositionDate,ChargeOffenseDate,ChargeCitationNum,ChargePlea,' \
+         'ChargePleaDate,,,,,\n'
+ROWS = ['Black,M,12/1/2019,12/2/2019,12/1/2019,X: Felony - X,Open,1,322.34(2C),DL SUSPENDED,\xa0,\xa0,12/1/2019,'
+        'AC5ZTYE,\xa0,\xa0,,,,,\n',
+        'W,F,\xa0,04/04/2014,04/03/2014,V: Felony - V,Closed,2,812.014(2C1),GRAND THEFT,NOLLE PROSSE,NOT GUILTY,'
+        '04/03/2014, ,GUILTY,05/01/2014,,,,,\n']
+
+
+@pytest.fixture
+def felonies_zip(tmpdir):
+    path = tmpdir.join('felonies.zip').strpath
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('felonies.csv', HEADER + ''.join(ROWS))
+    return path
+
+
+class TestFeloniesLoader:
+
+    def test_columns_and_types(self, felonies_zip):
+        frame = FeloniesLoader.load_felonies(felonies_zip)
+        assert list(frame.columns) == FeloniesLoader.FELONIES_COLUMNS
+        for col in FeloniesLoader.CATEGORY_COLUMNS:
+            assert isinstance(frame[col].dtype, pd.CategoricalDtype)
+        for col in FeloniesLoader.DATE_COLUMNS:
+            assert pd.api.types.is_datetime64_any_dtype(frame[col])
+        assert list(frame['ChargeCount']) == [1, 2]
+
+    def test_blank_fields_are_null(self, felonies_zip):
+        frame = FeloniesLoader.load_felonies(felonies_zip)
+        assert pd.isna(frame['ChargeDisposition'][0])
+        assert pd.isna(frame['ChargePlea'][0])
+        assert pd.isna(frame['ArrestDate'][1])
+        assert pd.isna(frame['ChargeCitationNum'][1])
+        assert frame['ChargeCitationNum'][0] == 'AC5ZTYE'
+
+    def test_dates_parsed(self, felonies_zip):
+        frame = FeloniesLoader.load_felonies(felonies_zip)
+        assert frame['FilingDate'][0] == pd.Timestamp(2019, 12, 2)
+        assert frame['FilingDate'][1] == pd.Timestamp(2014, 4, 4)
+
+    def test_shifted_date_is_null(self, felonies_zip):
+        # Text in a date column (from a misaligned row) should not fail the load
+        frame = FeloniesLoader.load_felonies(felonies_zip)
+        assert pd.isna(frame['ChargeDispositionDate'][1])
+
+    def test_column_subset(self, felonies_zip):
+        frame = FeloniesLoader.load_felonies(felonies_zip, columns=['Sex', 'FilingDate'])
+        assert list(frame.columns) == ['Sex', 'FilingDate']
+
+    def test_unknown_column(self, felonies_zip):
+        with pytest.raises(ValueError):
+            FeloniesLoader.load_felonies(felonies_zip, columns=['PortalID'])
+
+    def test_uncompressed_csv(self, tmpdir):
+        path = tmpdir.join('felonies.csv')
+        path.write_text(HEADER + ''.join(ROWS), encoding='utf-8')
+        frame = FeloniesLoader.load_felonies(path.strpath)
+        assert len(frame) == 2
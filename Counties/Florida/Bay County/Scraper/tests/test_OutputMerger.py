@@ -0,0 +1,80 @@
+import csv
+import pytest
+from analysis import OutputMerger as OutputMergerModule
+from analysis.OutputMerger import OutputMerger, sort_value
+from utils import ScraperUtils, CompressedCsv
+from utils.ScraperUtils import CSV_HEADER
+from factories import make_record, make_charge
+
+
+def read_rows(path):
+    if CompressedCsv.compression_for(path):
+        f = CompressedCsv.open_text(path)
+    else:
+        f = open(path, 'r', encoding='utf-8', newline='')
+    with f:
+        return list(csv.reader(f))
+
+
+def keys(rows):
+    portal_id, charge_count, record_id = [CSV_HEADER.index(col) for col in ('PortalID', 'ChargeCount', '_id')]
+    return [(row[portal_id], row[charge_count], row[record_id]) for row in rows[1:]]
+
+
+@pytest.fixture
+def worker_outputs(tmpdir):
+    first = tmpdir.join('bay.w1.csv').strpath
+    second = tmpdir.join('bay.w2.csv.gz').strpath
+    ScraperUtils.write_csv(first, make_record('19000002CFMA', [make_charge(count, disposition='PENDING')
+                                                               for count in (1, 2)], id='a'))
+    ScraperUtils.write_csv(first, make_record('19000001CFMA', 10, id='b'))
+    # Found again as an associated case, after it was disposed
+    ScraperUtils.write_csv(first, make_record('19000002CFMA', 2, id='c'))
+    ScraperUtils.write_csv(second, make_record('19000003CFMA', 2, id='d'))
+    # Scraped again after a restart
+    ScraperUtils.write_csv(second, make_record('19000001CFMA', [make_charge(1, disposition='GUILTY',
+                                                                            description='GRAND THEFT,\nTHIRD DEGREE')],
+                                               id='e'))
+    return first, second
+
+
+class TestOutputMerger:
+
+    def test_sort_value(self):
+        assert sorted(['10', '9', '', 'A1'], key=sort_value) == ['9', '10', '', 'A1']
+
+    @pytest.mark.parametrize('processes', [1, 2])
+    def test_merge(self, tmpdir, worker_outputs, processes, monkeypatch):
+        # Small fan-in and blocks, so there are several runs and merge passes
+        monkeypatch.setattr(OutputMergerModule, 'MAX_FAN_IN', 2)
+        monkeypatch.setattr(OutputMergerModule, 'MIN_BLOCK_SIZE', 1)
+        output = tmpdir.join('bay-merged.csv').strpath
+        merger = OutputMerger(processes, memory_cap=1)
+        assert merger.merge(worker_outputs, output) == 12
+        assert merger.runs > 2 and merger.merge_passes > 1
+
+        rows = read_rows(output)
+        assert rows[0] == CSV_HEADER
+        # The rescrape of 19000001CFMA has only one charge, so charges 2-10 of the older version are dropped
+        assert keys(rows) == [('19000001CFMA', '1', 'e'), ('19000002CFMA', '1', 'c'), ('19000002CFMA', '2', 'c'),
+                              ('19000003CFMA', '1', 'd'), ('19000003CFMA', '2', 'd')]
+        assert rows[1][CSV_HEADER.index('ChargeDisposition')] == 'GUILTY'
+        assert rows[1][CSV_HEADER.index('ChargeDescription')] == 'GRAND THEFT,\nTHIRD DEGREE'
+        assert [name for name in tmpdir.listdir() if name.basename.startswith(('merge-', '.merging-'))] == []
+
+    def test_merge_in_place_compressed(self, tmpdir, worker_outputs):
+        first, second = worker_outputs
+        merger = OutputMerger()
+        assert merger.merge([first, second], second) == 12
+        assert merger.runs == 2 and merger.merge_passes == 1
+        assert len(read_rows(second)) == 1 + 5
+        assert merger.summary().startswith('Merged 17 rows into 5 (12 duplicates removed)')
+
+    def test_mismatched_columns(self, tmpdir, worker_outputs):
+        other = tmpdir.join('other.csv')
+        other.write('PortalID,ChargeCount\n19000001CFMA,1\n')
+        with pytest.raises(ValueError):
+            OutputMerger().merge([worker_outputs[0], other.strpath], tmpdir.join('out.csv').strpath)
+        other.write('PortalID,Charge\n19000001CFMA,1\n')
+        with pytest.raises(ValueError):
+            OutputMerger().merge([other.strpath], tmpdir.join('out.csv').strpath)
@@ -0,0 +1,94 @@
+import time
+import threading
+import pytest
+
+from utils.Pipeline import Pipeline, PipelineError
+
+
+class TestPipeline:
+
+    def test_items_pass_through_stages_in_order(self):
+        written = []
+        pipeline = Pipeline()
+        pipeline.add_stage('double', lambda item: pipeline.put('write', item * 2))
+        pipeline.add_stage('write', written.append)
+        for i in range(100):
+            pipeline.put('double', i)
+        pipeline.close()
+        assert written == [i * 2 for i in range(100)]
+        assert pipeline.stages['write'].items == 100
+
+    def test_backpressure(self):
+        release = threading.Event()
+        pipeline = Pipeline()
+        pipeline.add_stage('slow', lambda item: release.wait(), queue_size=2)
+        pipeline.put('slow', 1)
+        time.sleep(0.05)
+        # One item being handled, and two waiting in the queue
+        pipeline.put('slow', 2)
+        pipeline.put('slow', 3)
+        blocked = threading.Thread(target=pipeline.put, args=('slow', 4))
+        blocked.start()
+        blocked.join(0.2)
+        assert blocked.is_alive()
+        release.set()
+        blocked.join(1)
+        assert not blocked.is_alive()
+        pipeline.close()
+        assert pipeline.stages['slow'].blocked_seconds >= 0.1
+
+    def test_error_raised_in_caller(self):
+        def fail(item):
+            raise ValueError('Unexpected page')
+
+        pipeline = Pipeline()
+        pipeline.add_stage('parse', fail)
+        pipeline.put('parse', 1)
+        with pytest.raises(PipelineError):
+            pipeline.drain()
+        with pytest.raises(PipelineError):
+            pipeline.put('parse', 2)
+        with pytest.raises(PipelineError):
+            pipeline.close()
+
+    def test_handled_error_only_fails_item(self):
+        failed = []
+        written = []
+
+        def write(item):
+            if item == 2:
+                raise ValueError('Unexpected page')
+            if item == 4:
+                raise OSError('No space left on device')
+            written.append(item)
+
+        def on_error(item, err):
+            if not isinstance(err, ValueError):
+                return False
+            failed.append(item)
+            return True
+
+        pipeline = Pipeline()
+        pipeline.add_stage('write', write, on_error=on_error)
+        for i in range(4):
+            pipeline.put('write', i)
+        pipeline.drain()
+        assert (written, failed) == ([0, 1, 3], [2])
+        assert '1 failed' in pipeline.report()
+        # Errors the handler doesn't handle still fail the pipeline
+        pipeline.put('write', 4)
+        with pytest.raises(PipelineError):
+            pipeline.close()
+
+    def test_report(self):
+        clock = [0.0]
+        pipeline = Pipeline(clock=lambda: clock[0])
+        pipeline.add_source('browser')
+        pipeline.add_stage('write', lambda item: None, workers=2)
+        with pipeline.busy('browser'):
+            clock[0] += 3.0
+        clock[0] += 1.0
+        report = pipeline.report()
+        assert 'browser: 75% busy, 1 items' in report
+        assert 'write: 0% busy, 0 items, 2 workers, 0/8 queued' in report
+        pipeline.close()
@@ -0,0 +1,135 @@
+import csv
+import time
+import threading
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from benchmarks.fake_portal import FakePortal
+from utils.PortalProber import PortalLink, PortalProber, read_portal_links, fingerprint, get_portal_base, \
+    write_targets, output_name
+
+
+class OtherPortal:
+    """Serves pages which are not Benchmark portals, and counts the most requests handled at once."""
+
+    def __init__(self, benchmark_base, delay=0.0):
+        self.delay = delay
+        self.active = 0
+        self.most_active = 0
+        self.lock = threading.Lock()
+        pages = {
+            '/landing': '<a href="{}Home.aspx/Search">Search court records</a>'.format(benchmark_base).encode(),
+            '/other': b'<html><form action="/CaseSearch.do"><input name="caseNumber"></form></html>',
+        }
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with portal.lock:
+                    portal.active += 1
+                    portal.most_active = max(portal.most_active, portal.active)
+                time.sleep(portal.delay)
+                with portal.lock:
+                    portal.active -= 1
+                if self.path == '/slow':
+                    time.sleep(1)
+                body = pages.get(self.path, b'<html></html>')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def fake_portal():
+    portal = FakePortal().start()
+    yield portal
+    portal.stop()
+
+
+class TestPortalProber:
+
+    def test_read_portal_links(self, tmpdir):
+        links_file = tmpdir.join('links.csv')
+        links_file.write('Florida,State Courts,https://www.flcourts.org/\n'
+                         ',Bay County,https://court.baycoclerk.com/BenchmarkWeb2/Home.aspx/Search\n'
+                         ',"No URL",\n'
+                         'Georgia,Courts,http://www.gasupreme.us/\n')
+        links = read_portal_links(links_file.strpath)
+        assert [(link.state, link.name) for link in links] == [('Florida', 'State Courts'), ('Florida', 'Bay County'),
+                                                               ('Georgia', 'Courts')]
+
+    def test_fingerprint(self):
+        url = 'https://courtsweb.co.charlotte.fl.us/BenchmarkWeb/Home.aspx/Search'
+        html = '<img src="/BenchmarkWeb/Captcha.aspx" alt="Captcha">'
+        assert fingerprint(url, html) == ['benchmark', 'search', 'captcha']
+        assert fingerprint('https://www.flcourts.org/', '<html></html>') == []
+
+    def test_get_portal_base(self):
+        assert get_portal_base('https://court.baycoclerk.com/BenchmarkWeb2/Home.aspx/Search') == \
+            'https://court.baycoclerk.com/BenchmarkWeb2/'
+        assert get_portal_base('http://clerkapps.okaloosaclerk.com/benchmarkweb2/') == \
+            'http://clerkapps.okaloosaclerk.com/benchmarkweb2/'
+        assert get_portal_base('https://www.flcourts.org/') is None
+
+    def test_output_name(self):
+        assert output_name('Florida', 'St. Lucie County') == 'fl-st-lucie-scraped.csv'
+
+    def test_probe(self, fake_portal):
+        other = OtherPortal(fake_portal.portal_base)
+        try:
+            links = [
+                PortalLink('Florida', 'Bay County', fake_portal.portal_base + 'Home.aspx/Search'),
+                PortalLink('Florida', 'Portal Root', fake_portal.portal_base),
+                PortalLink('Florida', 'Landing Page', other.base + '/landing'),
+                PortalLink('Georgia', 'Other Vendor', other.base + '/other'),
+                PortalLink('Georgia', 'Slow', other.base + '/slow'),
+                PortalLink('Georgia', 'Unreachable', 'http://127.0.0.1:1/'),
+            ]
+            results = PortalProber(timeout=0.5).run(links)
+        finally:
+            other.stop()
+
+        assert [result.is_benchmark for result in results] == [True, True, True, False, False, False]
+        assert results[0].portal_base == fake_portal.portal_base
+        assert results[0].markers == ['benchmark', 'search', 'captcha']
+        assert results[2].portal_base == fake_portal.portal_base
+        assert results[3].error is None and results[3].status == 200
+        assert results[4].error is not None
+        assert results[5].error is not None
+
+    def test_per_host_limit(self):
+        other = OtherPortal('http://127.0.0.1/BenchmarkWeb2/', delay=0.2)
+        try:
+            links = [PortalLink('Georgia', 'County {}'.format(i), '{}/{}'.format(other.base, i)) for i in range(8)]
+            started = time.time()
+            results = PortalProber(concurrency=8, per_host=2).run(links)
+            elapsed = time.time() - started
+        finally:
+            other.stop()
+        assert all(result.error is None for result in results)
+        assert other.most_active <= 2
+        assert elapsed >= 0.8
+
+    def test_write_targets(self, fake_portal, tmpdir):
+        links = [PortalLink('Florida', 'Bay County', fake_portal.portal_base + 'Home.aspx/Search'),
+                 PortalLink('Florida', 'Bay County Search', fake_portal.portal_base)]
+        results = PortalProber().run(links)
+        targets_file = tmpdir.join('targets.csv').strpath
+        assert write_targets(targets_file, results) == 1
+        with open(targets_file, 'r', encoding='utf-8', newline='') as f:
+            targets = list(csv.DictReader(f))
+        assert targets == [{'state-code': 'FL', 'county': 'Bay', 'portal-base': fake_portal.portal_base,
+                            'output': 'fl-bay-scraped.csv', 'captcha': 'True'}]
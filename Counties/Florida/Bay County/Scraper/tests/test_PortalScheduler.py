@@ -0,0 +1,184 @@
+import pytest
+
+from utils.PortalScheduler import PortalConfig, PortalScheduler, fair_shares, read_portal_config
+from utils.PortalProber import PortalLink, ProbeResult, write_targets
+from utils.DeadLetters import DeadLetters
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeProcess:
+    def __init__(self, args):
+        self.args = args
+        self.returncode = None
+        self.signalled = False
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, sig):
+        self.signalled = True
+        self.returncode = 0
+
+    def terminate(self):
+        self.send_signal(None)
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+    def kill(self):
+        self.returncode = -9
+
+
+class FakeLauncher:
+    def __init__(self):
+        self.processes = []
+
+    def __call__(self, args, log_file):
+        self.processes.append(FakeProcess(args))
+        return self.processes[-1]
+
+
+def make_portal(name, max_workers=2, searches_per_minute=0):
+    return PortalConfig('FL', name, 'https://{}.example/BenchmarkWeb2/'.format(name), '{}-scraped.csv'.format(name),
+                        max_workers, searches_per_minute, ['--solve-captchas'])
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def launcher():
+    return FakeLauncher()
+
+
+@pytest.fixture
+def in_tmpdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
+
+
+def make_scheduler(portals, capacity, launcher, clock, **kwargs):
+    return PortalScheduler(portals, capacity, 2019, 2019, cases_per_unit=100, launch=launcher, clock=clock, **kwargs)
+
+
+def report_progress(crawl, cases):
+    """Simulates workers scraping a number of cases in the portal's work queue."""
+    unit = crawl.work_queue.acquire('test', lease_seconds=10 ** 6)
+    crawl.work_queue.heartbeat(unit['id'], 'test', unit['first_case'] + cases, lease_seconds=10 ** 6)
+
+
+class TestPortalScheduler:
+
+    def test_fair_shares(self):
+        assert fair_shares(4, {'a': 3, 'b': 3}) == {'a': 2, 'b': 2}
+        assert fair_shares(5, {'a': 1, 'b': 3, 'c': 3}) == {'a': 1, 'b': 2, 'c': 2}
+        assert fair_shares(5, {'a': 1, 'b': 1}) == {'a': 1, 'b': 1}
+        assert fair_shares(0, {'a': 1}) == {'a': 0}
+
+    def test_read_portal_config(self, tmpdir):
+        config_file = tmpdir.join('portals.csv')
+        config_file.write('state-code,county,portal-base,output,captcha,max-workers,searches-per-minute,args\n'
+                          'FL,Bay,https://court.baycoclerk.com/BenchmarkWeb2/,fl-bay-scraped.csv.gz,True,3,30,'
+                          '"--solve-captchas --lean-browser"\n'
+                          'FL,Levy,http://benchmark.levyclerk.com/BenchmarkWeb/,fl-levy-scraped.csv,True,,,\n')
+        bay, levy = read_portal_config(config_file.strpath)
+        assert (bay.max_workers, bay.args) == (3, ['--solve-captchas', '--lean-browser'])
+        assert bay.min_search_interval() == 6.0
+        assert bay.worker_output(2) == 'fl-bay-scraped.w2.csv.gz'
+        assert (levy.max_workers, levy.min_search_interval(), levy.worker_output(1)) == (1, 0, 'fl-levy-scraped.w1.csv')
+
+    def test_worker_args_from_prober_targets(self, in_tmpdir, launcher, clock):
+        links = [PortalLink('Florida', 'Bay County', 'https://court.baycoclerk.com/BenchmarkWeb2/'),
+                 PortalLink('Florida', 'Levy County', 'http://benchmark.levyclerk.com/BenchmarkWeb/')]
+        write_targets('portal-targets.csv', [
+            ProbeResult(links[0], markers=['benchmark', 'search', 'captcha'], portal_base=links[0].url),
+            ProbeResult(links[1], markers=['benchmark', 'search'], portal_base=links[1].url)])
+        bay, levy = read_portal_config('portal-targets.csv')
+        scheduler = make_scheduler([bay, levy], 2, launcher, clock)
+        bay_args = scheduler.worker_args(bay, 1)
+        assert bay_args[bay_args.index('--portal-base') + 1] == 'https://court.baycoclerk.com/BenchmarkWeb2/'
+        assert bay_args[bay_args.index('--county') + 1] == 'Bay'
+        assert bay_args.count('--solve-captchas') == 1
+        assert '--solve-captchas' not in scheduler.worker_args(levy, 1)
+
+    def test_capacity_shared_fairly(self, in_tmpdir, launcher, clock):
+        scheduler = make_scheduler([make_portal('bay', 3), make_portal('levy', 3)], 4, launcher, clock)
+        assert scheduler.step()
+        assert [len(crawl.workers) for crawl in scheduler.crawls] == [2, 2]
+        args = launcher.processes[0].args
+        assert args[args.index('--output') + 1] == 'bay-scraped.w1.csv'
+        assert args[args.index('--coordinator') + 1] == in_tmpdir.join('bay-scraped.work.sqlite').strpath
+        assert args[-1] == '--solve-captchas'
+
+    def test_capacity_moves_from_failing_portal(self, in_tmpdir, launcher, clock):
+        scheduler = make_scheduler([make_portal('bay', 3), make_portal('levy', 3)], 4, launcher, clock)
+        scheduler.step()
+        bay, levy = scheduler.crawls
+
+        # A bay worker crashes, eg. after the portal starts refusing requests
+        bay.workers[1].returncode = 1
+        clock.now += 300
+        report_progress(levy, 50)
+        scheduler.step()
+        assert bay.limit == 1
+        assert [len(crawl.workers) for crawl in scheduler.crawls] == [1, 3]
+
+        # Failed cases in the remaining bay worker's dead letters pause the portal
+        dead_letters = DeadLetters(in_tmpdir.join('bay-scraped.w2.csv.failed.sqlite').strpath)
+        dead_letters.add('19000001', 'Page could not be loaded')
+        dead_letters.close()
+        clock.now += 300
+        scheduler.step()
+        assert [len(crawl.workers) for crawl in scheduler.crawls] == [0, 3]
+
+        # After the cooldown, bay gets a worker back
+        for _ in range(2):
+            clock.now += 300
+            scheduler.step()
+        assert len(bay.workers) == 1
+
+    def test_capacity_moves_from_slow_portal(self, in_tmpdir, launcher, clock):
+        scheduler = make_scheduler([make_portal('bay', 2), make_portal('levy', 2), make_portal('gulf', 2)], 4,
+                                   launcher, clock)
+        scheduler.step()
+        bay, levy, gulf = scheduler.crawls
+        assert [len(crawl.workers) for crawl in scheduler.crawls] == [2, 1, 1]
+
+        clock.now += 60
+        report_progress(bay, 2)
+        report_progress(levy, 40)
+        report_progress(gulf, 40)
+        scheduler.step()
+        assert bay.throughput == 1.0
+        assert [len(crawl.workers) for crawl in scheduler.crawls] == [1, 2, 1]
+
+    def test_finished_portal_frees_capacity(self, in_tmpdir, launcher, clock):
+        scheduler = make_scheduler([make_portal('bay', 2), make_portal('levy', 2)], 2, launcher, clock)
+        scheduler.step()
+        bay, levy = scheduler.crawls
+        for crawl in scheduler.crawls:
+            assert len(crawl.workers) == 1
+
+        # Bay's work is all done, and its worker exits
+        unit = bay.work_queue.acquire('test')
+        bay.work_queue.complete(unit['id'], 'test', end_of_year=True)
+        bay.workers[1].returncode = 0
+        clock.now += 300
+        assert scheduler.step()
+        assert bay.finished()
+        assert len(levy.workers) == 2
+
+        scheduler.stop_all()
+        assert len(levy.workers) == 0
+        levy_processes = [process for process in launcher.processes
+                          if process.args[process.args.index('--node-id') + 1].startswith('levy')]
+        assert len(levy_processes) == 2 and all(process.signalled for process in levy_processes)
@@ -0,0 +1,76 @@
+from utils.PortalSession import PortalSession
+
+PORTAL_BASE = 'https://court.baycoclerk.com/BenchmarkWeb2/'
+
+
+class FakeDriver:
+    def __init__(self, cookies, captcha=True):
+        self.cookies = cookies
+        self.captcha = captcha
+        self.cookie_reads = 0
+
+    def get_cookies(self):
+        self.cookie_reads += 1
+        return self.cookies
+
+    def delete_all_cookies(self):
+        self.cookies = []
+
+    def execute_script(self, script):
+        return 'Mozilla/5.0'
+
+    def find_elements_by_xpath(self, xpath):
+        return ['captcha'] if self.captcha else []
+
+
+class TestPortalSession:
+
+    def test_captcha_required(self):
+        assert PortalSession.captcha_required(FakeDriver([], captcha=True))
+        assert not PortalSession.captcha_required(FakeDriver([], captcha=False))
+
+    def test_searches_per_captcha(self):
+        session = PortalSession(PORTAL_BASE)
+        session.captcha_solved()
+        for _ in range(4):
+            session.search_succeeded()
+        session.captcha_solved()
+        for _ in range(2):
+            session.search_succeeded()
+        assert session.searches_per_captcha() == 3
+        assert session.most_searches_per_session == 4
+
+    def test_http_session_reused(self):
+        driver = FakeDriver([{'name': 'ASP.NET_SessionId', 'value': 'abc'}, {'name': 'captcha', 'value': '1'}])
+        session = PortalSession(PORTAL_BASE)
+        http_session, cookie_header = session.get_http_session(driver)
+        assert cookie_header == 'ASP.NET_SessionId=abc; captcha=1'
+        assert http_session.headers['Host'] == 'court.baycoclerk.com'
+        assert session.get_http_session(driver)[0] is http_session
+        assert driver.cookie_reads == 1
+
+    def test_http_session_refreshed_after_new_session(self):
+        driver = FakeDriver([{'name': 'ASP.NET_SessionId', 'value': 'abc'}])
+        session = PortalSession(PORTAL_BASE)
+        session.get_http_session(driver)
+        session.captcha_rejected(driver)
+        assert driver.cookies == []
+        assert session.get_http_session(driver)[1] == ''
+        assert driver.cookie_reads == 2
+
+    def test_pace_search(self):
+        now = [100.0]
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            now[0] += seconds
+
+        session = PortalSession(PORTAL_BASE, min_search_interval=10, clock=lambda: now[0], sleep=sleep)
+        session.pace_search()
+        now[0] += 4
+        session.pace_search()
+        now[0] += 15
+        session.pace_search()
+        assert slept == [6]
+        assert session.seconds_paced == 6
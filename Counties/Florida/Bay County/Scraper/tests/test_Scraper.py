@@ -0,0 +1,119 @@
+import pytest
+from selenium.common.exceptions import TimeoutException, NoSuchElementException
+
+import Scraper
+from utils.CaseSnapshot import CaseSnapshot
+from utils.DeadLetters import DeadLetters
+from utils.Pipeline import PipelineError
+from utils.SeenCases import SeenCases
+from factories import make_record
+
+
+class FakeDriver:
+    def __init__(self, title, captcha_alert):
+        self.title = title
+        self.captcha_alert = captcha_alert
+
+    def find_element_by_xpath(self, xpath):
+        if not self.captcha_alert:
+            raise NoSuchElementException()
+        return object()
+
+
+class FakeWait:
+    """WebDriverWait which times out while the page is 'loading'."""
+    def __init__(self, driver, timeout):
+        self.driver = driver
+
+    def until(self, condition):
+        if self.driver.title == 'loading':
+            raise TimeoutException()
+        return condition(self.driver)
+
+
+class FakeCaptchaSolver:
+    def __init__(self):
+        self.fails = 0
+
+    def notify_last_captcha_fail(self):
+        self.fails += 1
+
+
+class FakePortalSession:
+    def captcha_rejected(self, driver):
+        pass
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    started = []
+    monkeypatch.setattr(Scraper, 'start_search', lambda case_number: started.append(case_number) or True)
+    monkeypatch.setattr(Scraper, 'WebDriverWait', FakeWait)
+    monkeypatch.setattr(Scraper, 'captcha_solver', FakeCaptchaSolver())
+    monkeypatch.setattr(Scraper, 'portal_session', FakePortalSession())
+    monkeypatch.setitem(Scraper.settings, 'solve-captchas', True)
+    monkeypatch.setitem(Scraper.settings, 'connect-thresh', 3)
+    monkeypatch.setitem(Scraper.settings, 'captcha-thresh', 4)
+    return started
+
+
+@pytest.fixture
+def parse_errors(tmpdir, monkeypatch):
+    """
+    Starts Scraper's pipeline, parsing a record for each case put on it.
+    :return: Dict of PortalID to the error parsing the case raises
+    """
+    errors = {}
+
+    def parse_record(snapshot, state_code, county, collect_pii, record_id):
+        if snapshot.case_number in errors:
+            raise errors[snapshot.case_number]
+        return make_record(snapshot.case_number, charges=1)
+
+    output_file = tmpdir.join('out.csv').strpath
+    monkeypatch.setattr(Scraper, 'parse_record', parse_record)
+    monkeypatch.setattr(Scraper, 'output_file', output_file)
+    monkeypatch.setattr(Scraper, 'seen_cases', SeenCases(tmpdir.join('out.seen').strpath, output_file))
+    monkeypatch.setattr(Scraper, 'dead_letters', DeadLetters(tmpdir.join('out.failed.sqlite').strpath))
+    monkeypatch.setitem(Scraper.settings, 'collect-pii', False)
+    monkeypatch.setattr(Scraper, 'pipeline', Scraper.start_pipeline())
+    return errors
+
+
+def put_case(portal_id):
+    Scraper.seen_cases.add_pending(portal_id)
+    Scraper.pipeline.put('extract', CaseSnapshot(portal_id, 'https://portal.example/case', '', ''))
+
+
+class TestScraper:
+
+    def test_case_failing_in_pipeline_saved_to_retry(self, parse_errors):
+        parse_errors['19000002CFMA'] = ValueError('Unexpected page')
+        for portal_id in ('19000001CFMA', '19000002CFMA', '19000003CFMA'):
+            put_case(portal_id)
+        Scraper.pipeline.close()
+        assert '19000003CFMA' in Scraper.seen_cases
+        assert not Scraper.seen_cases.scrape_done('19000002CFMA')
+        letters = Scraper.dead_letters.letters()
+        assert [letter['case_number'] for letter in letters] == ['19000002CFMA']
+        assert 'extract' in letters[0]['reason']
+
+    def test_infrastructure_error_stops_crawl(self, parse_errors):
+        parse_errors['19000001CFMA'] = OSError('No space left on device')
+        put_case('19000001CFMA')
+        with pytest.raises(PipelineError):
+            Scraper.pipeline.close()
+        assert Scraper.dead_letters.letters() == []
+
+    def test_search_gives_up_after_timeouts(self, searches, monkeypatch):
+        monkeypatch.setattr(Scraper, 'driver', FakeDriver('loading', False))
+        with pytest.raises(RuntimeError):
+            Scraper.search_portal('19000001')
+        assert len(searches) == 3
+
+    def test_search_gives_up_after_captcha_rejections(self, searches, monkeypatch):
+        monkeypatch.setattr(Scraper, 'driver', FakeDriver('Search', True))
+        with pytest.raises(RuntimeError):
+            Scraper.search_portal('19000001')
+        assert len(searches) == 4
+        assert Scraper.captcha_solver.fails == 4
@@ -1,8 +1,31 @@
 import pytest
 from utils import ScraperUtils
+from utils.ScraperUtils import Charge
+from factories import make_record, make_charge
 import os
 
 
+class FakeElement:
+    def __init__(self, text='', attributes=None, children=None):
+        self.text = text
+        self.attributes = attributes or {}
+        self.children = children or {}
+
+    def get_attribute(self, name):
+        return self.attributes.get(name)
+
+    def find_elements_by_tag_name(self, tag):
+        return self.children.get(tag, [])
+
+
+class FakeDriver:
+    def __init__(self, elements_by_class):
+        self.elements_by_class = elements_by_class
+
+    def find_elements_by_class_name(self, name):
+        return self.elements_by_class.get(name, [])
+
+
 class TestScraperUtils:
 
     def test_parse_plea_case_numbers_blank(self):
@@ -66,6 +89,11 @@ class TestScraperUtils:
         assert ScraperUtils.parse_attorneys(invalid_test) is None
         assert ScraperUtils.parse_attorneys(invalid_test2) is None
 
+    def test_output_variant(self):
+        assert ScraperUtils.output_variant('bay.csv', 'retried') == 'bay.retried.csv'
+        assert ScraperUtils.output_variant('out/bay.CSV.GZ', 'retried') == 'out/bay.retried.CSV.GZ'
+        assert ScraperUtils.output_variant('bay', 'retried') == 'bay.retried.csv'
+
     def test_parse_out_path_illegal_characters(self):
         filename_invalid_chars = 't<>:e"/s\\t|?n*ame'
         assert ScraperUtils.parse_out_path('', filename_invalid_chars, 'pdf') == os.path.join('', 'testname.pdf')
@@ -97,3 +125,72 @@ class TestScraperUtils:
         filename_too_long = '01234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789012345678901234567890123456789'
         parsed_path = ScraperUtils.parse_out_path(os.getcwd(), filename_too_long, 'txt')
         assert len(parsed_path) <= 256
+
+    def test_charge_shares_repeated_strings(self):
+        charge1 = Charge(1, ''.join(['812.014', '(2C1)']), 'GRAND THEFT', 'F', '3', 'NOLLE PROSSE', '01/02/2019', None,
+                         None, None, None)
+        charge2 = Charge(1, ''.join(['812.014', '(2C1)']), 'GRAND THEFT', 'F', '3', 'NOLLE PROSSE', '01/02/2019', None,
+                         None, None, None)
+        assert charge1.statute is charge2.statute
+        assert not hasattr(charge1, '__dict__')
+
+    def test_record_shares_repeated_strings(self):
+        record1 = make_record(race=''.join(['Whi', 'te']))
+        record2 = make_record(race=''.join(['Whi', 'te']))
+        assert record1.race is record2.race
+        assert record1 == record2
+        assert not hasattr(record1, '__dict__')
+
+    def write_test_csv(self, path, portal_ids, description='GRAND THEFT'):
+        for portal_id in portal_ids:
+            ScraperUtils.write_csv(path, make_record(portal_id, [make_charge(description=description)]))
+
+    def test_get_last_csv_row(self, tmpdir):
+        path = tmpdir.join('out.csv').strpath
+        self.write_test_csv(path, ['19000001CFMA', '19000002CFMA'])
+        row = ScraperUtils.get_last_csv_row(path)
+        assert row[3] == '19000002CFMA'
+
+    def test_get_last_csv_row_header_only(self, tmpdir):
+        path = tmpdir.join('out.csv')
+        path.write('_id,_state,PortalID\n')
+        assert ScraperUtils.get_last_csv_row(path.strpath) is None
+
+    def test_get_last_csv_row_long_row(self, tmpdir):
+        # Final row is much longer than the first block read from the end of the file, and contains newlines.
+        path = tmpdir.join('out.csv').strpath
+        long_description = 'LONG DESCRIPTION,\n' * 1000
+        self.write_test_csv(path, ['19000001CFMA', '19000002CFMA'], long_description)
+        row = ScraperUtils.get_last_csv_row(path)
+        assert row[3] == '19000002CFMA'
+        assert row[24] == long_description
+
+    def test_get_last_csv_row_torn_row(self, tmpdir):
+        path = tmpdir.join('out.csv').strpath
+        self.write_test_csv(path, ['19000001CFMA', '19000002CFMA'])
+        size = os.path.getsize(path)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('id,FL,Bay,19000003CFMA,"PARTIAL\nDESCRIPTION')
+
+        assert ScraperUtils.get_last_csv_row(path)[3] == '19000002CFMA'
+        assert os.path.getsize(path) > size
+        assert ScraperUtils.get_last_csv_row(path, truncate_torn_row=True)[3] == '19000002CFMA'
+        assert os.path.getsize(path) == size
+
+    def test_get_last_portal_id(self, tmpdir):
+        # Associated cases are written in any order, so the last row is not necessarily the furthest case.
+        path = tmpdir.join('out.csv').strpath
+        self.write_test_csv(path, ['19000001CFMA', '19000005CFMA', '19000003CFMA'])
+        assert ScraperUtils.get_last_portal_id(path) == '19000005CFMA'
+
+    def test_get_last_portal_id_previous_year(self, tmpdir):
+        path = tmpdir.join('out.csv').strpath
+        self.write_test_csv(path, ['19000009CFMA', '18000001CFMA'])
+        assert ScraperUtils.get_last_portal_id(path) == '18000001CFMA'
+
+    def test_get_associated_cases(self):
+        link = FakeElement('19000001CFMA', {'href': 'https://portal/CourtCase.aspx/Details/1'})
+        driver = FakeDriver({'sorting_1': [FakeElement('19000001CFMA', children={'a': [link]}),
+                                           FakeElement('19000001MMMA')]})
+        assert ScraperUtils.get_associated_cases(driver) == {'19000001CFMA': 'https://portal/CourtCase.aspx/Details/1',
+                                                             '19000001MMMA': None}
@@ -0,0 +1,75 @@
+from utils.SeenCases import SeenCases
+
+
+class TestSeenCases:
+
+    def test_add_and_persist(self, tmpdir):
+        seen_file = tmpdir.join('out.csv.seen').strpath
+        seen = SeenCases(seen_file)
+        seen.add('19000001CFMA')
+        seen.add('19000001CFMA')
+        assert '19000001CFMA' in seen
+
+        reloaded = SeenCases(seen_file)
+        assert '19000001CFMA' in reloaded
+        assert len(reloaded) == 1
+        assert tmpdir.join('out.csv.seen').read() == '19000001CFMA\n'
+
+    def test_search_done(self, tmpdir):
+        seen = SeenCases(tmpdir.join('out.csv.seen').strpath)
+        seen.add('19000005MMMA')
+        # Never searched for, so it is not known which cases the search finds
+        assert not seen.search_done('19000005')
+        seen.add_search('19000005', ['19000005MMMA'])
+        assert seen.search_done('19000005')
+        assert not seen.search_done('19000006')
+        assert seen.searches_saved == 1
+
+        reloaded = SeenCases(tmpdir.join('out.csv.seen').strpath)
+        assert reloaded.search_done('19000005')
+        assert tmpdir.join('out.csv.searches').read() == '19000005\t19000005MMMA\n'
+
+    def test_search_retried_after_failed_sibling(self, tmpdir):
+        seen = SeenCases(tmpdir.join('out.csv.seen').strpath)
+        seen.add_search('19000005', ['19000005CFMA', '19000005MMMA'])
+        # 19000005CFMA is scraped, then scraping 19000005MMMA fails
+        seen.add('19000005CFMA')
+        assert not seen.search_done('19000005')
+
+        # Retried: the search is done again, and only the failed sibling is scraped
+        seen.add_search('19000005', ['19000005CFMA', '19000005MMMA'])
+        assert seen.scrape_done('19000005CFMA')
+        assert not seen.scrape_done('19000005MMMA')
+        assert not seen.search_written('19000005')
+        seen.add('19000005MMMA')
+        assert seen.search_done('19000005')
+        assert seen.search_written('19000005')
+        assert tmpdir.join('out.csv.searches').read() == '19000005\t19000005CFMA\t19000005MMMA\n'
+
+    def test_scrape_done(self, tmpdir):
+        seen = SeenCases(tmpdir.join('out.csv.seen').strpath)
+        seen.add('19000005MMMA')
+        assert seen.scrape_done('19000005MMMA')
+        assert not seen.scrape_done('19000005CFMA')
+        assert seen.scrapes_saved == 1
+
+    def test_seeded_from_output(self, tmpdir):
+        output = tmpdir.join('out.csv')
+        output.write('_id,_state,_county,PortalID\nid1,FL,Bay,19000001CFMA\nid2,FL,Bay,19000001CFMA\n'
+                     'id3,FL,Bay,19000002\n')
+        seen = SeenCases(tmpdir.join('out.csv.seen').strpath, output.strpath)
+        assert len(seen) == 2
+        assert '19000002' in seen
+        assert tmpdir.join('out.csv.seen').check()
+
+    def test_pending_not_saved_until_added(self, tmpdir):
+        seen_file = tmpdir.join('out.csv.seen')
+        seen = SeenCases(seen_file.strpath)
+        seen.add_search('19000005', ['19000005MMMA'])
+        seen.add_pending('19000005MMMA')
+        assert seen.search_done('19000005')
+        assert seen.scrape_done('19000005MMMA')
+        assert not seen_file.exists() or seen_file.read() == ''
+        seen.add('19000005MMMA')
+        assert seen_file.read() == '19000005MMMA\n'
+        assert len(seen.pending) == 0
@@ -0,0 +1,56 @@
+import io
+import pytest
+from analysis import StreamingAggregator
+from utils import ScraperUtils
+from factories import make_record, make_charge
+
+
+@pytest.fixture
+def scraped_csv(tmpdir):
+    path = tmpdir.join('scraped.csv').strpath
+    ScraperUtils.write_csv(path, make_record('19000001CFMA', race='W', sex='M', filing_date='01/02/2019', charges=[
+        make_charge(1, '812.014(2C1)', 'NOLLE PROSSE'),
+        make_charge(2, '843.02', 'NOLLE PROSSE', 'RESIST OFFICER,\nWITHOUT VIOLENCE')]))
+    ScraperUtils.write_csv(path, make_record('18000002CFMA', race='B', sex='F', filing_date='03/04/2018', charges=[
+        make_charge(1, '812.014(2C1)', '')]))
+    return path
+
+
+class TestStreamingAggregator:
+
+    def test_scraped_schema(self, scraped_csv):
+        totals = StreamingAggregator.aggregate_csv(scraped_csv)
+        assert totals['rows']['total'] == 3
+        assert totals['statute'] == {'812.014(2C1)': 2, '843.02': 1}
+        assert totals['disposition'] == {'NOLLE PROSSE': 2, None: 1}
+        assert totals['race_sex'] == {('W', 'M'): 2, ('B', 'F'): 1}
+        assert totals['year'] == {'2019': 2, '2018': 1}
+
+    def test_felonies_schema(self, tmpdir):
+        path = tmpdir.join('felonies.csv')
+        path.write_text('Race,Sex,FilingDate,ChargeStatute,ChargeDisposition,,\n'
+                        'W,M,12/2/2019,322.34(2C),\xa0,,\n'
+                        'W,M,1/2/2014,322.34(2C),NO FILE,,\n', encoding='utf-8')
+        totals = StreamingAggregator.aggregate_csv(path.strpath)
+        assert totals['statute'] == {'322.34(2C)': 2}
+        assert totals['disposition'] == {None: 1, 'NO FILE': 1}
+        assert totals['year'] == {'2019': 1, '2014': 1}
+
+    def test_missing_columns(self, tmpdir):
+        path = tmpdir.join('other.csv')
+        path.write_text('a,b\n1,2\n', encoding='utf-8')
+        with pytest.raises(ValueError):
+            StreamingAggregator.aggregate_csv(path.strpath)
+
+    def test_blocks_end_on_row_boundary(self):
+        data = b'a,"multi\nline",c\nd,e,f\ng,"h\n\ni",j\n'
+        for block_size in range(1, len(data) + 1):
+            blocks = list(StreamingAggregator.iter_blocks(io.BytesIO(data), block_size))
+            assert b''.join(blocks) == data
+            for block in blocks:
+                assert block.count(b'"') % 2 == 0
+
+    def test_process_pool_matches_serial(self, scraped_csv):
+        serial = StreamingAggregator.aggregate_csv(scraped_csv)
+        pooled = StreamingAggregator.aggregate_csv(scraped_csv, processes=2, memory_cap=1)
+        assert serial == pooled
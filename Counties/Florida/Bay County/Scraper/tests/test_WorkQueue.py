@@ -0,0 +1,170 @@
+import threading
+import pytest
+import requests
+from utils.WorkQueue import WorkQueue, RemoteWorkQueue, WorkQueueServer, with_retries, DONE, SKIPPED, PENDING, FAILED
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def work_queue(tmpdir, clock):
+    queue = WorkQueue(tmpdir.join('work.sqlite').strpath, clock)
+    queue.add_years(2018, 2019, cases_per_unit=100, max_case=300)
+    yield queue
+    queue.close()
+
+
+class TestWorkQueue:
+
+    def test_units_created_once(self, work_queue):
+        assert work_queue.status() == {PENDING: 6}
+        assert work_queue.add_years(2018, 2019, cases_per_unit=100, max_case=300) == 0
+
+    def test_acquire_latest_year_first(self, work_queue):
+        unit1 = work_queue.acquire('node1')
+        unit2 = work_queue.acquire('node2')
+        assert (unit1['year'], unit1['first_case'], unit1['last_case']) == (2019, 1, 100)
+        assert (unit2['year'], unit2['first_case'], unit2['last_case']) == (2019, 101, 200)
+
+    def test_expired_lease_reassigned_from_progress(self, work_queue, clock):
+        unit = work_queue.acquire('node1', lease_seconds=60)
+        assert work_queue.heartbeat(unit['id'], 'node1', next_case=42, lease_seconds=60)
+
+        clock.now += 61
+        reassigned = work_queue.acquire('node2')
+        assert reassigned['id'] == unit['id']
+        assert reassigned['next_case'] == 42
+        # The original node has lost the lease
+        assert not work_queue.heartbeat(unit['id'], 'node1', next_case=43)
+        assert not work_queue.complete(unit['id'], 'node1')
+
+    def test_heartbeat_keeps_lease(self, work_queue, clock):
+        unit = work_queue.acquire('node1', lease_seconds=60)
+        clock.now += 50
+        work_queue.heartbeat(unit['id'], 'node1', lease_seconds=60)
+        clock.now += 50
+        assert work_queue.acquire('node2')['id'] != unit['id']
+
+    def test_end_of_year_skips_later_units(self, work_queue):
+        unit = work_queue.acquire('node1')
+        assert work_queue.complete(unit['id'], 'node1', end_of_year=True)
+        assert work_queue.status() == {DONE: 1, SKIPPED: 2, PENDING: 3}
+        assert work_queue.acquire('node1')['year'] == 2018
+
+    def test_release(self, work_queue):
+        unit = work_queue.acquire('node1', lease_seconds=300)
+        work_queue.heartbeat(unit['id'], 'node1', next_case=41)
+        assert work_queue.release(unit['id'], 'node1')
+        assert not work_queue.heartbeat(unit['id'], 'node1', next_case=42)
+        assert work_queue.available() == 6
+        unit = work_queue.acquire('node2')
+        assert unit['next_case'] == 41
+
+    def test_unit_failing_every_node_given_up(self, tmpdir, clock):
+        work_queue = WorkQueue(tmpdir.join('capped.sqlite').strpath, clock, max_attempts=2)
+        work_queue.add_years(2019, 2019, cases_per_unit=100, max_case=100)
+        unit = work_queue.acquire('node1', lease_seconds=60)
+        # Stopping a node doesn't count as an attempt
+        assert work_queue.release(unit['id'], 'node1', stopped=True)
+        unit = work_queue.acquire('node2', lease_seconds=60)
+        assert work_queue.release(unit['id'], 'node2')
+        unit = work_queue.acquire('node3', lease_seconds=60)
+        # node3 dies and its lease expires
+        clock.now += 61
+        assert work_queue.acquire('node4') is None
+        assert work_queue.status() == {FAILED: 1}
+        assert not work_queue.heartbeat(unit['id'], 'node3', next_case=2)
+        work_queue.close()
+
+    def test_with_retries(self):
+        calls = []
+        delays = []
+
+        def heartbeat(unit_id):
+            calls.append(unit_id)
+            if len(calls) < 3:
+                raise requests.ConnectionError('Connection refused')
+            return True
+
+        assert with_retries(heartbeat, 1, sleep=delays.append)
+        assert delays == [1, 2]
+        calls.clear()
+        with pytest.raises(requests.ConnectionError):
+            with_retries(heartbeat, 1, retries=1, sleep=delays.append)
+        assert len(calls) == 2
+
+    def test_no_work_left(self, work_queue):
+        for _ in range(6):
+            unit = work_queue.acquire('node1')
+            work_queue.complete(unit['id'], 'node1', end_of_year=unit['first_case'] == 201)
+        assert work_queue.acquire('node1') is None
+
+    def test_year_extended_until_end_found(self, work_queue):
+        for _ in range(3):
+            unit = work_queue.acquire('node1')
+            work_queue.complete(unit['id'], 'node1')
+        # The end of 2019 was not found by case 300, so the year continues
+        unit = work_queue.acquire('node1')
+        assert (unit['year'], unit['first_case'], unit['last_case']) == (2019, 301, 400)
+        work_queue.complete(unit['id'], 'node1', end_of_year=True)
+        assert work_queue.acquire('node1')['year'] == 2018
+        assert work_queue.status() == {DONE: 4, 'leased': 1, PENDING: 2}
+
+    def test_available(self, work_queue, clock):
+        assert work_queue.available() == 6
+        work_queue.acquire('node1', lease_seconds=60)
+        assert work_queue.available() == 5
+        clock.now += 61
+        assert work_queue.available() == 6
+
+    def test_progress(self, work_queue):
+        assert work_queue.progress() == 0
+        unit = work_queue.acquire('node1')
+        work_queue.heartbeat(unit['id'], 'node1', next_case=41)
+        assert work_queue.progress() == 40
+        work_queue.complete(unit['id'], 'node1', end_of_year=True)
+        assert work_queue.progress() == 100
+
+    def test_remote_work_queue(self, work_queue):
+        server = WorkQueueServer(work_queue, ('127.0.0.1', 0))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            remote = RemoteWorkQueue('http://127.0.0.1:{}/'.format(server.server_address[1]))
+            unit = remote.acquire('node1')
+            assert unit['year'] == 2019
+            assert remote.heartbeat(unit['id'], 'node1', 10)
+            assert remote.release(unit['id'], 'node1')
+            unit = remote.acquire('node1')
+            assert unit['next_case'] == 10
+            assert remote.complete(unit['id'], 'node1')
+            assert remote.status()[DONE] == 1
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_remote_work_queue_error(self, tmpdir):
+        broken = WorkQueue(tmpdir.join('broken.sqlite').strpath)
+        broken.close()
+        server = WorkQueueServer(broken, ('127.0.0.1', 0))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            remote = RemoteWorkQueue('http://127.0.0.1:{}/'.format(server.server_address[1]))
+            with pytest.raises(requests.HTTPError) as err:
+                remote.acquire('node1')
+            assert err.value.response.status_code == 500
+        finally:
+            server.shutdown()
+            server.server_close()
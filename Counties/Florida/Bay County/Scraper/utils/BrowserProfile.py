@@ -0,0 +1,114 @@
+import base64
+from urllib.parse import quote, urlsplit
+from selenium import webdriver
+
+# Proxy address which refuses all connections. Requests routed here by the PAC script fail immediately.
+BLOCKING_PROXY = 'PROXY 127.0.0.1:9'
+
+# Preferences for repeated navigation around the same portal.
+CACHE_PREFERENCES = {
+    'browser.cache.disk.enable': True,
+    'browser.cache.memory.enable': True,
+    'browser.cache.disk.smart_size.enabled': False,
+    'browser.cache.disk.capacity': 256000,  # KB
+    'network.http.max-persistent-connections-per-server': 6,
+    # The scraper never goes back, so history entries only use memory.
+    'browser.sessionhistory.max_entries': 2,
+    'browser.sessionhistory.max_total_viewers': 0,
+    # Don't fetch anything speculatively.
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+    'network.http.speculative-parallel-limit': 0,
+}
+
+# Preferences which stop the browser downloading resources the scraper does not need.
+BLOCKING_PREFERENCES = {
+    # 2 = Block all images. The captcha is fetched separately, see get_captcha_png.
+    'permissions.default.image': 2,
+    'gfx.downloadable_fonts.enabled': False,
+    'browser.display.use_document_fonts': 0,
+    'media.autoplay.default': 5,
+    'network.proxy.failover_direct': False,
+}
+
+
+def build_pac_script(allowed_hosts):
+    """
+    Builds a proxy auto-config script which only lets requests to the allowed hosts through.
+    :param allowed_hosts: Host names the browser may connect to. Eg: ['court.baycoclerk.com']
+    :return: PAC script as str
+    """
+    conditions = ' || '.join('host == "{}"'.format(host) for host in allowed_hosts) or 'false'
+    return 'function FindProxyForURL(url, host) {{ if ({}) return "DIRECT"; return "{}"; }}'.format(
+        conditions, BLOCKING_PROXY)
+
+
+def build_firefox_options(portal_base, headless=False, lean=False, allowed_hosts=()):
+    """
+    Builds the Firefox options used for scraping.
+    A lean profile blocks images, fonts and requests to any host other than the portal, and tunes the
+    cache for repeat navigation to the same portal.
+    :param portal_base: Base URL for the portal. Eg: 'https://court.baycoclerk.com/BenchmarkWeb2/'
+    :param headless: Run Firefox without a visible window
+    :param lean: Use the lean profile
+    :param allowed_hosts: Other hosts the lean profile may connect to, eg. if the portal loads scripts from a CDN.
+    :return: webdriver.FirefoxOptions
+    """
+    ffx_profile = webdriver.FirefoxOptions()
+    # Automatically dismiss unexpected alerts.
+    ffx_profile.set_capability('unexpectedAlertBehaviour', 'dismiss')
+    if headless:
+        ffx_profile.add_argument('-headless')
+
+    if lean:
+        for pref, value in CACHE_PREFERENCES.items():
+            ffx_profile.set_preference(pref, value)
+        for pref, value in BLOCKING_PREFERENCES.items():
+            ffx_profile.set_preference(pref, value)
+        hosts = [urlsplit(portal_base).hostname] + list(allowed_hosts)
+        # 2 = Use a proxy auto-config script
+        ffx_profile.set_preference('network.proxy.type', 2)
+        ffx_profile.set_preference('network.proxy.autoconfig_url',
+                                   'data:application/x-ns-proxy-autoconfig,' + quote(build_pac_script(hosts)))
+
+    return ffx_profile
+
+
+# Fetches the captcha image with the page's cookies and re-encodes it as a PNG via a canvas.
+# The <img> itself is never loaded when images are blocked, so this is the only time the captcha is requested.
+FETCH_IMAGE_SCRIPT = '''
+var img = arguments[0];
+var done = arguments[arguments.length - 1];
+fetch(img.src, {credentials: 'same-origin'})
+    .then(function (response) { return response.blob(); })
+    .then(function (blob) {
+        var loaded = new Image();
+        loaded.onload = function () {
+            var canvas = document.createElement('canvas');
+            canvas.width = loaded.naturalWidth;
+            canvas.height = loaded.naturalHeight;
+            canvas.getContext('2d').drawImage(loaded, 0, 0);
+            URL.revokeObjectURL(loaded.src);
+            done(canvas.toDataURL('image/png').split(',')[1]);
+        };
+        loaded.onerror = function () { done(null); };
+        loaded.src = URL.createObjectURL(blob);
+    })
+    .catch(function () { done(null); });
+'''
+
+
+def get_captcha_png(driver, captcha_image_elem, lean=False):
+    """
+    Gets the captcha image as PNG bytes.
+    :param driver: Selenium driver
+    :param captcha_image_elem: Captcha <img> element
+    :param lean: True if the browser is using the lean profile, where images are not loaded.
+    :return: PNG bytes, or None if the image could not be fetched.
+    """
+    if not lean:
+        return captcha_image_elem.screenshot_as_png
+    png_base64 = driver.execute_async_script(FETCH_IMAGE_SCRIPT, captcha_image_elem)
+    if png_base64 is None:
+        return None
+    return base64.b64decode(png_base64)
@@ -0,0 +1,139 @@
+import sys
+import time
+
+import psutil
+from selenium.common.exceptions import WebDriverException
+
+
+def browser_processes(driver):
+    """
+    :param driver: Selenium driver
+    :return: List of psutil.Process for the webdriver (eg. geckodriver) and every browser process it started.
+    """
+    try:
+        process = psutil.Process(driver.service.process.pid)
+        return [process] + process.children(recursive=True)
+    except (AttributeError, psutil.Error):
+        return []
+
+
+def browser_rss(driver):
+    """
+    :param driver: Selenium driver
+    :return: Total resident memory of the browser and webdriver processes, in bytes.
+    """
+    total = 0
+    for process in browser_processes(driver):
+        try:
+            total += process.memory_info().rss
+        except psutil.Error:
+            # Content processes come and go
+            pass
+    return total
+
+
+class BrowserSupervisor:
+    """
+    Restarts the browser before it slows down or hangs. Firefox's memory grows the longer it runs, so it is replaced
+    after a number of cases, or when its resident memory passes a limit. It is also replaced when a case fails because
+    pages stopped loading, and the case is retried in the new browser.
+    """
+
+    def __init__(self, start_browser, max_rss_mb=2048, max_cases=1000, max_retries=2, clock=time.time):
+        """
+        :param start_browser: Function which starts a browser and returns its driver.
+        :param max_rss_mb: Restart once the browser uses this much memory. 0 for no limit.
+        :param max_cases: Restart after this many cases. 0 for no limit.
+        :param max_retries: Times a failed case is retried in a new browser before the error is raised.
+        :param clock: Time function, replaceable in tests.
+        """
+        self.start_browser = start_browser
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.max_cases = max_cases
+        self.max_retries = max_retries
+        self.clock = clock
+
+        self.cases = 0
+        self.case_seconds = 0.0
+        self.restarts = {'memory': 0, 'cases': 0, 'failure': 0}
+        self.last_rss = 0
+
+    def run_case(self, driver, scrape_case):
+        """
+        Scrapes a case, restarting the browser and retrying the case if it fails with a page load error or the browser
+        stops responding. Cases written before the failure are not scraped again, as they are in the seen cases.
+        :param driver: Current Selenium driver
+        :param scrape_case: Function which scrapes the case with the current driver and returns its result.
+        :return: (result of scrape_case, driver to use from now on)
+        """
+        attempt = 0
+        while True:
+            started = self.clock()
+            try:
+                result = scrape_case()
+                break
+            except (RuntimeError, WebDriverException) as err:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                print('Restarting browser after error (retry {}/{}): {}'.format(attempt, self.max_retries, err),
+                      file=sys.stderr)
+                driver = self.restart(driver, 'failure')
+
+        self.cases += 1
+        self.case_seconds += self.clock() - started
+        reason = self.restart_reason(driver)
+        if reason is not None:
+            print('Restarting browser after {} cases ({} MB)'.format(self.cases, self.last_rss // (1024 * 1024)))
+            driver = self.restart(driver, reason)
+        return result, driver
+
+    def restart_reason(self, driver):
+        """
+        :return: 'cases' or 'memory' if the browser should be restarted, otherwise None.
+        """
+        if self.max_cases and self.cases >= self.max_cases:
+            return 'cases'
+        if self.max_rss:
+            self.last_rss = browser_rss(driver)
+            if self.last_rss >= self.max_rss:
+                return 'memory'
+        return None
+
+    def restart(self, driver, reason):
+        """
+        Quits the browser, kills any of its processes which are left (eg. if it had hung), and starts a new browser.
+        :return: New Selenium driver
+        """
+        self.restarts[reason] += 1
+        self.cases = 0
+        self.case_seconds = 0.0
+        processes = browser_processes(driver)
+        try:
+            driver.quit()
+        except (WebDriverException, OSError):
+            pass
+        for process in processes:
+            try:
+                process.terminate()
+            except psutil.Error:
+                pass
+        alive = psutil.wait_procs(processes, timeout=5)[1]
+        for process in alive:
+            try:
+                process.kill()
+            except psutil.Error:
+                pass
+        return self.start_browser()
+
+    def mean_case_seconds(self):
+        """
+        :return: Average time per case since the browser was started
+        """
+        return self.case_seconds / max(self.cases, 1)
+
+    def summary(self):
+        return 'Browser restarted {} times ({} for memory, {} for case count, {} after failures). ' \
+               'Current browser: {} cases, {:.1f}s per case, {} MB.'.format(
+                   sum(self.restarts.values()), self.restarts['memory'], self.restarts['cases'],
+                   self.restarts['failure'], self.cases, self.mean_case_seconds(), self.last_rss // (1024 * 1024))
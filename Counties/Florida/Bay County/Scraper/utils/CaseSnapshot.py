@@ -0,0 +1,182 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from lxml import html
+
+import utils.ScraperUtils as ScraperUtils
+from utils.ScraperUtils import Record, Charge
+
+# Locations of fields on the case page and the defendant's party details page
+SUMMARY_COLUMN = '//*[@id="summaryAccordionCollapse"]/table/tbody/tr/td[{}]/dl/dd'
+CHARGE_ROWS = '//*[@id="gridCharges"]/tbody/tr'
+DOCKET_PUBLIC_DEFENDER = "//*[contains(text(), 'COURT APPOINTED ATTORNEY') and contains(text(), 'ASSIGNED')]"
+DOCKET_ATTORNEY = "//*[contains(text(), 'DEFENSE') and contains(text(), 'ASSIGNED')]"
+DOCKET_PLEAS = "//*[contains(text(), 'PLEA OF')]"
+DOCKET_ATTACHMENTS = '//*[contains(concat(" ", normalize-space(@class), " "), " casedocketimage ")]'
+PARTY_TABLE = '//*[@id="mainTableContent"]/tbody/tr/td/table/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody'
+PARTY_RACE = '//*[@id="fd-table-2"]/tbody/tr[2]/td[2]/table[2]/tbody/tr/td[2]/table/tbody/tr[7]/td[2]'
+PARTY_SEX = PARTY_TABLE + '/tr[6]/td[2]'
+PARTY_NAME = PARTY_TABLE + '/tr[1]/td[2]'
+PARTY_ID = PARTY_TABLE + '/tr[8]/td[2]'
+
+
+@dataclass
+class CaseSnapshot:
+    """
+    Page sources of a scraped case, taken in the browser so they can be parsed in another thread.
+    """
+    case_number: str
+    case_url: str
+    case_html: str
+    party_html: str
+    # (requests.Session, Cookie header) copied from the browser, if attachments are to be downloaded.
+    http_session: Optional[tuple] = None
+    # The browser's String(new Date()), which the portal expects when requesting attachments.
+    javascript_time: Optional[str] = None
+
+
+@dataclass
+class Attachment:
+    name: str
+    cid: str
+    digest: str
+
+
+def element_text(element):
+    """
+    :return: Text of an element with whitespace collapsed, like Selenium's element.text
+    """
+    return ' '.join(element.text_content().split())
+
+
+def first_text(tree, xpath):
+    elements = tree.xpath(xpath)
+    return element_text(elements[0]) if len(elements) > 0 else None
+
+
+def parse_charges(case_tree):
+    """
+    :param case_tree: Parsed case page
+    :return: Dict of charge count to Charge, with pleas from the dockets applied.
+    """
+    charges = {}
+    for charge in case_tree.xpath(CHARGE_ROWS):
+        charge_details = charge.xpath('./td')
+        count = int(element_text(charge_details[0]))
+        long_desc = element_text(charge_details[1])
+        # Statute is contained within brackets
+        if '(' in long_desc and ')' in long_desc:
+            statute = long_desc[long_desc.find('(') + 1:long_desc.find(')')]
+        else:
+            statute = None
+        description = long_desc.split('(')[0]
+        level = element_text(charge_details[2])
+        degree = element_text(charge_details[3])
+        # Plea (charge_details[4]) is not filled out on this portal.
+        disposition = element_text(charge_details[5])
+        disposition_date = element_text(charge_details[6])
+        # Offense date and citation number are not shown on this portal
+        charges[count] = Charge(count, statute, description, level, degree, disposition, disposition_date, None, None,
+                                None, None)
+
+    # Pleas are not in the 'plea' field, but instead in the dockets.
+    for plea_element in case_tree.xpath(DOCKET_PLEAS):
+        plea_text = element_text(plea_element)
+        plea = ScraperUtils.parse_plea_type(plea_text)
+        plea_date = element_text(plea_element.xpath('./../td[2]')[0])
+        plea_number = ScraperUtils.parse_plea_case_numbers(plea_text, list(charges.keys()))
+
+        # If no case number is specified in the plea, then we assume it applies to all charges in the trial.
+        if len(plea_number) == 0:
+            for charge in charges.values():
+                charge.plea = plea
+                charge.plea_date = plea_date
+        else:
+            # Apply plea to relevant charge count(s).
+            for count in plea_number:
+                charges[count].plea = plea
+                charges[count].plea_date = plea_date
+    return charges
+
+
+def parse_record(snapshot: CaseSnapshot, state, county, collect_pii=False, record_id=None) -> Record:
+    """
+    Parses a case from the page sources taken by the browser.
+    :param snapshot: Page sources of the case
+    :param state: State code, eg. 'FL'
+    :param county: County, eg. 'Bay'
+    :param collect_pii: Collect Personally Identifiable Information
+    :param record_id: _id for the record
+    :return: Record
+    """
+    case_tree = html.fromstring(snapshot.case_html)
+    party_tree = html.fromstring(snapshot.party_html)
+
+    summary_table_col1 = [element_text(dd) for dd in case_tree.xpath(SUMMARY_COLUMN.format(1))]
+    summary_table_col2 = [element_text(dd) for dd in case_tree.xpath(SUMMARY_COLUMN.format(2))]
+    summary_table_col3 = [element_text(dd) for dd in case_tree.xpath(SUMMARY_COLUMN.format(3))]
+
+    CaseNum = summary_table_col2[1]
+    AgencyReportNum = summary_table_col1[4]
+    FilingDate = summary_table_col1[2]
+    DivisionName = summary_table_col3[3]
+    CaseStatus = summary_table_col3[1]
+
+    if collect_pii:
+        # Assigned defense attorney(s) and public defenders / appointed attorneys
+        DefenseAttorney = ScraperUtils.parse_attorneys([element_text(e) for e in case_tree.xpath(DOCKET_ATTORNEY)])
+        PublicDefender = ScraperUtils.parse_attorneys(
+            [element_text(e) for e in case_tree.xpath(DOCKET_PUBLIC_DEFENDER)])
+        Judge = summary_table_col1[0]
+    else:
+        DefenseAttorney = []
+        PublicDefender = []
+        Judge = None
+
+    Charges = parse_charges(case_tree)
+
+    Race = first_text(party_tree, PARTY_RACE)
+    Sex = first_text(party_tree, PARTY_SEX)
+    FirstName = None
+    MiddleName = None
+    LastName = None
+    PartyID = None
+
+    # Only collect PII if configured
+    if collect_pii:
+        full_name = first_text(party_tree, PARTY_NAME)
+        if ',' in full_name:
+            name_split = full_name.split(',')[1].lstrip().split()
+            FirstName = name_split[0]
+            MiddleName = " ".join(name_split[1:])
+            LastName = full_name.split(',')[0]
+        else:
+            # If there's no comma, it's a corporation name.
+            FirstName = full_name
+        # PartyID is a field within the portal system to uniquely identify defendants
+        PartyID = first_text(party_tree, PARTY_ID)
+
+    # Arrest date, offense date, suffix, DOB and arresting officer can't be found on this portal
+    return Record(record_id, state, county, snapshot.case_number, CaseNum, AgencyReportNum, PartyID, FirstName,
+                  MiddleName, LastName, None, None, Race, Sex, None, FilingDate, None, DivisionName, CaseStatus,
+                  DefenseAttorney, PublicDefender, Judge, list(Charges.values()), None, None)
+
+
+def parse_attachments(snapshot: CaseSnapshot, save_attachments) -> List[Attachment]:
+    """
+    :param snapshot: Page sources of the case
+    :param save_attachments: 'filing' for only attachments related to the case or citation filing, or 'all'.
+    :return: Docket attachments to download
+    """
+    if save_attachments not in ('filing', 'all'):
+        return []
+    attachments = []
+    for attachment_link in html.fromstring(snapshot.case_html).xpath(DOCKET_ATTACHMENTS):
+        attachment_text = element_text(attachment_link.xpath('./../../td[3]')[0])
+        if save_attachments == 'filing':
+            if not ('CITATION FILED' in attachment_text or 'CASE FILED' in attachment_text):
+                # Attachment is not a filing, don't download it.
+                continue
+        attachments.append(Attachment('{}-{}'.format(snapshot.case_number, attachment_text),
+                                      attachment_link.get('rel'), attachment_link.get('digest')))
+    return attachments
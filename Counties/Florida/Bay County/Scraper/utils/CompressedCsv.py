@@ -0,0 +1,180 @@
+import io
+import os
+import sys
+import csv
+import gzip
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    # Only needed for .zst output
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+FRAME_MAGIC = {GZIP: b'\x1f\x8b\x08', ZSTD: b'\x28\xb5\x2f\xfd'}
+
+DECODE_ERRORS = (zlib.error,) if zstandard is None else (zlib.error, zstandard.ZstdError)
+
+
+def compression_for(path):
+    """
+    :param path: Path to a CSV file
+    :return: 'gzip' for .gz files, 'zstd' for .zst files, or None if not compressed.
+    """
+    if path.endswith('.gz'):
+        return GZIP
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('The zstandard package is required for .zst files. Install it with: pip install zstandard')
+        return ZSTD
+    return None
+
+
+def compress_frame(data, compression):
+    """
+    Compresses data into a single frame, which can be decoded on its own.
+    :param data: Bytes to compress
+    :param compression: 'gzip' or 'zstd'
+    :return: Compressed bytes
+    """
+    if compression == GZIP:
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    return zstandard.ZstdCompressor(level=10, write_content_size=True).compress(data)
+
+
+def decompressobj(compression):
+    """
+    :return: Decompressor for one frame, with eof and unused_data attributes.
+    """
+    if compression == GZIP:
+        return zlib.decompressobj(wbits=31)
+    return zstandard.ZstdDecompressor().decompressobj()
+
+
+def append_frame(path, data, compression):
+    """
+    Appends data to a file as a new compressed frame. A file of frames is still a valid .gz or .zst file, and a crash
+    part way through writing a frame can't damage the frames before it.
+    :param path: Path to the compressed file
+    :param data: Bytes to append
+    :param compression: 'gzip' or 'zstd'
+    """
+    with open(path, 'ab') as f:
+        f.write(compress_frame(data, compression))
+
+
+def write_rows(path, rows, header=None):
+    """
+    Appends CSV rows to a compressed file as one frame. The header is written as its own frame when the file is created.
+    :param path: Path to the compressed CSV, ending in .gz or .zst
+    :param rows: List of rows
+    :param header: Header row, written if the file does not exist yet.
+    """
+    compression = compression_for(path)
+    if header is not None and not os.path.isfile(path):
+        append_frame(path, encode_rows([header]), compression)
+    append_frame(path, encode_rows(rows), compression)
+
+
+def encode_rows(rows):
+    text = io.StringIO()
+    csv.writer(text).writerows(rows)
+    return text.getvalue().encode('utf-8')
+
+
+def decode_rows(data):
+    return list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+
+
+def open_binary(path):
+    """
+    Opens a compressed file for reading, decompressing every frame in turn.
+    :param path: Path to the compressed file
+    :return: Binary file object
+    """
+    compression = compression_for(path)
+    if compression == GZIP:
+        return gzip.open(path, 'rb')
+    reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    return io.BufferedReader(reader)
+
+
+def open_text(path):
+    """
+    Opens a compressed CSV for reading with the csv module.
+    :param path: Path to the compressed file
+    :return: Text file object
+    """
+    return io.TextIOWrapper(open_binary(path), encoding='utf-8', newline='')
+
+
+def decode_frame(data, start, compression):
+    """
+    Decodes the frame starting at data[start].
+    :return: (decoded bytes, offset in data where the frame ends), or (None, None) if there is no complete frame there.
+    """
+    decompressor = decompressobj(compression)
+    try:
+        decoded = decompressor.decompress(data[start:])
+    except DECODE_ERRORS:
+        return None, None
+    if not decompressor.eof:
+        return None, None
+    return decoded, len(data) - len(decompressor.unused_data)
+
+
+def read_tail(path, block_size=64 * 1024, truncate_torn_frame=False):
+    """
+    Reads the rows in the last frames of a compressed CSV without decompressing the whole file.
+    Frames are found by searching backwards for the frame magic number, and checking a complete frame decodes from there.
+    The file is read in growing blocks from the end until a complete frame is found, so this takes the same time however
+    large the file is.
+    :param path: Path to the compressed CSV
+    :param block_size: Bytes to read from the end of the file at first
+    :param truncate_torn_frame: If the file ends with a partially written frame (eg. after a crash), remove it from the
+    file so appending stays valid.
+    :return: (header, list of rows from the complete frames found at the end of the file)
+    """
+    compression = compression_for(path)
+    magic = FRAME_MAGIC[compression]
+    with open(path, 'r+b' if truncate_torn_frame else 'rb') as f:
+        # The header is always the first frame on its own.
+        header_data = f.read(block_size)
+        header_frame, header_end = decode_frame(header_data, 0, compression)
+        header = decode_rows(header_frame)[0] if header_frame else []
+        file_size = f.seek(0, os.SEEK_END)
+
+        window = block_size
+        while True:
+            start = max(file_size - window, header_end or 0)
+            f.seek(start)
+            data = f.read(file_size - start)
+
+            # Find the last complete frame. Anything after it is a torn frame.
+            frames = []
+            pos = len(data)
+            while True:
+                pos = data.rfind(magic, 0, pos)
+                if pos == -1:
+                    break
+                decoded, end = decode_frame(data, pos, compression)
+                if decoded is None:
+                    continue
+                if len(frames) == 0 or end == frames[0][0]:
+                    frames.insert(0, (pos, end, decoded))
+            if len(frames) > 0 or start == (header_end or 0):
+                break
+            window *= 2
+
+        frames_end = frames[-1][1] if len(frames) > 0 else 0
+        if start + frames_end < file_size and header_end is not None and truncate_torn_frame:
+            print('Removing partially written frame from the end of {}'.format(path), file=sys.stderr)
+            f.truncate(start + frames_end)
+
+    rows = []
+    for _, _, decoded in frames:
+        rows.extend(decode_rows(decoded))
+    return header, rows
@@ -0,0 +1,166 @@
+import sys
+import time
+import getopt
+import sqlite3
+import threading
+
+# Dead letter statuses
+FAILED = 'failed'
+RESOLVED = 'resolved'
+# Failed too many retry passes, and will not be retried again.
+ABANDONED = 'abandoned'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS dead_letters (
+    case_number TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'failed',
+    reason TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    failures INTEGER NOT NULL DEFAULT 0,
+    first_failed REAL NOT NULL,
+    last_failed REAL NOT NULL,
+    next_retry REAL NOT NULL,
+    resolved_at REAL
+)
+'''
+
+
+class DeadLetters:
+    """
+    Case numbers which could not be scraped (eg. pages did not load after 'connect-thresh' attempts), stored in SQLite
+    with the reason and number of attempts so the crawl can move on. A separate retry pass scrapes them again later,
+    waiting longer after each failure.
+    """
+
+    def __init__(self, db_file, base_delay=60, max_delay=6 * 3600, max_failures=5, clock=time.time):
+        """
+        :param db_file: Path to the SQLite database. Created if it does not exist.
+        :param base_delay: Seconds to wait before the first retry. Multiplied by 4 after every failed retry.
+        :param max_delay: Longest wait before a retry, in seconds.
+        :param max_failures: A case is abandoned once it has failed this many times.
+        :param clock: Function returning the current time in seconds
+        """
+        self.db_file = db_file
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_failures = max_failures
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def backoff(self, failures):
+        """
+        :param failures: Number of times the case has failed
+        :return: Seconds to wait before retrying it
+        """
+        return min(self.base_delay * 4 ** (failures - 1), self.max_delay)
+
+    def add(self, case_number, reason, attempts=1):
+        """
+        Records a failed case. If it failed before, its attempts and failures are added to.
+        :param case_number: Case number which failed, eg. '19000123'
+        :param reason: Error message
+        :param attempts: Number of times the case was tried before giving up on it this time
+        :return: Status of the dead letter, 'failed' or 'abandoned' if it has failed too many times.
+        """
+        with self.lock:
+            now = self.clock()
+            letter = self.db.execute('SELECT failures FROM dead_letters WHERE case_number = ?',
+                                     (case_number,)).fetchone()
+            failures = (letter['failures'] if letter is not None else 0) + 1
+            status = ABANDONED if failures >= self.max_failures else FAILED
+            self.db.execute(
+                'INSERT INTO dead_letters (case_number, status, reason, attempts, failures, first_failed, last_failed, '
+                'next_retry) VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (case_number) DO UPDATE SET status = excluded.status, reason = excluded.reason, '
+                'attempts = attempts + excluded.attempts, failures = excluded.failures, '
+                'last_failed = excluded.last_failed, next_retry = excluded.next_retry, resolved_at = NULL',
+                (case_number, status, reason, attempts, failures, now, now, now + self.backoff(failures)))
+            return status
+
+    def resolve(self, case_number):
+        """
+        Records a case which was scraped successfully on a retry.
+        """
+        with self.lock:
+            self.db.execute('UPDATE dead_letters SET status = ?, resolved_at = ? WHERE case_number = ?',
+                            (RESOLVED, self.clock(), case_number))
+
+    def requeue(self, case_number):
+        """
+        Retries a case (eg. an abandoned one) in the next retry pass, as if it had not failed before.
+        """
+        with self.lock:
+            self.db.execute('UPDATE dead_letters SET status = ?, failures = 0, next_retry = ? WHERE case_number = ?',
+                            (FAILED, self.clock(), case_number))
+
+    def next_letter(self):
+        """
+        :return: Dict of the failed case due to be retried soonest (which may not be due yet), or None if there are none.
+        """
+        with self.lock:
+            letter = self.db.execute('SELECT * FROM dead_letters WHERE status = ? ORDER BY next_retry, case_number '
+                                     'LIMIT 1', (FAILED,)).fetchone()
+        return dict(letter) if letter is not None else None
+
+    def letters(self, status=None):
+        """
+        :param status: Only return dead letters with this status
+        :return: List of dicts, in case number order
+        """
+        with self.lock:
+            if status is None:
+                rows = self.db.execute('SELECT * FROM dead_letters ORDER BY case_number').fetchall()
+            else:
+                rows = self.db.execute('SELECT * FROM dead_letters WHERE status = ? ORDER BY case_number',
+                                       (status,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def counts(self):
+        """
+        :return: Dict of status to number of dead letters
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT status, COUNT(*) FROM dead_letters GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def summary(self):
+        counts = self.counts()
+        return '{} failed cases waiting to be retried, {} resolved on retry, {} abandoned.'.format(
+            counts.get(FAILED, 0), counts.get(RESOLVED, 0), counts.get(ABANDONED, 0))
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 's:r:'
+    long_args = ['status=', 'requeue=']
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    if len(paths) != 1:
+        print('Usage: python -m utils.DeadLetters [-s failed|resolved|abandoned] [-r case-number] '
+              'bay-county-scraped.csv.failed.sqlite', file=sys.stderr)
+        sys.exit(2)
+
+    dead_letters = DeadLetters(paths[0])
+    status = None
+    for arg, val in opts:
+        if arg in ('-s', '--status'):
+            status = val
+        elif arg in ('-r', '--requeue'):
+            dead_letters.requeue(val)
+
+    for letter in dead_letters.letters(status):
+        print('{case_number} {status}: {attempts} attempts, {failures} failures. {reason}'.format(**letter))
+    print(dead_letters.summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+import sys
+import time
+import queue
+import threading
+import traceback
+from contextlib import contextmanager
+
+# Put on a stage's queue to stop one of its workers
+STOP = object()
+
+
+class PipelineError(Exception):
+    """Raised in the thread feeding the pipeline when a stage has failed."""
+
+
+class Stage:
+    def __init__(self, name, function, workers, queue_size, clock, on_error=None):
+        self.name = name
+        self.function = function
+        self.on_error = on_error
+        self.workers = workers
+        self.queue = queue.Queue(queue_size) if function is not None else None
+        self.threads = []
+        self.clock = clock
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.blocked_seconds = 0.0
+        # Items whose error was handled by on_error
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def add_time(self, busy_seconds=0.0, blocked_seconds=0.0, items=0, errors=0):
+        with self.lock:
+            self.busy_seconds += busy_seconds
+            self.blocked_seconds += blocked_seconds
+            self.items += items
+            self.errors += errors
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, each run by its own worker threads. Putting an item on a full queue blocks until
+    the stage catches up, so a slow stage holds back the stages feeding it rather than queueing unbounded work.
+    Time spent busy in each stage is measured to show which stage is the bottleneck.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.stages = {}
+        self.clock = clock
+        self.started = clock()
+        self.error = None
+
+    def add_stage(self, name, function, workers=1, queue_size=8, on_error=None):
+        """
+        Adds a stage, and starts its workers. Stages must be added after the stages they put items onto, and are closed
+        in the order they were added.
+        :param name: Stage name, used to put items on it and in the report.
+        :param function: Called with each item put on the stage.
+        :param workers: Number of worker threads. Items are handled in order if there is one worker.
+        :param queue_size: Items which can be waiting for the stage before putting another one blocks.
+        :param on_error: Called with the item and the error if function raises. If it returns True, only that item has
+        failed and the stage carries on. Otherwise (or if there is no on_error) the pipeline fails.
+        """
+        stage = Stage(name, function, workers, queue_size, self.clock, on_error)
+        for i in range(workers):
+            thread = threading.Thread(target=self.__work__, args=(stage,), name='{}-{}'.format(name, i), daemon=True)
+            thread.start()
+            stage.threads.append(thread)
+        self.stages[name] = stage
+
+    def add_source(self, name):
+        """
+        Adds a stage which runs in the caller's thread (eg. the browser), timed with busy().
+        """
+        self.stages[name] = Stage(name, None, 1, 0, self.clock)
+
+    def __work__(self, stage):
+        while True:
+            item = stage.queue.get()
+            try:
+                if item is STOP:
+                    return
+                if self.error is not None:
+                    # Drop items once the pipeline has failed, so nothing blocks waiting on this stage.
+                    continue
+                started = self.clock()
+                try:
+                    stage.function(item)
+                except Exception as err:
+                    print('Error in pipeline stage {}:'.format(stage.name), file=sys.stderr)
+                    traceback.print_exc()
+                    if self.__handled__(stage, item, err):
+                        stage.add_time(errors=1)
+                    elif self.error is None:
+                        self.error = PipelineError('Pipeline stage {} failed: {!r}'.format(stage.name, err))
+                        self.error.__cause__ = err
+                stage.add_time(busy_seconds=self.clock() - started, items=1)
+            finally:
+                stage.queue.task_done()
+
+    def __handled__(self, stage, item, err):
+        """
+        :return: True if the stage's on_error handled the error, so the pipeline carries on.
+        """
+        if stage.on_error is None:
+            return False
+        try:
+            return stage.on_error(item, err) is True
+        except Exception:
+            print('Error handler for pipeline stage {} failed:'.format(stage.name), file=sys.stderr)
+            traceback.print_exc()
+            return False
+
+    def check(self):
+        """
+        :raises PipelineError: If a stage has failed.
+        """
+        if self.error is not None:
+            raise self.error
+
+    def put(self, name, item):
+        """
+        Puts an item on a stage's queue, blocking while the queue is full.
+        :raises PipelineError: If a stage has failed.
+        """
+        self.check()
+        stage = self.stages[name]
+        started = self.clock()
+        stage.queue.put(item)
+        stage.add_time(blocked_seconds=self.clock() - started)
+
+    @contextmanager
+    def busy(self, name):
+        """
+        Times work done for a source stage in the caller's thread.
+        """
+        started = self.clock()
+        try:
+            yield
+        finally:
+            self.stages[name].add_time(busy_seconds=self.clock() - started, items=1)
+
+    def drain(self, *names):
+        """
+        Waits until every item put on the given stages (all stages if none are given) has been handled.
+        :raises PipelineError: If a stage has failed.
+        """
+        for name in names or self.stages:
+            stage = self.stages[name]
+            if stage.queue is not None:
+                stage.queue.join()
+        self.check()
+
+    def close(self):
+        """
+        Finishes every item already in the pipeline, then stops the workers.
+        :raises PipelineError: If a stage has failed.
+        """
+        for stage in self.stages.values():
+            if stage.queue is None:
+                continue
+            for _ in stage.threads:
+                stage.queue.put(STOP)
+            for thread in stage.threads:
+                thread.join()
+        self.check()
+
+    def report(self):
+        """
+        :return: How busy each stage has been, as a % of the time its workers have been running.
+        """
+        elapsed = max(self.clock() - self.started, 1e-9)
+        lines = []
+        for stage in self.stages.values():
+            line = '{}: {:.0%} busy, {} items'.format(stage.name, stage.busy_seconds / (elapsed * stage.workers),
+                                                      stage.items)
+            if stage.queue is not None:
+                line += ', {} workers, {}/{} queued'.format(stage.workers, stage.queue.qsize(), stage.queue.maxsize)
+            if stage.errors > 0:
+                line += ', {} failed'.format(stage.errors)
+            if stage.blocked_seconds >= 0.1:
+                line += ', {:.0f}s spent waiting for space in its queue'.format(stage.blocked_seconds)
+            lines.append(line)
+        return 'Pipeline: ' + '; '.join(lines)
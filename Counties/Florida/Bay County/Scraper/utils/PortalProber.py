@@ -0,0 +1,263 @@
+"""
+Finds which court record portals in the state links directory run Benchmark (Pioneer Technology), which Scraper.py
+can scrape, by fetching every listed URL concurrently and checking the pages for parts of the Benchmark search page.
+
+Usage: python -m utils.PortalProber [-j concurrency] [-p per-host] [-t timeout] [-o targets.csv] [links.csv]
+"""
+import re
+import os
+import sys
+import csv
+import getopt
+import asyncio
+from dataclasses import dataclass, field
+from typing import List, Optional
+from urllib.parse import urljoin, urlsplit
+
+import aiohttp
+
+DEFAULT_LINKS_FILE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', '..', '..', '..',
+                                                  'Privacy_Public Access to Court Records State Links.csv'))
+
+# Only the start of a page is needed to fingerprint it
+MAX_BODY = 512 * 1024
+
+USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:91.0) Gecko/20100101 Firefox/91.0'
+
+# Benchmark is installed under a path such as /BenchmarkWeb2/, /BenchmarkWeb/ or /Benchmark/
+BENCHMARK_BASE = re.compile(r'^(https?://[^/]+/benchmark\w*/)', re.IGNORECASE)
+BENCHMARK_LINK = re.compile(r'''href\s*=\s*["']([^"']*/benchmark\w*/[^"']*)["']''', re.IGNORECASE)
+
+# Parts of the Benchmark search page which Scraper.py relies on
+FINGERPRINTS = {
+    'benchmark': re.compile(r'/benchmark\w*/', re.IGNORECASE),
+    'search': re.compile(r'Home\.aspx/Search|searchtype\s*=\s*["\']CaseNumber', re.IGNORECASE),
+    'captcha': re.compile(r'<img[^>]+alt\s*=\s*["\']Captcha["\']', re.IGNORECASE),
+}
+
+TARGET_COLUMNS = ['state-code', 'county', 'portal-base', 'output', 'captcha']
+
+STATE_CODES = {
+    'Alabama': 'AL', 'Alaska': 'AK', 'Arizona': 'AZ', 'Arkansas': 'AR', 'California': 'CA', 'Colorado': 'CO',
+    'Connecticut': 'CT', 'Delaware': 'DE', 'District of Columbia': 'DC', 'Florida': 'FL', 'Georgia': 'GA',
+    'Hawaii': 'HI', 'Idaho': 'ID', 'Illinois': 'IL', 'Indiana': 'IN', 'Iowa': 'IA', 'Kansas': 'KS', 'Kentucky': 'KY',
+    'Louisiana': 'LA', 'Maine': 'ME', 'Maryland': 'MD', 'Massachusetts': 'MA', 'Michigan': 'MI', 'Minnesota': 'MN',
+    'Mississippi': 'MS', 'Missouri': 'MO', 'Montana': 'MT', 'Nebraska': 'NE', 'Nevada': 'NV', 'New Hampshire': 'NH',
+    'New Jersey': 'NJ', 'New Mexico': 'NM', 'New York': 'NY', 'North Carolina': 'NC', 'North Dakota': 'ND',
+    'Ohio': 'OH', 'Oklahoma': 'OK', 'Oregon': 'OR', 'Pennsylvania': 'PA', 'Rhode Island': 'RI',
+    'South Carolina': 'SC', 'South Dakota': 'SD', 'Tennessee': 'TN', 'Texas': 'TX', 'Utah': 'UT', 'Vermont': 'VT',
+    'Virginia': 'VA', 'Washington': 'WA', 'West Virginia': 'WV', 'Wisconsin': 'WI', 'Wyoming': 'WY',
+}
+
+
+@dataclass
+class PortalLink:
+    state: str
+    name: str
+    url: str
+
+
+@dataclass
+class ProbeResult:
+    link: PortalLink
+    final_url: Optional[str] = None
+    status: Optional[int] = None
+    markers: List[str] = field(default_factory=list)
+    portal_base: Optional[str] = None
+    error: Optional[str] = None
+
+    @property
+    def is_benchmark(self):
+        return 'benchmark' in self.markers and 'search' in self.markers
+
+
+def read_portal_links(links_file):
+    """
+    Reads the state links directory. The state is only given on the first row of each state, so it is carried down.
+    :param links_file: Path to CSV of state, portal name, URL
+    :return: List of PortalLink
+    """
+    links = []
+    state = ''
+    with open(links_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) < 3:
+                continue
+            state = row[0].strip() or state
+            url = row[2].strip()
+            if url.lower().startswith(('http://', 'https://')):
+                links.append(PortalLink(state, row[1].strip(), url))
+    return links
+
+
+def fingerprint(url, html):
+    """
+    :param url: Final URL of the page, after redirects
+    :param html: Page source
+    :return: List of the FINGERPRINTS names found in the URL or page
+    """
+    return [name for name, pattern in FINGERPRINTS.items() if pattern.search(url) or pattern.search(html)]
+
+
+def get_portal_base(url):
+    """
+    :param url: URL of any page of a Benchmark portal
+    :return: Portal base to pass to Scraper.py --portal-base, eg. https://court.baycoclerk.com/BenchmarkWeb2/, or None
+    """
+    match = BENCHMARK_BASE.match(url)
+    return match.group(1) if match else None
+
+
+def state_code(state):
+    return STATE_CODES.get(state, state[:2].upper())
+
+
+def county_name(name):
+    return re.sub(r'\s+(County|Parish)$', '', name.strip(), flags=re.IGNORECASE)
+
+
+def output_name(state, name):
+    slug = re.sub(r'[^a-z0-9]+', '-', county_name(name).lower()).strip('-')
+    return '{}-{}-scraped.csv'.format(state_code(state).lower(), slug)
+
+
+class PortalProber:
+    """
+    Fetches portal pages concurrently. At most `concurrency` portals are probed at once, and at most `per_host`
+    requests are made to one host at once, as many counties share a host.
+    """
+
+    def __init__(self, concurrency=20, per_host=2, timeout=20):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.host_limits = {}
+
+    def __host_limit__(self, url):
+        host = urlsplit(url).hostname
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self.host_limits[host]
+
+    async def fetch(self, session, url):
+        """
+        :return: (final URL, status code, start of page source)
+        """
+        async with self.__host_limit__(url):
+            async with session.get(url, timeout=self.timeout, allow_redirects=True) as response:
+                body = await response.content.read(MAX_BODY)
+                return str(response.url), response.status, body.decode(response.charset or 'utf-8', errors='replace')
+
+    async def probe(self, session, link):
+        """
+        Fingerprints a listed portal. If the page is not a Benchmark search page, but is part of a Benchmark portal or
+        links to one, the portal's search page is fingerprinted instead.
+        :return: ProbeResult
+        """
+        result = ProbeResult(link)
+        try:
+            result.final_url, result.status, html = await self.fetch(session, link.url)
+            result.markers = fingerprint(result.final_url, html)
+            result.portal_base = get_portal_base(result.final_url)
+            if result.portal_base is None:
+                match = BENCHMARK_LINK.search(html)
+                if match:
+                    result.portal_base = get_portal_base(urljoin(result.final_url, match.group(1)))
+
+            if result.portal_base is not None and not result.is_benchmark:
+                search_url = urljoin(result.portal_base, 'Home.aspx/Search')
+                result.final_url, result.status, html = await self.fetch(session, search_url)
+                result.markers = fingerprint(result.final_url, html)
+            if result.status >= 400:
+                result.markers = []
+            if not result.is_benchmark:
+                result.portal_base = None
+        except (aiohttp.ClientError, asyncio.TimeoutError, UnicodeError, ValueError) as err:
+            result.error = '{}: {}'.format(type(err).__name__, err) if str(err) else type(err).__name__
+        return result
+
+    async def probe_all(self, links):
+        """
+        :param links: List of PortalLink
+        :return: List of ProbeResult, in the same order as links
+        """
+        limit = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        async with aiohttp.ClientSession(connector=connector, headers={'User-Agent': USER_AGENT}) as session:
+            async def bounded_probe(link):
+                async with limit:
+                    return await self.probe(session, link)
+            return await asyncio.gather(*(bounded_probe(link) for link in links))
+
+    def run(self, links):
+        return asyncio.run(self.probe_all(links))
+
+
+def write_targets(targets_file, results):
+    """
+    Writes the Benchmark portals found as a CSV of Scraper.py settings, one portal per row. A portal listed more than
+    once is only written once.
+    :param targets_file: Path to output CSV
+    :param results: List of ProbeResult
+    :return: Number of portals written
+    """
+    written = set()
+    with open(targets_file, 'w', encoding='utf-8', newline='') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(TARGET_COLUMNS)
+        for result in results:
+            if not result.is_benchmark or result.portal_base.lower() in written:
+                continue
+            written.add(result.portal_base.lower())
+            link = result.link
+            writer.writerow([state_code(link.state), county_name(link.name), result.portal_base,
+                             output_name(link.state, link.name), 'captcha' in result.markers])
+    return len(written)
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'j:p:t:o:'
+    long_args = ['concurrency=', 'per-host=', 'timeout=', 'output=']
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+
+    concurrency = 20
+    per_host = 2
+    timeout = 20
+    targets_file = 'portal-targets.csv'
+    for arg, val in opts:
+        if arg in ('-j', '--concurrency'):
+            concurrency = int(val)
+        elif arg in ('-p', '--per-host'):
+            per_host = int(val)
+        elif arg in ('-t', '--timeout'):
+            timeout = float(val)
+        elif arg in ('-o', '--output'):
+            targets_file = val
+
+    links = read_portal_links(paths[0] if paths else DEFAULT_LINKS_FILE)
+    results = PortalProber(concurrency, per_host, timeout).run(links)
+    for result in results:
+        if result.error:
+            status = result.error
+        elif result.is_benchmark:
+            status = 'Benchmark {}'.format(result.portal_base)
+        else:
+            status = 'HTTP {}'.format(result.status)
+        print('{}, {}: {}'.format(result.link.state, result.link.name, status))
+
+    count = write_targets(targets_file, results)
+    print('Found {} Benchmark portals out of {} links. Saved to {}'.format(count, len(links), targets_file))
+    with open(targets_file, 'r', encoding='utf-8', newline='') as f:
+        for target in csv.DictReader(f):
+            print('python3 Scraper.py --portal-base {} --state {} --county "{}" --output {}{}'.format(
+                target['portal-base'], target['state-code'], target['county'], target['output'],
+                ' --solve-captchas' if target['captcha'] == 'True' else ''))
+
+
+if __name__ == '__main__':
+    main()
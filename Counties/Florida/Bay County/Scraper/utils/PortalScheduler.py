@@ -0,0 +1,397 @@
+"""
+Crawls several Benchmark portals at once, each with its own scraper workers (Scraper.py processes, each with its own
+browser), output and checkpoint. The portals are read from a CSV, such as the portal-targets.csv written by
+utils/PortalProber.py.
+
+Usage: python -m utils.PortalScheduler [-w workers] [-i interval-seconds] [-y start-year] [-e end-year] portals.csv
+"""
+import os
+import sys
+import csv
+import time
+import shlex
+import signal
+import getopt
+import subprocess
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import List
+
+from utils.WorkQueue import WorkQueue, PENDING, LEASED
+from utils.DeadLetters import DeadLetters
+
+SCRAPER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Scraper.py'))
+
+OUTPUT_EXTENSIONS = ('.csv.gz', '.csv.zst', '.csv')
+
+
+@dataclass
+class PortalConfig:
+    state_code: str
+    county: str
+    portal_base: str
+    output: str
+    # Most scraper workers (browsers) to run against the portal at once
+    max_workers: int = 1
+    # Rate budget for the whole portal, shared by its workers. 0 for no limit.
+    searches_per_minute: float = 0
+    # Extra arguments for Scraper.py, eg. --solve-captchas
+    args: List[str] = field(default_factory=list)
+
+    @property
+    def name(self):
+        for extension in OUTPUT_EXTENSIONS:
+            if self.output.lower().endswith(extension):
+                return self.output[:-len(extension)]
+        return self.output
+
+    @property
+    def extension(self):
+        return self.output[len(self.name):] or '.csv'
+
+    @property
+    def checkpoint(self):
+        """
+        :return: Path to the portal's work queue, which records which case ranges have been scraped.
+        """
+        return os.path.abspath('{}.work.sqlite'.format(self.name))
+
+    def worker_output(self, slot):
+        """
+        Each worker writes its own output file, so workers never append to the same file.
+        :param slot: Worker number, from 1 to max_workers
+        """
+        return '{}.w{}{}'.format(self.name, slot, self.extension)
+
+    def min_search_interval(self):
+        """
+        :return: Seconds each worker waits between searches so the portal's workers stay within its rate budget even
+        when all of them are running.
+        """
+        if not self.searches_per_minute:
+            return 0
+        return 60.0 * self.max_workers / self.searches_per_minute
+
+
+def read_portal_config(config_file):
+    """
+    Reads the portals to crawl. Columns state-code, county, portal-base and output are required. Optional columns are
+    captcha (True if the portal shows a captcha, which turns on --solve-captchas), max-workers (default 1),
+    searches-per-minute (default no limit) and args (extra Scraper.py arguments).
+    :param config_file: Path to CSV
+    :return: List of PortalConfig
+    """
+    portals = []
+    with open(config_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            args = shlex.split(row.get('args') or '')
+            # Without --solve-captchas a worker fails every search on a portal which shows a captcha
+            if (row.get('captcha') or '').lower() == 'true' and not {'-u', '--solve-captchas'} & set(args):
+                args.append('--solve-captchas')
+            portals.append(PortalConfig(row['state-code'], row['county'], row['portal-base'], row['output'],
+                                        int(row.get('max-workers') or 1),
+                                        float(row.get('searches-per-minute') or 0),
+                                        args))
+    return portals
+
+
+def fair_shares(capacity, limits):
+    """
+    Shares workers between portals as evenly as possible. A portal never gets more than its limit, and workers a portal
+    can't use are shared between the others.
+    :param capacity: Number of workers to share
+    :param limits: Dict of portal name to the most workers it can use
+    :return: Dict of portal name to number of workers
+    """
+    shares = {name: 0 for name in limits}
+    remaining = capacity
+    while remaining > 0:
+        wanting = [name for name in limits if shares[name] < limits[name]]
+        if len(wanting) == 0:
+            break
+        # One worker at a time to the portal with fewest, in config order when tied
+        name = min(wanting, key=lambda n: shares[n])
+        shares[name] += 1
+        remaining -= 1
+    return shares
+
+
+def launch_worker(args, log_file):
+    """
+    Starts a Scraper.py worker, logging its output to a file.
+    :return: subprocess.Popen
+    """
+    with open(log_file, 'ab') as log:
+        return subprocess.Popen(args, stdout=log, stderr=subprocess.STDOUT)
+
+
+class PortalCrawl:
+    """
+    State of one portal's crawl: its running workers, progress, and how many workers it is allowed.
+    """
+
+    def __init__(self, config: PortalConfig, start_year, end_year, cases_per_unit, clock):
+        self.config = config
+        self.clock = clock
+        self.work_queue = WorkQueue(config.checkpoint, clock)
+        self.work_queue.add_years(start_year, end_year, cases_per_unit)
+        self.workers = {}
+        self.limit = config.max_workers
+        self.healthy_rounds = 0
+        self.paused_until = 0
+        self.errors = 0
+        self.last_time = clock()
+        self.last_progress = self.work_queue.progress()
+        self.last_failures = self.failures()
+        self.last_workers = 0
+        self.throughput = None
+
+    def failures(self):
+        """
+        :return: Total failures recorded in the dead letters of every worker.
+        """
+        total = 0
+        for slot in range(1, self.config.max_workers + 1):
+            dead_letter_file = '{}.failed.sqlite'.format(os.path.abspath(self.config.worker_output(slot)))
+            if os.path.isfile(dead_letter_file):
+                dead_letters = DeadLetters(dead_letter_file)
+                total += sum(letter['failures'] for letter in dead_letters.letters())
+                dead_letters.close()
+        return total
+
+    def reap(self):
+        """
+        Removes workers which have exited, counting those which exited with an error.
+        """
+        for slot, process in list(self.workers.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del self.workers[slot]
+            if code != 0:
+                print('{} worker {} exited with code {}'.format(self.config.name, slot, code), file=sys.stderr)
+                self.errors += 1
+
+    def measure(self):
+        """
+        Measures progress since the last measurement.
+        :return: Number of new failures (worker errors and failed cases)
+        """
+        now = self.clock()
+        progress = self.work_queue.progress()
+        failures = self.failures()
+        minutes = (now - self.last_time) / 60
+        if self.last_workers > 0 and minutes > 0:
+            self.throughput = (progress - self.last_progress) / minutes / self.last_workers
+        else:
+            self.throughput = None
+        new_failures = failures - self.last_failures + self.errors
+        self.last_time = now
+        self.last_progress = progress
+        self.last_failures = failures
+        self.errors = 0
+        return new_failures
+
+    def demand(self):
+        """
+        :return: Most workers which could be given work now.
+        """
+        return len(self.workers) + self.work_queue.available()
+
+    def finished(self):
+        status = self.work_queue.status()
+        return len(self.workers) == 0 and status.get(PENDING, 0) == 0 and status.get(LEASED, 0) == 0
+
+    def summary(self):
+        throughput = '{:.1f} cases/min per worker'.format(self.throughput) if self.throughput is not None else 'idle'
+        return '{}: {} workers (limit {}), {}, {} cases, {}'.format(
+            self.config.name, len(self.workers), self.limit, throughput, self.last_progress, self.work_queue.status())
+
+
+class PortalScheduler:
+    """
+    Shares a fixed number of scraper workers between portals. Each round, every portal's progress and failures are
+    measured. A portal whose workers are failing (eg. rate limited) or much slower per worker than the best portal is
+    allowed one fewer worker, and a portal failing with a single worker is paused for a few rounds, so its workers go to
+    the other portals. Limits grow back by one worker after a few healthy rounds.
+    """
+
+    def __init__(self, portals, capacity, start_year, end_year, cases_per_unit=500, slow_ratio=0.5, recover_rounds=2,
+                 cooldown_rounds=2, stop_timeout=60, launch=launch_worker, clock=time.time):
+        """
+        :param portals: List of PortalConfig
+        :param capacity: Most workers to run at once, across all portals
+        :param start_year: Earliest year to scrape
+        :param end_year: Latest year to scrape
+        :param cases_per_unit: Case numbers in each unit of work
+        :param slow_ratio: A portal is slow if its cases per worker are below this fraction of the fastest portal's.
+        :param recover_rounds: Healthy rounds before a portal's limit is raised again
+        :param cooldown_rounds: Rounds a portal is paused for after failing with one worker
+        :param stop_timeout: Seconds to let a worker finish writing after being asked to stop, before it is killed
+        :param launch: Function taking (args, log file) which starts a worker process
+        :param clock: Time function, replaceable in tests
+        """
+        self.capacity = capacity
+        self.slow_ratio = slow_ratio
+        self.recover_rounds = recover_rounds
+        self.cooldown_rounds = cooldown_rounds
+        self.stop_timeout = stop_timeout
+        self.launch = launch
+        self.round = 0
+        self.crawls = [PortalCrawl(config, start_year, end_year, cases_per_unit, clock) for config in portals]
+
+    def worker_args(self, config: PortalConfig, slot):
+        return [sys.executable, SCRAPER, '--portal-base', config.portal_base, '--state', config.state_code,
+                '--county', config.county, '--output', config.worker_output(slot), '--coordinator', config.checkpoint,
+                '--node-id', '{}-w{}'.format(config.name, slot), '--headless',
+                '--min-search-interval', str(config.min_search_interval())] + config.args
+
+    def start_worker(self, crawl: PortalCrawl):
+        slot = min(set(range(1, crawl.config.max_workers + 1)) - set(crawl.workers))
+        log_file = '{}.w{}.log'.format(crawl.config.name, slot)
+        crawl.workers[slot] = self.launch(self.worker_args(crawl.config, slot), log_file)
+
+    def stop_worker(self, crawl: PortalCrawl):
+        """
+        Asks the most recently added worker to stop, which lets it finish writing the cases it has read.
+        """
+        slot = max(crawl.workers)
+        process = crawl.workers.pop(slot)
+        if os.name == 'nt':
+            process.terminate()
+        else:
+            process.send_signal(signal.SIGINT)
+        try:
+            process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def adjust_limit(self, crawl: PortalCrawl, new_failures, best_throughput):
+        """
+        Lowers the limit of a failing or slow portal, and raises it again after it has been healthy for a while.
+        """
+        if crawl.paused_until > self.round:
+            # Rounds without workers don't show whether the portal has recovered
+            return
+        # Workers running during the last round, including any which have since crashed
+        running = max(crawl.last_workers, 1)
+        slow = crawl.throughput is not None and best_throughput and \
+            crawl.throughput < self.slow_ratio * best_throughput
+        if new_failures > 0:
+            crawl.healthy_rounds = 0
+            if min(crawl.limit, running) <= 1:
+                print('Pausing {} for {} rounds after {} failures'.format(crawl.config.name, self.cooldown_rounds,
+                                                                         new_failures))
+                crawl.paused_until = self.round + self.cooldown_rounds
+                crawl.limit = 1
+            else:
+                crawl.limit = min(crawl.limit, running) - 1
+        elif slow:
+            crawl.healthy_rounds = 0
+            crawl.limit = max(1, min(crawl.limit, running) - 1)
+        else:
+            crawl.healthy_rounds += 1
+            if crawl.healthy_rounds >= self.recover_rounds and crawl.limit < crawl.config.max_workers:
+                crawl.limit += 1
+                crawl.healthy_rounds = 0
+
+    def step(self):
+        """
+        One scheduling round: measure each portal, adjust its limit, and start or stop workers to match the new shares.
+        :return: True if any portal still has work left
+        """
+        self.round += 1
+        active = []
+        for crawl in self.crawls:
+            crawl.reap()
+            new_failures = crawl.measure()
+            if crawl.finished():
+                continue
+            active.append((crawl, new_failures))
+
+        measured = [crawl.throughput for crawl, _ in active if crawl.throughput is not None]
+        best_throughput = max(measured) if len(measured) > 0 else None
+        for crawl, new_failures in active:
+            self.adjust_limit(crawl, new_failures, best_throughput)
+
+        # Portals get up to their limit first. Workers left over go to portals which are only slow, not failing.
+        running = [crawl for crawl, _ in active if crawl.paused_until <= self.round]
+        limits = {crawl.config.name: min(crawl.limit, crawl.demand()) for crawl in running}
+        shares = fair_shares(self.capacity, limits)
+        spare = self.capacity - sum(shares.values())
+        if spare > 0:
+            extra = fair_shares(spare, {crawl.config.name: min(crawl.config.max_workers, crawl.demand()) -
+                                        shares[crawl.config.name]
+                                        for crawl, new_failures in active
+                                        if crawl in running and new_failures == 0})
+            for name, count in extra.items():
+                shares[name] += count
+
+        for crawl, _ in active:
+            share = shares.get(crawl.config.name, 0)
+            while len(crawl.workers) > share:
+                self.stop_worker(crawl)
+            while len(crawl.workers) < share:
+                self.start_worker(crawl)
+            crawl.last_workers = len(crawl.workers)
+        return len(active) > 0
+
+    def stop_all(self):
+        for crawl in self.crawls:
+            while len(crawl.workers) > 0:
+                self.stop_worker(crawl)
+
+    def summary(self):
+        return '\n'.join(crawl.summary() for crawl in self.crawls)
+
+    def run(self, interval=300):
+        """
+        Runs scheduling rounds every interval seconds until every portal is finished.
+        """
+        try:
+            while self.step():
+                print('Round {}:\n{}'.format(self.round, self.summary()))
+                time.sleep(interval)
+        finally:
+            self.stop_all()
+        print('All portals finished:\n{}'.format(self.summary()))
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'w:i:y:e:n:'
+    long_args = ['workers=', 'interval=', 'start-year=', 'end-year=', 'cases-per-unit=']
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    if len(paths) != 1:
+        print('Usage: python -m utils.PortalScheduler [-w workers] [-i interval-seconds] [-y start-year] [-e end-year] '
+              '[-n cases-per-unit] portals.csv', file=sys.stderr)
+        sys.exit(2)
+
+    workers = 4
+    interval = 300
+    start_year = 2000
+    end_year = datetime.now().year
+    cases_per_unit = 500
+    for arg, val in opts:
+        if arg in ('-w', '--workers'):
+            workers = int(val)
+        elif arg in ('-i', '--interval'):
+            interval = float(val)
+        elif arg in ('-y', '--start-year'):
+            start_year = int(val)
+        elif arg in ('-e', '--end-year'):
+            end_year = int(val)
+        elif arg in ('-n', '--cases-per-unit'):
+            cases_per_unit = int(val)
+
+    scheduler = PortalScheduler(read_portal_config(paths[0]), workers, start_year, end_year, cases_per_unit)
+    scheduler.run(interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import time
+import requests
+
+
+class PortalSession:
+    """
+    Tracks the portal session which a solved captcha unlocks, so it is reused for as many searches as the portal allows.
+    A new captcha is only solved when the portal asks for one, and cookies are only cleared when the portal rejects an
+    answer. Also keeps a requests session with the portal's cookies for downloading attachments.
+    """
+
+    def __init__(self, portal_base, min_search_interval=0, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param portal_base: Base URL for the portal. Eg: 'https://court.baycoclerk.com/BenchmarkWeb2/'
+        :param min_search_interval: Least time between starting searches, in seconds, to keep within a rate budget.
+        :param clock: Time function, replaceable in tests.
+        :param sleep: Sleep function, replaceable in tests.
+        """
+        self.portal_base = portal_base
+        self.min_search_interval = min_search_interval
+        self.clock = clock
+        self.sleep = sleep
+        self.last_search_started = None
+        self.seconds_paced = 0.0
+        self.host = portal_base.split('/')[2]
+        # Incremented whenever the browser's session changes, so copies of its cookies know to refresh.
+        self.generation = 0
+        self.captchas_solved = 0
+        self.captchas_rejected = 0
+        self.searches = 0
+        self.searches_this_session = 0
+        self.most_searches_per_session = 0
+
+        self.http_session = None
+        self.cookie_header = None
+        self.http_generation = None
+
+    @staticmethod
+    def captcha_required(driver):
+        """
+        :param driver: Selenium driver, on the portal's search page
+        :return: True if the search page is showing a captcha
+        """
+        return len(driver.find_elements_by_xpath('//*/img[@alt="Captcha"]')) > 0
+
+    def pace_search(self):
+        """
+        Call before starting a search. Waits until at least min_search_interval has passed since the last search started.
+        """
+        if self.min_search_interval > 0 and self.last_search_started is not None:
+            wait = self.last_search_started + self.min_search_interval - self.clock()
+            if wait > 0:
+                self.seconds_paced += wait
+                self.sleep(wait)
+        self.last_search_started = self.clock()
+
+    def captcha_solved(self):
+        """
+        Call when the portal accepts a captcha answer, which starts a new session.
+        """
+        self.captchas_solved += 1
+        self.searches_this_session = 0
+        self.generation += 1
+
+    def captcha_rejected(self, driver):
+        """
+        Call when the portal rejects a captcha answer. The portal keeps showing the same captcha for the session, so the
+        session is discarded to get a new captcha.
+        :param driver: Selenium driver
+        """
+        self.captchas_rejected += 1
+        driver.delete_all_cookies()
+        self.generation += 1
+
+    def browser_restarted(self):
+        """
+        Call when the browser is replaced with a new one, which starts without the portal session.
+        """
+        self.searches_this_session = 0
+        self.generation += 1
+
+    def search_succeeded(self):
+        """
+        Call when a search returns results (or no results) rather than the search page.
+        """
+        self.searches += 1
+        self.searches_this_session += 1
+        self.most_searches_per_session = max(self.most_searches_per_session, self.searches_this_session)
+
+    def searches_per_captcha(self):
+        """
+        :return: Average number of searches made per captcha solved
+        """
+        return self.searches / max(self.captchas_solved, 1)
+
+    def get_http_session(self, driver):
+        """
+        Gets a requests session and Cookie header matching the browser's portal session. These are only rebuilt when the
+        browser's session has changed, rather than for every attachment.
+        The portal does not handle cookies in a standard way, so they must be sent as a Cookie header on each request
+        rather than through the requests cookie jar.
+        :param driver: Selenium driver
+        :return: (requests.Session, Cookie header str)
+        """
+        if self.http_session is None or self.http_generation != self.generation:
+            # Copy Selenium's user agent and headers to requests
+            user_agent = driver.execute_script('return navigator.userAgent;')
+            self.http_session = requests.Session()
+            self.http_session.headers.update({'User-Agent': user_agent, 'Host': self.host, 'Connection': 'keep-alive',
+                                              'Accept-Language': 'en-US,en;q=0.5',
+                                              'Accept-Encoding': 'gzip, deflate, br', 'Accept': 'text/css,*/*;q=0.1'})
+            self.cookie_header = '; '.join('{}={}'.format(cookie['name'], cookie['value'])
+                                           for cookie in driver.get_cookies())
+            self.http_generation = self.generation
+        return self.http_session, self.cookie_header
+
+    def reset_http_session(self):
+        """
+        Forces the requests session and cookies to be copied from the browser again, eg. after a download was refused.
+        """
+        self.http_session = None
+
+    def summary(self):
+        return '{} searches using {} captchas ({:.1f} searches per captcha, at most {} in one session). ' \
+               '{} captcha answers rejected.'.format(self.searches, self.captchas_solved, self.searches_per_captcha(),
+                                                     self.most_searches_per_session, self.captchas_rejected)
@@ -8,10 +8,35 @@ from dataclasses import dataclass
 import requests
 from requests_toolbelt.utils import dump
 from requests.exceptions import HTTPError, Timeout
+from utils.PortalSession import PortalSession
+from utils import CompressedCsv
+from utils.CompressedCsv import compression_for
+
+CSV_HEADER = ['_id', '_state', '_county', 'PortalID', 'CaseNum', 'AgencyReportNum', 'PartyID', 'FirstName', 'MiddleName',
+              'LastName', 'Suffix', 'DOB', 'Race', 'Sex', 'ArrestDate', 'FilingDate', 'OffenseDate', 'DivisionName',
+              'CaseStatus', 'DefenseAttorney', 'PublicDefender', 'Judge', 'ChargeCount', 'ChargeStatute',
+              'ChargeDescription', 'ChargeLevel', 'ChargeDegree', 'ChargeDisposition', 'ChargeDispositionDate',
+              'ChargeOffenseDate', 'ChargeCitationNum', 'ChargePlea', 'ChargePleaDate', 'ArrestingOfficer',
+              'ArrestingOfficerBadgeNumber']
+
+
+def intern_str(value):
+    """
+    Interns a string so equal values share one object. Used for fields that repeat across many records.
+    :param value: str or None
+    :return: Interned str, or the value unchanged if it is not a str.
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
 
 
 @dataclass
 class Charge:
+    # Slots avoid a per-instance __dict__, as hundreds of thousands of charges may be held in memory at once.
+    __slots__ = ('count', 'statute', 'description', 'level', 'degree', 'disposition', 'disposition_date',
+                 'offense_date', 'citation_number', 'plea', 'plea_date')
+
     count: int
     statute: str
     description: str
@@ -24,9 +49,27 @@ class Charge:
     plea: str
     plea_date: str
 
+    def __post_init__(self):
+        # Statutes, descriptions, levels, dispositions and dates come from a small set of values.
+        # Interning them means each distinct value is stored once and shared by every charge.
+        self.statute = intern_str(self.statute)
+        self.description = intern_str(self.description)
+        self.level = intern_str(self.level)
+        self.degree = intern_str(self.degree)
+        self.disposition = intern_str(self.disposition)
+        self.disposition_date = intern_str(self.disposition_date)
+        self.offense_date = intern_str(self.offense_date)
+        self.plea = intern_str(self.plea)
+        self.plea_date = intern_str(self.plea_date)
+
 
 @dataclass
 class Record:
+    __slots__ = ('id', 'state', 'county', 'portal_id', 'case_num', 'agency_report_num', 'party_id', 'first_name',
+                 'middle_name', 'last_name', 'suffix', 'dob', 'race', 'sex', 'arrest_date', 'filing_date',
+                 'offense_date', 'division_name', 'case_status', 'defense_attorney', 'public_defender', 'judge',
+                 'charges', 'arresting_officer', 'arresting_officer_badge_number')
+
     id: str
     state: str
     county: str
@@ -53,6 +96,19 @@ class Record:
     arresting_officer: str
     arresting_officer_badge_number: str
 
+    def __post_init__(self):
+        # Low-cardinality fields shared by many records
+        self.state = intern_str(self.state)
+        self.county = intern_str(self.county)
+        self.race = intern_str(self.race)
+        self.sex = intern_str(self.sex)
+        self.arrest_date = intern_str(self.arrest_date)
+        self.filing_date = intern_str(self.filing_date)
+        self.offense_date = intern_str(self.offense_date)
+        self.division_name = intern_str(self.division_name)
+        self.case_status = intern_str(self.case_status)
+        self.judge = intern_str(self.judge)
+
 
 def parse_plea_case_numbers(plea_text: str, valid_charges: List[int]) -> List[int]:
     """
@@ -161,60 +217,182 @@ def write_csv(output_file, record: Record, verbose=False):
         print('ArrestingOfficerBadgeNumber', record.arresting_officer_badge_number)
         print('-----------')
 
-    if os.path.isfile(output_file):
+    if compression_for(output_file):
+        # Each record is written as its own compressed frame, so an interrupted write never damages earlier records
+        CompressedCsv.write_rows(output_file, record_rows(record), header=CSV_HEADER)
+    elif os.path.isfile(output_file):
         # CSV exists, append to end of file
         with open(output_file, 'a', encoding='utf-8', newline='') as outfile:
             writer = csv.writer(outfile)
-            for charge in record.charges:
-                writer.writerow(
-                    [record.id, record.state, record.county, record.portal_id, record.case_num, record.agency_report_num, record.party_id,
-                     record.first_name, record.middle_name, record.last_name, record.suffix, record.dob, record.race,
-                     record.sex, record.arrest_date, record.filing_date, record.offense_date, record.division_name,
-                     record.case_status, record.defense_attorney, record.public_defender, record.judge, charge.count,
-                     charge.statute, charge.description, charge.level, charge.degree, charge.disposition,
-                     charge.disposition_date, charge.offense_date, charge.citation_number, charge.plea,
-                     charge.plea_date,
-                     record.arresting_officer, record.arresting_officer_badge_number])
+            writer.writerows(record_rows(record))
     else:
         # CSV does not exist. Write the headings
         with open(output_file, 'w', encoding='utf-8', newline='') as outfile:
             writer = csv.writer(outfile)
-            writer.writerow(
-                ['_id', '_state', '_county', 'PortalID', 'CaseNum', 'AgencyReportNum', 'PartyID', 'FirstName',
-                 'MiddleName', 'LastName', 'Suffix', 'DOB', 'Race', 'Sex', 'ArrestDate', 'FilingDate', 'OffenseDate',
-                 'DivisionName', 'CaseStatus', 'DefenseAttorney', 'PublicDefender', 'Judge', 'ChargeCount',
-                 'ChargeStatute', 'ChargeDescription', 'ChargeLevel', 'ChargeDegree', 'ChargeDisposition',
-                 'ChargeDispositionDate', 'ChargeOffenseDate', 'ChargeCitationNum', 'ChargePlea', 'ChargePleaDate',
-                 'ArrestingOfficer', 'ArrestingOfficerBadgeNumber'])
-            for charge in record.charges:
-                writer.writerow(
-                    [record.id, record.state, record.county, record.portal_id, record.case_num, record.agency_report_num, record.party_id,
-                     record.first_name, record.middle_name, record.last_name, record.suffix, record.dob, record.race,
-                     record.sex, record.arrest_date, record.filing_date, record.offense_date, record.division_name,
-                     record.case_status, record.defense_attorney, record.public_defender, record.judge, charge.count,
-                     charge.statute, charge.description, charge.level, charge.degree, charge.disposition,
-                     charge.disposition_date, charge.offense_date, charge.citation_number, charge.plea,
-                     charge.plea_date,
-                     record.arresting_officer, record.arresting_officer_badge_number])
-
-
-def get_last_csv_row(csv_file) -> str:
-    """
-    Gets last row of CSV file without having to load entire file into memory, as the parsed data CSV is expected to get large.
+            writer.writerow(CSV_HEADER)
+            writer.writerows(record_rows(record))
+
+
+def record_rows(record: Record) -> List[list]:
+    """
+    :param record: Case record
+    :return: One CSV row per charge of the record
+    """
+    return [[record.id, record.state, record.county, record.portal_id, record.case_num, record.agency_report_num,
+             record.party_id, record.first_name, record.middle_name, record.last_name, record.suffix, record.dob,
+             record.race, record.sex, record.arrest_date, record.filing_date, record.offense_date,
+             record.division_name, record.case_status, record.defense_attorney, record.public_defender, record.judge,
+             charge.count, charge.statute, charge.description, charge.level, charge.degree, charge.disposition,
+             charge.disposition_date, charge.offense_date, charge.citation_number, charge.plea, charge.plea_date,
+             record.arresting_officer, record.arresting_officer_badge_number]
+            for charge in record.charges]
+
+
+def iter_csv_rows(data: bytes):
+    """
+    Splits CSV bytes into rows. A newline only ends a row if it is outside quotes, so fields containing newlines are
+    kept within their row. Any incomplete row at the end of data is not returned.
+    :param data: CSV bytes, beginning at the start of a row
+    :return: Generator of (row bytes, offset in data where the row ends)
+    """
+    row_start = 0
+    pos = 0
+    quotes = 0
+    while True:
+        newline = data.find(b'\n', pos)
+        if newline == -1:
+            break
+        quotes += data.count(b'"', pos, newline)
+        pos = newline + 1
+        if quotes % 2 == 0:
+            yield data[row_start:pos], pos
+            row_start = pos
+            quotes = 0
+
+
+def parse_csv_tail(data: bytes, at_row_start: bool, columns: int):
+    """
+    Parses the complete rows in the tail of a CSV file.
+    The tail usually begins part way through a row, so each newline is tried as the start of the first row until one
+    gives rows that all have the expected number of columns.
+    :param data: Bytes read from the end of the CSV file
+    :param at_row_start: True if data begins at the start of a row (eg. directly after the header)
+    :param columns: Number of columns in the CSV
+    :return: (List of rows, offset in data after the last complete row). (None, None) if no complete row was found.
+    """
+    if at_row_start:
+        candidates = [0]
+    else:
+        candidates = (match.end() for match in re.finditer(b'\n', data))
+
+    for candidate in candidates:
+        rows = []
+        rows_end = candidate
+        for row_bytes, end in iter_csv_rows(data[candidate:]):
+            row = next(csv.reader([row_bytes.decode('utf-8', errors='replace')]), [])
+            if len(row) != columns:
+                # This newline was inside a quoted field, not the end of a row.
+                rows = None
+                break
+            rows.append(row)
+            rows_end = candidate + end
+        if rows is None:
+            continue
+        if len(rows) == 0 and not at_row_start:
+            # Only part of a row is in data
+            break
+        return rows, rows_end
+    return None, None
+
+
+def read_csv_tail(csv_file, block_size=1024, truncate_torn_row=False):
+    """
+    Reads the last complete rows of a CSV without loading the entire file into memory, as the parsed data CSV is
+    expected to get large. The file is read backwards in growing blocks until at least one complete row is found, so
+    this takes the same time however large the file is.
+    :param csv_file: Path to CSV file
+    :param block_size: Bytes to read from the end of the file at first. Doubled until a complete row is found.
+    :param truncate_torn_row: If the file ends with a partially written row (eg. after a crash), remove it from the file
+    :return: (header, list of complete rows found at the end of the file). Each row is a list of str.
+    """
+    if compression_for(csv_file):
+        return CompressedCsv.read_tail(csv_file, max(block_size, 64 * 1024), truncate_torn_row)
+
+    with open(csv_file, 'r+b' if truncate_torn_row else 'rb') as f:
+        header_bytes = f.readline()
+        header = next(csv.reader([header_bytes.decode('utf-8-sig')]), [])
+        header_end = len(header_bytes)
+        file_size = f.seek(0, os.SEEK_END)
+
+        window = block_size
+        while True:
+            start = max(file_size - window, header_end)
+            f.seek(start)
+            data = f.read(file_size - start)
+            rows, rows_end = parse_csv_tail(data, start == header_end, len(header))
+            if rows is not None or start == header_end:
+                break
+            window *= 2
+
+        if rows is None:
+            print('Could not find a complete row at the end of {}'.format(csv_file), file=sys.stderr)
+            return header, []
+
+        if start + rows_end < file_size and truncate_torn_row:
+            print('Removing partially written row from the end of {}'.format(csv_file), file=sys.stderr)
+            f.truncate(start + rows_end)
+
+    return header, rows
+
+
+def get_last_csv_row(csv_file, truncate_torn_row=False) -> List[str]:
+    """
+    Gets last complete row of CSV file without having to load entire file into memory.
     :param csv_file: Path to CSV file
-    :return: Last line of CSV file.
+    :param truncate_torn_row: If the file ends with a partially written row, remove it from the file.
+    :return: Last row of CSV file as a list of str, or None if the file has no rows after the header.
     """
-    with open(csv_file, "r") as f:
-        f.seek(0, 2)  # Seek @ EOF
-        fsize = f.tell()  # Get Size
-        f.seek(max(fsize - 1024, 0), 0)  # Set pos @ last n chars
-        lines = f.readlines()  # Read to end
+    rows = read_csv_tail(csv_file, truncate_torn_row=truncate_torn_row)[1]
+    if len(rows) == 0:
+        return None
+    return rows[-1]
+
 
-    line = lines[-1:][0]  # Get last line
-    return line
+def get_last_portal_id(csv_file, truncate_torn_row=True, block_size=64 * 1024):
+    """
+    Finds the furthest case scraped so far, to continue scraping from.
+    Associated cases are written in no particular order, so the last row is not always the furthest case. Instead, the
+    highest PortalID in the same year as the last row is taken from the rows at the end of the file.
+    :param csv_file: Path to output CSV file
+    :param truncate_torn_row: If the file ends with a partially written row, remove it so appending stays valid.
+    :param block_size: Bytes to read from the end of the file. Grown if it does not contain a whole row.
+    :return: PortalID eg. '19000123CFMA', or None if no cases have been scraped.
+    """
+    header, rows = read_csv_tail(csv_file, block_size, truncate_torn_row)
+    portal_id_col = header.index('PortalID') if 'PortalID' in header else 3
+    portal_ids = [row[portal_id_col] for row in rows if row[portal_id_col][:8].isdigit()]
+    if len(portal_ids) == 0:
+        return None
+    year = portal_ids[-1][:2]
+    return max((pid for pid in portal_ids if pid[:2] == year), key=lambda pid: int(pid[2:8]))
+
+
+def output_variant(output_file, variant):
+    """
+    Names a file written alongside the output CSV, with the same extension (including compression).
+    Eg. output_variant('bay-county-scraped.csv.gz', 'retried') returns 'bay-county-scraped.retried.csv.gz'.
+    :param output_file: Path to output CSV file
+    :param variant: Name inserted before the extension
+    :return: Path
+    """
+    for extension in ('.csv.gz', '.csv.zst', '.csv'):
+        if output_file.lower().endswith(extension):
+            return '{}.{}{}'.format(output_file[:-len(extension)], variant, output_file[-len(extension):])
+    return '{}.{}.csv'.format(output_file, variant)
 
 
-def save_attached_pdf(driver, directory, name, portal_base, download_href, timeout=20, verbose=False):
+def save_attached_pdf(driver, directory, name, portal_base, download_href, timeout=20, verbose=False,
+                      portal_session=None):
     """
     Save a PDF docket attachment within a case.
     :param driver: Selenium driver
@@ -224,26 +402,43 @@ def save_attached_pdf(driver, directory, name, portal_base, download_href, timeo
     :param download_href: Href for the download link, which holds attributes 'rel' (cid) and 'digest'.
     :param timeout: Time before aborting HTTP requests
     :param verbose: Print HTTP GET/POSTs for debugging
+    :param portal_session: PortalSession to share cookies with. If None, cookies are copied from Selenium for this
+    attachment only.
     :return: True (Success), False (Failure).
     """
-    # Copy Selenium's user agent and headers to requests
-    user_agent = driver.execute_script('return navigator.userAgent;')
-    s = requests.Session()
-    host = portal_base.split('/')[2]
-    s.headers.update({'User-Agent': user_agent, 'Host': host, 'Connection': 'keep-alive', 'Accept-Language': 'en-US,en;q=0.5', 'Accept-Encoding': 'gzip, deflate, br', 'Accept': 'text/css,*/*;q=0.1'})
-
     # It took me AGES to work this out, the portal does NOT handle cookies in a standard way. This meant my requests
     # always got 'access denied' even when I copied the cookies from Selenium to requests.
-    portal_cookies = driver.get_cookies()
-    cookie_header = ''
-    for cookie in portal_cookies:
-        cookie_header += '{}={}; '.format(cookie['name'], cookie['value'])
-    cookie_header = cookie_header[:-2]  # Remove last deliminator '; '
+    # The Cookie header is built by PortalSession, which only copies it from Selenium again when the session changes.
+    if portal_session is None:
+        portal_session = PortalSession(portal_base)
+    http_session = portal_session.get_http_session(driver)
+    javascript_time = driver.execute_script('return String(new Date())')
+    return download_attached_pdf(http_session, directory, name, portal_base, download_href.get_attribute('rel'),
+                                 download_href.get_attribute('digest'), driver.current_url, javascript_time, timeout,
+                                 verbose, portal_session)
+
+
+def download_attached_pdf(http_session, directory, name, portal_base, cid, digest, referer, javascript_time,
+                          timeout=20, verbose=False, portal_session=None):
+    """
+    Save a PDF docket attachment within a case, without using the browser. Can be run in another thread.
+    :param http_session: (requests.Session, Cookie header) from PortalSession.get_http_session()
+    :param directory: Directory to save attachment
+    :param name: Name for PDF
+    :param portal_base: Base URL for the portal. Eg: 'https://court.baycoclerk.com/BenchmarkWeb2/'
+    :param cid: 'rel' attribute of the attachment's download link
+    :param digest: 'digest' attribute of the attachment's download link
+    :param referer: URL of the case page the attachment is on
+    :param javascript_time: The browser's String(new Date()), which is embedded in the request for the attachment.
+    :param timeout: Time before aborting HTTP requests
+    :param verbose: Print HTTP GET/POSTs for debugging
+    :param portal_session: PortalSession the cookies came from, reset if the portal refuses them.
+    :return: True (Success), False (Failure).
+    """
+    s, cookie_header = http_session
+    host = portal_base.split('/')[2]
 
     # Attempt to make the same HTTP requests as the website would, to be more stealthy ;)
-    cid = download_href.get_attribute('rel')
-    digest = download_href.get_attribute('digest')
-
     try:
         """
         This section does a GET request for PDFViewer2. 
@@ -255,7 +450,7 @@ def save_attached_pdf(driver, directory, name, portal_base, download_href, timeo
         # GET for PDFViewer2 with cid and digest
         get_PDFViewer2 = requests.Request('GET', get_PDFViewer2_url, headers={
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-            'Referer': driver.current_url,
+            'Referer': referer,
             'Upgrade-Insecure-Requests': '1',
             'Cookie': cookie_header
         })
@@ -272,8 +467,8 @@ def save_attached_pdf(driver, directory, name, portal_base, download_href, timeo
         """
         This section does a POST for the attachment's access GUID
         """
-        javascript_time = driver.execute_script('return String(new Date())').replace(' ', '+')
-        # Get the Javascript time formatting, as this is embedded in the POST url.
+        # The Javascript time formatting is embedded in the POST url.
+        javascript_time = javascript_time.replace(' ', '+')
         post_getPDFRequestGuid_url = '{}ImageAsync.aspx/GetPDFRequestGuid?cid={}&digest={}&time={}&redacted={}'.format(portal_base, cid, digest, javascript_time, False)
         post_getPDFRequestGuid = requests.Request('POST', post_getPDFRequestGuid_url, headers={
             'Accept': '*/*',
@@ -321,6 +516,9 @@ def save_attached_pdf(driver, directory, name, portal_base, download_href, timeo
                 return False
     except HTTPError as http_err:
         print('HTTP error occurred while downloading attachment {}: {}'.format(name, http_err))
+        # The session may have expired, so copy it from Selenium again next time.
+        if portal_session is not None:
+            portal_session.reset_http_session()
         return False
     except Timeout:
         print('HTTP request/response timed out while downloading attachment {}'.format(name))
@@ -355,10 +553,13 @@ def parse_out_path(directory, filename, extension):
 def get_associated_cases(driver):
     """
     When a  case number is associated with multiple cases, the search portal returns all those cases.
-    This function returns all the associated case numbers.
+    This function returns all the associated case numbers, along with the link to open each case from the results.
     :param driver: Selenium driver
-    :return: A set of case numbers
+    :return: A dict of case number to case details URL. The URL is None if the case has no link in the results table.
     """
     elems = driver.find_elements_by_class_name('sorting_1')
-    case_nums = set([e.text for e in elems])
-    return case_nums
+    case_links = {}
+    for e in elems:
+        links = e.find_elements_by_tag_name('a')
+        case_links[e.text] = links[0].get_attribute('href') if len(links) > 0 else None
+    return case_links
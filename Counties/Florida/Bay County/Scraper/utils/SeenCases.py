@@ -0,0 +1,142 @@
+import os
+import csv
+
+from utils import CompressedCsv
+
+
+class SeenCases:
+    """
+    Run-wide set of portal case IDs which have already been scraped, so associated cases found more than once are not
+    searched for or scraped again. Persisted to a file (one PortalID per line) so it carries over between runs.
+    The cases each search found are saved to a second file (case number, then the PortalIDs found, tab separated), so a
+    search is only skipped once every case it finds has been scraped.
+    """
+
+    def __init__(self, seen_file, output_file=None, searches_file=None):
+        """
+        :param seen_file: Path to the file the set is saved in.
+        :param output_file: Scraper output CSV. Used to build the set the first time if seen_file does not exist yet.
+        :param searches_file: Path to the file searches are saved in. Defaults to seen_file with a .searches extension.
+        """
+        self.seen_file = seen_file
+        self.searches_file = searches_file or '{}.searches'.format(os.path.splitext(seen_file)[0])
+        self.portal_ids = set()
+        # Case number searched (YYNNNNNN) to the PortalIDs the search found
+        self.searches = {}
+        # Cases which have been read from the portal, but are still waiting to be written to the output
+        self.pending = set()
+        self.searches_saved = 0
+        self.scrapes_saved = 0
+
+        if os.path.isfile(seen_file):
+            with open(seen_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._remember(line.strip())
+        elif output_file is not None and os.path.isfile(output_file):
+            if CompressedCsv.compression_for(output_file):
+                output = CompressedCsv.open_text(output_file)
+            else:
+                output = open(output_file, 'r', encoding='utf-8', newline='')
+            with output as f:
+                reader = csv.reader(f)
+                header = next(reader, [])
+                portal_id_col = header.index('PortalID') if 'PortalID' in header else 3
+                for row in reader:
+                    if len(row) > portal_id_col:
+                        self._remember(row[portal_id_col])
+            with open(seen_file, 'w', encoding='utf-8') as f:
+                f.writelines('{}\n'.format(portal_id) for portal_id in sorted(self.portal_ids))
+
+        if os.path.isfile(self.searches_file):
+            with open(self.searches_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 1:
+                        self.searches[fields[0]] = frozenset(fields[1:])
+
+    def _remember(self, portal_id):
+        if portal_id:
+            self.portal_ids.add(portal_id)
+
+    def __contains__(self, portal_id):
+        return portal_id in self.portal_ids
+
+    def __len__(self):
+        return len(self.portal_ids)
+
+    def add(self, portal_id):
+        """
+        Records a case as scraped.
+        :param portal_id: PortalID of the scraped case, eg. '19000123CFMA'
+        """
+        if portal_id not in self.portal_ids:
+            self._remember(portal_id)
+            with open(self.seen_file, 'a', encoding='utf-8') as f:
+                f.write('{}\n'.format(portal_id))
+        # Only once it is seen, so the browser thread never finds the case neither pending nor seen
+        self.pending.discard(portal_id)
+
+    def add_pending(self, portal_id):
+        """
+        Records a case which has been read from the portal but not written yet, so it is not scraped again in the
+        meantime. It is not saved to the seen file until add() is called once the case is written.
+        :param portal_id: PortalID of the case, eg. '19000123CFMA'
+        """
+        if portal_id:
+            self.pending.add(portal_id)
+
+    def discard_pending(self, portal_id):
+        """
+        Forgets a case which was read but could not be written, so it is scraped again if found again.
+        :param portal_id: PortalID of the case, eg. '19000123CFMA'
+        """
+        self.pending.discard(portal_id)
+
+    def add_search(self, case_number, portal_ids):
+        """
+        Records the cases a search found, so the search can be skipped once all of them have been scraped.
+        :param case_number: Case number searched, eg. '19000123'
+        :param portal_ids: PortalIDs the search found. Searches which found nothing are not recorded.
+        """
+        portal_ids = frozenset(portal_ids)
+        if len(portal_ids) == 0 or self.searches.get(case_number) == portal_ids:
+            return
+        self.searches[case_number] = portal_ids
+        with open(self.searches_file, 'a', encoding='utf-8') as f:
+            f.write('{}\t{}\n'.format(case_number, '\t'.join(sorted(portal_ids))))
+
+    def search_done(self, case_number):
+        """
+        Checks if a search for a case number has been done before, and every case it found has been scraped (or is
+        waiting to be written). Counts a saved search if so.
+        :param case_number: Case number to search, eg. '19000123'
+        :return: True if the search can be skipped
+        """
+        portal_ids = self.searches.get(case_number)
+        if portal_ids and all(portal_id in self.portal_ids or portal_id in self.pending for portal_id in portal_ids):
+            self.searches_saved += 1
+            return True
+        return False
+
+    def search_written(self, case_number):
+        """
+        :param case_number: Case number searched, eg. '19000123'
+        :return: True if the search found cases, and every one of them has been written (not only read).
+        """
+        portal_ids = self.searches.get(case_number)
+        return bool(portal_ids) and all(portal_id in self.portal_ids for portal_id in portal_ids)
+
+    def scrape_done(self, portal_id):
+        """
+        Checks if a case has already been scraped. Counts a saved scrape if so.
+        :param portal_id: PortalID of the case, eg. '19000123CFMA'
+        :return: True if the case can be skipped
+        """
+        if portal_id in self.portal_ids or portal_id in self.pending:
+            self.scrapes_saved += 1
+            return True
+        return False
+
+    def summary(self):
+        return '{} cases seen. Skipped {} searches and {} case scrapes of already scraped cases.'.format(
+            len(self.portal_ids), self.searches_saved, self.scrapes_saved)
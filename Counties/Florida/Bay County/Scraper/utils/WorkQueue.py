@@ -0,0 +1,373 @@
+import sys
+import json
+import time
+import getopt
+import sqlite3
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+# Work unit statuses
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+# Units after the last case of a year, which don't need scraping.
+SKIPPED = 'skipped'
+# Units which were leased max_attempts times without being completed (eg. a case in them crashes every node)
+FAILED = 'failed'
+
+# Case numbers are 6 digits (YYNNNNNN)
+MAX_CASE_NUMBER = 999999
+
+# Errors talking to the work queue which may pass, eg. the server is restarting or the database is locked
+TRANSIENT_ERRORS = (requests.RequestException, sqlite3.OperationalError)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS work_units (
+    id INTEGER PRIMARY KEY,
+    year INTEGER NOT NULL,
+    first_case INTEGER NOT NULL,
+    last_case INTEGER NOT NULL,
+    next_case INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    node TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    finished_at REAL,
+    UNIQUE (year, first_case)
+)
+'''
+
+
+class WorkQueue:
+    """
+    Queue of (year, case range) work units for scraper nodes, stored in SQLite.
+    A node leases a unit for a limited time and renews the lease with heartbeats as it scrapes. If a node dies, its lease
+    expires and the unit is handed to another node, which continues from the last case the first node reported.
+    The SQLite file can be shared by scrapers on one host, or served to other hosts with WorkQueueServer.
+    """
+
+    def __init__(self, db_file, clock=time.time, max_attempts=5):
+        """
+        :param db_file: Path to the SQLite database. Created if it does not exist.
+        :param clock: Function returning the current time in seconds
+        :param max_attempts: Times a unit is leased without being completed before it is marked failed and no longer
+        handed out
+        """
+        self.db_file = db_file
+        self.clock = clock
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_file, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __transaction__(self, func):
+        # BEGIN IMMEDIATE takes the write lock up front, so two nodes can't lease the same unit.
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                result = func()
+                self.db.execute('COMMIT')
+                return result
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+
+    def add_years(self, start_year, end_year, cases_per_unit=500, max_case=20000):
+        """
+        Splits years into work units of case number ranges. Units which already exist are left unchanged.
+        :param start_year: Earliest year to scrape (inclusive)
+        :param end_year: Latest year to scrape (inclusive)
+        :param cases_per_unit: Number of case numbers in each unit
+        :param max_case: Highest case number to create units for at first. Units beyond the last case in a year are
+        skipped once a node reaches the end of the year. If a year has more cases, more units are added as its last
+        unit is completed (see complete()).
+        :return: Number of units added
+        """
+        def add():
+            added = 0
+            for year in range(end_year, start_year - 1, -1):
+                for first_case in range(1, max_case + 1, cases_per_unit):
+                    last_case = min(first_case + cases_per_unit - 1, max_case)
+                    cursor = self.db.execute(
+                        'INSERT OR IGNORE INTO work_units (year, first_case, last_case, next_case) VALUES (?, ?, ?, ?)',
+                        (year, first_case, last_case, first_case))
+                    added += cursor.rowcount
+            return added
+        return self.__transaction__(add)
+
+    def acquire(self, node, lease_seconds=300):
+        """
+        Leases the next unit of work, latest year first. Units whose lease has expired are handed out again, unless they
+        have already been leased max_attempts times, in which case they are marked failed.
+        :param node: Name of the node leasing the unit
+        :param lease_seconds: How long the node has to send a heartbeat before the unit is given to another node
+        :return: Dict with id, year, first_case, last_case and next_case (the first case still to scrape), or None if
+        there is no work left.
+        """
+        def acquire():
+            now = self.clock()
+            self.db.execute('UPDATE work_units SET status = ?, node = NULL, lease_expires = NULL '
+                            'WHERE (status = ? OR (status = ? AND lease_expires < ?)) AND attempts >= ?',
+                            (FAILED, PENDING, LEASED, now, self.max_attempts))
+            unit = self.db.execute(
+                'SELECT * FROM work_units WHERE status = ? OR (status = ? AND lease_expires < ?) '
+                'ORDER BY year DESC, first_case LIMIT 1', (PENDING, LEASED, now)).fetchone()
+            if unit is None:
+                return None
+            self.db.execute('UPDATE work_units SET status = ?, node = ?, lease_expires = ?, attempts = attempts + 1 '
+                            'WHERE id = ?', (LEASED, node, now + lease_seconds, unit['id']))
+            return {'id': unit['id'], 'year': unit['year'], 'first_case': unit['first_case'],
+                    'last_case': unit['last_case'], 'next_case': unit['next_case']}
+        return self.__transaction__(acquire)
+
+    def heartbeat(self, unit_id, node, next_case=None, lease_seconds=300):
+        """
+        Renews a lease, and records progress so another node can continue from the same case if this one dies.
+        :param unit_id: ID of the leased unit
+        :param node: Name of the node holding the lease
+        :param next_case: First case number in the unit not yet scraped
+        :param lease_seconds: New lease length from now
+        :return: True if the lease was renewed. False if the lease was lost (eg. it expired and was given to another
+        node), in which case the node should stop working on the unit.
+        """
+        def heartbeat():
+            cursor = self.db.execute(
+                'UPDATE work_units SET lease_expires = ?, next_case = COALESCE(?, next_case) '
+                'WHERE id = ? AND node = ? AND status = ?',
+                (self.clock() + lease_seconds, next_case, unit_id, node, LEASED))
+            return cursor.rowcount == 1
+        return self.__transaction__(heartbeat)
+
+    def release(self, unit_id, node, stopped=False):
+        """
+        Gives up a lease before it expires (eg. the node failed or is being stopped), so the unit can be handed to another
+        node straight away. The next node continues from the last case reported in a heartbeat.
+        :param unit_id: ID of the leased unit
+        :param node: Name of the node holding the lease
+        :param stopped: True if the node was asked to stop rather than failing, so the lease does not count towards the
+        unit's max_attempts.
+        :return: True if the unit was released, False if the lease had already been lost.
+        """
+        def release():
+            cursor = self.db.execute(
+                'UPDATE work_units SET status = ?, node = NULL, lease_expires = NULL, attempts = attempts - ? '
+                'WHERE id = ? AND node = ? AND status = ?', (PENDING, 1 if stopped else 0, unit_id, node, LEASED))
+            return cursor.rowcount == 1
+        return self.__transaction__(release)
+
+    def complete(self, unit_id, node, end_of_year=False):
+        """
+        Marks a unit as done. If it was the last unit of its year and the node did not find the end of the year, a unit
+        for the next range of case numbers is added, so years with more cases than add_years created units for are
+        still scraped to the end.
+        :param unit_id: ID of the leased unit
+        :param node: Name of the node holding the lease
+        :param end_of_year: True if the node found the last case of the year in this unit. Later units for the year are
+        skipped.
+        :return: True if the unit was completed, False if the lease had been lost.
+        """
+        def complete():
+            cursor = self.db.execute(
+                'UPDATE work_units SET status = ?, next_case = last_case + 1, lease_expires = NULL, finished_at = ? '
+                'WHERE id = ? AND node = ? AND status = ?', (DONE, self.clock(), unit_id, node, LEASED))
+            if cursor.rowcount != 1:
+                return False
+            unit = self.db.execute('SELECT year, first_case, last_case FROM work_units WHERE id = ?',
+                                   (unit_id,)).fetchone()
+            if end_of_year:
+                self.db.execute('UPDATE work_units SET status = ? WHERE year = ? AND first_case > ? AND status = ?',
+                                (SKIPPED, unit['year'], unit['last_case'], PENDING))
+                return True
+            # Units are skipped once the end of the year is found, so don't extend a year which has any
+            later = self.db.execute('SELECT COUNT(*) FROM work_units WHERE year = ? AND (first_case > ? OR status = ?)',
+                                    (unit['year'], unit['last_case'], SKIPPED)).fetchone()[0]
+            if later == 0 and unit['last_case'] < MAX_CASE_NUMBER:
+                first_case = unit['last_case'] + 1
+                last_case = min(first_case + unit['last_case'] - unit['first_case'], MAX_CASE_NUMBER)
+                self.db.execute(
+                    'INSERT OR IGNORE INTO work_units (year, first_case, last_case, next_case) VALUES (?, ?, ?, ?)',
+                    (unit['year'], first_case, last_case, first_case))
+            return True
+        return self.__transaction__(complete)
+
+    def status(self):
+        """
+        :return: Dict of status to number of units
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT status, COUNT(*) FROM work_units GROUP BY status').fetchall()
+        return {status: count for status, count in rows}
+
+    def available(self):
+        """
+        :return: Number of units which acquire() could hand out now: pending units, and leased units whose lease expired.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT COUNT(*) FROM work_units WHERE status = ? OR (status = ? AND lease_expires < ?)',
+                                  (PENDING, LEASED, self.clock())).fetchone()
+        return row[0]
+
+    def progress(self):
+        """
+        :return: Number of case numbers scraped so far, counted from the progress reported in heartbeats.
+        """
+        with self.lock:
+            row = self.db.execute('SELECT COALESCE(SUM(next_case - first_case), 0) FROM work_units WHERE status != ?',
+                                  (SKIPPED,)).fetchone()
+        return row[0]
+
+
+class RemoteWorkQueue:
+    """Client for a WorkQueue served by WorkQueueServer, with the same methods as WorkQueue for scraper nodes."""
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def __request__(self, method, **params):
+        response = self.session.post('{}/{}'.format(self.url, method), json=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['result']
+
+    def acquire(self, node, lease_seconds=300):
+        return self.__request__('acquire', node=node, lease_seconds=lease_seconds)
+
+    def heartbeat(self, unit_id, node, next_case=None, lease_seconds=300):
+        return self.__request__('heartbeat', unit_id=unit_id, node=node, next_case=next_case,
+                                lease_seconds=lease_seconds)
+
+    def release(self, unit_id, node, stopped=False):
+        return self.__request__('release', unit_id=unit_id, node=node, stopped=stopped)
+
+    def complete(self, unit_id, node, end_of_year=False):
+        return self.__request__('complete', unit_id=unit_id, node=node, end_of_year=end_of_year)
+
+    def status(self):
+        return self.__request__('status')
+
+
+class WorkQueueServer(ThreadingHTTPServer):
+    """
+    Serves a WorkQueue over HTTP, so scraper nodes on other hosts can share it.
+    Each method is a POST to /<method> with its arguments as a JSON object, and returns {"result": ...}.
+    """
+    METHODS = {'acquire', 'heartbeat', 'release', 'complete', 'status'}
+
+    def __init__(self, work_queue, address=('0.0.0.0', 8765)):
+        self.work_queue = work_queue
+        super().__init__(address, WorkQueueRequestHandler)
+
+
+class WorkQueueRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        method = self.path.strip('/')
+        if method not in WorkQueueServer.METHODS:
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            params = json.loads(self.rfile.read(length) or b'{}')
+            result = getattr(self.server.work_queue, method)(**params)
+        except (ValueError, TypeError) as err:
+            self.send_error(400, str(err))
+            return
+        except sqlite3.Error as err:
+            # Eg. the database is locked for longer than the timeout. The node can try again later.
+            self.send_error(500, 'Work queue error: {}'.format(err))
+            return
+        body = json.dumps({'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def with_retries(func, *args, retries=5, base_delay=1, sleep=time.sleep):
+    """
+    Calls a work queue method, retrying with exponential backoff if the work queue can't be reached.
+    :param func: Work queue method, eg. work_queue.heartbeat
+    :param args: Arguments for func
+    :param retries: Times to retry before raising the error
+    :param base_delay: Seconds to wait before the first retry. Doubled for each retry after.
+    :param sleep: Function to wait a number of seconds
+    :return: Result of func
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except TRANSIENT_ERRORS as err:
+            if attempt >= retries:
+                raise
+            delay = base_delay * 2 ** attempt
+            attempt += 1
+            print('Work queue error, retrying in {}s ({}/{}): {}'.format(delay, attempt, retries, err),
+                  file=sys.stderr)
+            sleep(delay)
+
+
+def open_work_queue(location):
+    """
+    :param location: URL of a WorkQueueServer, or path to a shared SQLite file
+    :return: RemoteWorkQueue or WorkQueue
+    """
+    if location.startswith('http://') or location.startswith('https://'):
+        return RemoteWorkQueue(location)
+    return WorkQueue(location)
+
+
+def main():
+    args = sys.argv[1:]
+    short_args = 'y:e:n:m:sp:'
+    long_args = ['start-year=', 'end-year=', 'cases-per-unit=', 'max-case=', 'serve', 'port=']
+    try:
+        opts, paths = getopt.getopt(args, short_args, long_args)
+    except getopt.error as err:
+        print("Unable to read arguments.", str(err), file=sys.stderr)
+        sys.exit(2)
+    if len(paths) != 1:
+        print('Usage: python -m utils.WorkQueue [-y start-year -e end-year] [-n cases-per-unit] [-m max-case] '
+              '[-s] [-p port] work-queue.sqlite', file=sys.stderr)
+        sys.exit(2)
+
+    start_year = end_year = None
+    cases_per_unit = 500
+    max_case = 20000
+    serve = False
+    port = 8765
+    for arg, val in opts:
+        if arg in ('-y', '--start-year'):
+            start_year = int(val)
+        elif arg in ('-e', '--end-year'):
+            end_year = int(val)
+        elif arg in ('-n', '--cases-per-unit'):
+            cases_per_unit = int(val)
+        elif arg in ('-m', '--max-case'):
+            max_case = int(val)
+        elif arg in ('-s', '--serve'):
+            serve = True
+        elif arg in ('-p', '--port'):
+            port = int(val)
+
+    work_queue = WorkQueue(paths[0])
+    if start_year is not None and end_year is not None:
+        print('Added {} work units'.format(work_queue.add_years(start_year, end_year, cases_per_unit, max_case)))
+    print(work_queue.status())
+    if serve:
+        print('Serving work queue on port {}'.format(port))
+        WorkQueueServer(work_queue, ('0.0.0.0', port)).serve_forever()
+
+
+if __name__ == '__main__':
+    main()